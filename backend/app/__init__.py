@@ -10,17 +10,30 @@ import pytz
 from datetime import datetime
 import logging
 import ipaddress
+import sys
 
 # Explicitly load .env from the project root
 dotenv_path = Path(__file__).resolve().parent.parent.parent / '.env'
 load_dotenv(dotenv_path=dotenv_path)
 
+def _in_cli_command():
+    """True when create_app runs for a `flask <command>` other than `flask run`."""
+    try:
+        import click
+        if click.get_current_context(silent=True) is None:
+            return False
+    except Exception:
+        return False
+    return 'run' not in sys.argv[1:]
+
+
 def create_app():
     app = Flask(__name__)
     # Ensure SECRET_KEY is a string; default for local/dev if not set
     app.config["SECRET_KEY"] = os.getenv("SECRET_KEY", "dev-secret")
     # Allow all origins for /api routes so that different hosts/IPs can call the API
-    CORS(app, resources={r"/api/*": {"origins": "*"}})
+    CORS(app, resources={r"/api/*": {"origins": "*"}},
+         expose_headers=["ETag", "Content-Location", "X-TTS-Key"])
 
     # MongoDB Configuration
     mongo_uri = os.getenv("MONGO_URI")
@@ -42,6 +55,23 @@ def create_app():
     # Get database from client using the name from .env
     app.db = client[db_name]
 
+    from .study_events import ensure_study_events_collection
+    from .review_schedule import ensure_review_schedule_indexes
+    from .streaks import ensure_streak_indexes
+    from .dictionary_index import ensure_dictionary_indexes
+    from .word_tags import ensure_word_tags_indexes
+    from .ai_cache import ensure_ai_cache_indexes
+    from .generation_jobs import ensure_generation_job_indexes
+    from .word_forms import ensure_word_forms_indexes
+    ensure_study_events_collection(app.db)
+    ensure_review_schedule_indexes(app.db)
+    ensure_streak_indexes(app.db)
+    ensure_dictionary_indexes(app.db)
+    ensure_word_tags_indexes(app.db)
+    ensure_ai_cache_indexes(app.db)
+    ensure_generation_job_indexes(app.db)
+    ensure_word_forms_indexes(app.db)
+
     from .routes.auth_routes import auth_bp
     from .routes.user_routes import user_bp
     from .routes.class_routes import class_bp
@@ -54,6 +84,7 @@ def create_app():
     from .routes.admin_routes import admin_bp
     from .routes.quiz_routes import quiz_bp
     from .routes.results_routes import results_bp
+    from .session import record_user_doc_usage
 
     app.register_blueprint(auth_bp)
     app.register_blueprint(user_bp)
@@ -69,6 +100,12 @@ def create_app():
     app.register_blueprint(quiz_bp)
     app.register_blueprint(results_bp)
 
+    from .commands import register_commands
+    register_commands(app)
+
+    from .ai_gateway import register_ai_gateway_errors
+    register_ai_gateway_errors(app)
+
     # --- Privacy-friendly access logging ---
     # Suppress Werkzeug default request logs (which include full client IPs)
     try:
@@ -104,17 +141,23 @@ def create_app():
             method = request.method
             status = response.status_code
 
+            # How much of the users collection this request pulled (see app.session)
+            user_doc = ''
+            if hasattr(g, 'current_user') or getattr(g, '_user_doc_queries', 0):
+                queries, size = record_user_doc_usage(request.endpoint)
+                user_doc = f" user_doc={queries}q/{size}B"
+
             # Strict privacy mode: default on; do not log IP/UA
             privacy_strict = os.getenv('PRIVACY_STRICT', 'true').lower() in ('1', 'true', 'yes', 'y')
             if privacy_strict:
-                app.logger.info(f"{method} {path} -> {status} {duration_ms}ms")
+                app.logger.info(f"{method} {path} -> {status} {duration_ms}ms{user_doc}")
             else:
                 # Prefer X-Forwarded-For if present (first IP), else remote_addr
                 xff = request.headers.get('X-Forwarded-For', '')
                 raw_ip = (xff.split(',')[0].strip() if xff else None) or (request.remote_addr or '')
                 ip_masked = _anonymize_ip(raw_ip)
                 ua = (request.user_agent.string or '')[:120]
-                app.logger.info(f"{method} {path} -> {status} {duration_ms}ms ip={ip_masked} ua={ua}")
+                app.logger.info(f"{method} {path} -> {status} {duration_ms}ms{user_doc} ip={ip_masked} ua={ua}")
         except Exception:
             # Never fail the response due to logging errors
             pass
@@ -143,10 +186,32 @@ def create_app():
                     pass
                 time.sleep(30)
 
+    # --- Background scheduler: nightly maintenance (streak roll, missed reviews) ---
+    # Every web worker polls; the leased app_meta 'nightly:<date>' claim makes sure
+    # one runs it per day. CLI commands do not poll: a short-lived process could
+    # claim the day and exit.
+    def _nightly_maintenance_loop(flask_app):
+        from .maintenance import maybe_run_nightly
+        with flask_app.app_context():
+            while True:
+                try:
+                    summary = maybe_run_nightly(flask_app.db)
+                    if summary is not None:
+                        flask_app.logger.info(f"nightly maintenance: {summary}")
+                except Exception:
+                    pass
+                time.sleep(300)
+
     try:
         t = threading.Thread(target=_quiz_publisher_loop, args=(app,), daemon=True)
         t.start()
     except Exception:
         pass
+    if not _in_cli_command():
+        try:
+            t = threading.Thread(target=_nightly_maintenance_loop, args=(app,), daemon=True)
+            t.start()
+        except Exception:
+            pass
 
     return app
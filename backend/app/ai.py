@@ -1,17 +1,24 @@
 import os
+import re
 import json
+import time
 from flask import Blueprint, request, jsonify, current_app, g
-from openai import OpenAI
 from functools import wraps
 from bson.objectid import ObjectId
 from .decorators import token_required
+from .ai_cache import cache_enabled, cache_key, cache_get, cache_put, count_bypass
+from .ai_gateway import AIGatewayError, PRIORITY_GRADING, PRIORITY_INTERACTIVE, PRIORITY_GENERATION
+from .ai_resilience import build_ai_client, chat_completion
+from .ai_batch import run_batched
+from .ai_telemetry import record_ai_call, usage_tokens
+from .word_forms import local_fill_blank_verdict, local_fill_blank_feedback, count_grading_path
 
 # --- AI Blueprint Setup ---
 ai_bp = Blueprint('ai_bp', __name__)
 
 # --- OpenAI Client Initialization ---
 try:
-    client = OpenAI(
+    client = build_ai_client(
         api_key=os.getenv("DEEPSEEK_API_KEY"),
         base_url=os.getenv("DEEPSEEK_API_BASE_URL", "https://api.deepseek.com")
     )
@@ -24,7 +31,7 @@ except Exception as e:
 
 # --- AI Core Function ---
 
-def call_deepseek_api(user_prompt: str, user_id: ObjectId, system_prompt: str = "You are a helpful assistant.", expect_json: bool = False, model: str = "deepseek-chat"):
+def call_deepseek_api(user_prompt: str, user_id: ObjectId, system_prompt: str = "You are a helpful assistant.", expect_json: bool = False, model: str = "deepseek-chat", cache: str = None, bypass_cache: bool = False, priority: int = PRIORITY_INTERACTIVE, site: str = None, validate=None):
     """
     A generic function to call the DeepSeek API and increment the user's call count.
     
@@ -33,9 +40,31 @@ def call_deepseek_api(user_prompt: str, user_id: ObjectId, system_prompt: str =
     :param system_prompt: The system message to set the AI's role.
     :param expect_json: Whether to request a JSON response.
     :param model: The model to use for the API call.
+    :param cache: Call-site name from ai_cache.CACHE_POLICIES; identical prompts are answered from the cache.
+    :param bypass_cache: Skip the cache lookup (a fresh answer still replaces the cached one).
+    :param priority: ai_gateway priority class for the upstream call.
+    :param site: Call-site name for telemetry (defaults to cache).
+    :param validate: Check on the parsed reply (the raw text unless expect_json); only replies it accepts are cached.
     :return: The content of the AI's response.
+    :raises AIGatewayError: If the gateway rejects the call (rate limit, full queue, queue timeout).
     :raises RuntimeError: If the AI client is not initialized or the API call fails.
     """
+    site = site or cache
+    key = None
+    cache_state = None
+    if cache and cache_enabled(cache):
+        key = cache_key(model, system_prompt, user_prompt, expect_json)
+        if bypass_cache:
+            count_bypass(cache)
+            cache_state = 'bypass'
+        else:
+            cached = cache_get(current_app.db, cache, key)
+            if cached is not None:
+                # No upstream call was made, so ai_calls is left alone
+                record_ai_call(site=site, model=model, cache='hit')
+                return cached
+            cache_state = 'miss'
+
     if not CLIENT_INITIALIZED or client is None:
         raise RuntimeError("AI client is not initialized. Please check environment variables.")
 
@@ -46,44 +75,83 @@ def call_deepseek_api(user_prompt: str, user_id: ObjectId, system_prompt: str =
     
     response_format = {"type": "json_object"} if expect_json else None
 
+    started = time.monotonic()
+    attempts = {}
     try:
-        print(f"--- [AI CALL] User: {user_id}, Model: {model} ---")
-        response = client.chat.completions.create(
+        response = chat_completion(
+            client,
+            user_id=user_id,
+            priority=priority,
+            stats=attempts,
             model=model,
             messages=messages,
             stream=False,
             response_format=response_format
         )
-        print(f"--- [AI SUCCESS] API call for user {user_id} successful. ---")
-        
+        latency_ms = (time.monotonic() - started) * 1000
+
         # Increment user's AI call count on successful API call
-        update_result = current_app.db.users.update_one(
+        current_app.db.users.update_one(
             {'_id': user_id},
             {'$inc': {'ai_calls': 1}}
         )
-        
-        if update_result.modified_count == 0:
-            print(f"--- [DB WARNING] Failed to increment ai_calls for user {user_id}. User not found or count not updated. ---")
-        else:
-            print(f"--- [DB SUCCESS] Incremented ai_calls for user {user_id}. ---")
 
         ai_response_content = response.choices[0].message.content
-        print(f"--- [AI RESPONSE] For User {user_id}: {ai_response_content} ---")
+        prompt_tokens, completion_tokens = usage_tokens(response)
+        record_ai_call(site=site, model=model, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                       latency_ms=latency_ms, retries=attempts.get('attempts', 1) - 1, cache=cache_state)
+        if key and _cacheable(ai_response_content, expect_json, validate):
+            cache_put(current_app.db, cache, key, model, ai_response_content)
         return ai_response_content
+    except AIGatewayError:
+        record_ai_call(site=site, model=model, cache=cache_state, outcome='rejected')
+        raise
     except Exception as e:
+        latency_ms = (time.monotonic() - started) * 1000
+        record_ai_call(site=site, model=model, latency_ms=latency_ms, retries=max(0, attempts.get('attempts', 1) - 1),
+                       cache=cache_state, outcome='error')
         current_app.logger.error(f"DeepSeek API call failed for user {user_id}: {e}")
         raise RuntimeError(f"DeepSeek API call failed: {e}")
 
 
+def _cacheable(content, expect_json, validate=None):
+    if not isinstance(content, str) or not content.strip():
+        return False
+    parsed = content
+    if expect_json:
+        try:
+            parsed = json.loads(content)
+        except Exception:
+            return False
+    if validate is not None:
+        try:
+            return bool(validate(parsed))
+        except Exception:
+            return False
+    return True
+
+
+def _has_keys(*keys):
+    """validate= check for a JSON object reply carrying all of keys."""
+    return lambda data: isinstance(data, dict) and all(k in data for k in keys)
+
+
 # --- AI Grading Functions ---
 
 def _fill_blank_score_ai(prompt_sentence: str, user_answer: str, target_word: str, user_id: ObjectId) -> dict:
     """
     Grades a fill-in-the-blank question using AI, providing detailed explanation.
-    Returns dict with keys: is_correct (bool), feedback (str).
+    Exact answers and clearly wrong ones (empty, another dictionary word) are
+    settled locally from the word_forms table without calling the model.
+    Returns dict with keys: is_correct (bool), feedback (str), grading_path (str).
     """
-    if len(user_answer or "") == 0:
-        return {"is_correct": False, "feedback": "🥲🥲🥲🥲🥲"}
+    verdict = local_fill_blank_verdict(current_app.db, user_answer, target_word)
+    if verdict is not None:
+        reason, is_correct, other = verdict
+        count_grading_path(f'local_{reason}')
+        feedback = "🥲🥲🥲🥲🥲" if reason == 'empty' else local_fill_blank_feedback(reason, user_answer, target_word, other)
+        return {"is_correct": is_correct, "feedback": feedback, "grading_path": f'local_{reason}'}
+    count_grading_path('ai')
 
     user_prompt = (
         "You are a strict but fair English teacher grading a fill-in-the-blank quiz. "
@@ -106,23 +174,29 @@ def _fill_blank_score_ai(prompt_sentence: str, user_answer: str, target_word: st
             user_id=user_id,
             system_prompt="You are a helpful assistant.",
             expect_json=True,
+            cache='grade_fill_blank',
+            priority=PRIORITY_GRADING,
+            validate=_has_keys('is_correct', 'feedback')
         )
         data = json.loads(response_str)
         if not isinstance(data, dict) or 'is_correct' not in data or 'feedback' not in data:
             raise json.JSONDecodeError("missing keys", response_str, 0)
-        return {"is_correct": bool(data.get('is_correct')), "feedback": str(data.get('feedback') or '').strip()}
+        return {"is_correct": bool(data.get('is_correct')), "feedback": str(data.get('feedback') or '').strip(), "grading_path": 'ai'}
+    except AIGatewayError:
+        # Let the caller answer 429/503 instead of marking the answer wrong
+        raise
     except Exception as e:
         current_app.logger.error(f"AI fill-in-the-blank grading failed for answer '{user_answer}': {e}")
-        return {"is_correct": False, "feedback": "Sorry, an error occurred while grading your answer. It has been marked as incorrect."}
+        return {"is_correct": False, "feedback": "Sorry, an error occurred while grading your answer. It has been marked as incorrect.", "grading_path": 'ai'}
 
 
 def grade_fill_in_the_blank(sentence: str, student_answer: str, correct_answer: str, user_id: ObjectId):
     """
     Wrapper to use the new explanation-based fill-in-the-blank grader.
-    Returns a tuple (is_correct: bool, feedback: str).
+    Returns a tuple (is_correct: bool, feedback: str, grading_path: str).
     """
     data = _fill_blank_score_ai(sentence, student_answer, correct_answer, user_id)
-    return bool(data.get('is_correct')), data.get('feedback') or ''
+    return bool(data.get('is_correct')), data.get('feedback') or '', data.get('grading_path') or 'ai'
 
 
 def grade_translation(chinese_sentence: str, student_translation: str, target_word: str, user_id: ObjectId):
@@ -160,10 +234,15 @@ def grade_translation(chinese_sentence: str, student_translation: str, target_wo
             user_prompt=user_prompt,
             system_prompt=system_prompt,
             expect_json=True,
-            user_id=user_id
+            user_id=user_id,
+            cache='grade_translation',
+            priority=PRIORITY_GRADING,
+            validate=_has_keys('score', 'feedback')
         )
         response_data = json.loads(response_str)
         return response_data.get('score', 0), response_data.get('feedback', '获取反馈失败。')
+    except AIGatewayError:
+        raise
     except (RuntimeError, json.JSONDecodeError) as e:
         current_app.logger.error(f"AI translation grading failed for user {user_id}: {e}")
         return 0, "AI评分服务当前不可用，本题未评分。"
@@ -200,7 +279,10 @@ def _sentence_score_ai(word: str, sentence: str, definition: str, user_id: Objec
         user_prompt=full_prompt,
         user_id=user_id,
         system_prompt=SYSTEM_PROMPT,
-        expect_json=True
+        expect_json=True,
+        cache='sentence_score',
+        priority=PRIORITY_GRADING,
+        validate=_has_keys('score', 'feedback')
     )
     data = json.loads(response_str)
     # Consolidate feedback fields if present
@@ -244,6 +326,8 @@ def test_chat():
     try:
         ai_message = call_deepseek_api(user_prompt=user_content, user_id=user_id)
         return jsonify({'response': ai_message})
+    except AIGatewayError:
+        raise
     except RuntimeError as e:
         return jsonify({'message': '调用AI服务时发生错误。', 'error': str(e)}), 500
     except Exception as e:
@@ -287,11 +371,16 @@ def explain_reordering():
             user_prompt=user_prompt,
             user_id=user_id,
             system_prompt=system_prompt,
-            expect_json=True
+            expect_json=True,
+            cache='explain_reordering',
+            priority=PRIORITY_GRADING,
+            validate=_has_keys('explanation')
         )
         data = json.loads(response_str)
         explanation = data.get('explanation') or '解析暂不可用，请稍后重试。'
         return jsonify({'explanation': explanation})
+    except AIGatewayError:
+        raise
     except Exception as e:
         current_app.logger.error(f"Explain reordering failed: {e}")
         return jsonify({'explanation': '解析服务暂不可用，请稍后重试。'}), 200
@@ -303,7 +392,7 @@ def grade_fill_blank_endpoint():
     """
     Grade a fill-in-the-blank answer.
     Expects JSON: { sentence: str, answer: str, correct_answer: str }
-    Returns: { is_correct: bool, feedback: str }
+    Returns: { is_correct: bool, feedback: str, grading_path: str }
     """
     data = request.get_json(force=True) or {}
     sentence = (data.get('sentence') or '').strip()
@@ -313,12 +402,14 @@ def grade_fill_blank_endpoint():
         return jsonify({'error': 'missing required fields'}), 400
     try:
         user_id = g.current_user['_id']
-        ok, fb = grade_fill_in_the_blank(sentence, answer, correct, user_id)
-        return jsonify({'is_correct': bool(ok), 'feedback': fb}), 200
+        ok, fb, path = grade_fill_in_the_blank(sentence, answer, correct, user_id)
+        return jsonify({'is_correct': bool(ok), 'feedback': fb, 'grading_path': path}), 200
+    except AIGatewayError:
+        raise
     except Exception as e:
         current_app.logger.error(f"grade-fill-blank failed: {e}")
         simple_ok = answer.lower().strip() == correct.lower()
-        return jsonify({'is_correct': simple_ok, 'feedback': '已采用简易规则判分。'}), 200
+        return jsonify({'is_correct': simple_ok, 'feedback': '已采用简易规则判分。', 'grading_path': 'fallback'}), 200
 
 
 @ai_bp.route('/api/ai/fill-in-blank-score', methods=['POST'])
@@ -333,11 +424,13 @@ def fill_in_blank_score_alias():
         return jsonify({'error': 'missing required fields'}), 400
     try:
         user_id = g.current_user['_id']
-        ok, fb = grade_fill_in_the_blank(prompt, answer, word, user_id)
-        return jsonify({'correct': bool(ok), 'feedback': fb}), 200
+        ok, fb, path = grade_fill_in_the_blank(prompt, answer, word, user_id)
+        return jsonify({'correct': bool(ok), 'feedback': fb, 'grading_path': path}), 200
+    except AIGatewayError:
+        raise
     except Exception:
         simple_ok = answer.lower().strip() == word.lower()
-        return jsonify({'correct': simple_ok, 'feedback': '已采用简易规则判分。'}), 200
+        return jsonify({'correct': simple_ok, 'feedback': '已采用简易规则判分。', 'grading_path': 'fallback'}), 200
 
 
 @ai_bp.route('/sentence-score', methods=['POST'])
@@ -353,6 +446,8 @@ def ai_sentence_score():
         user_id = g.current_user['_id']
         result = _sentence_score_ai(word, sentence, definition, user_id)
         return jsonify(result), 200
+    except AIGatewayError:
+        raise
     except Exception as e:
         current_app.logger.exception("internal error during AI scoring")
         return jsonify(error="internal scoring error"), 500
@@ -372,12 +467,88 @@ def sentence_score():
         user_id = g.current_user['_id']
         res = _sentence_score_ai(word, sentence, definition, user_id)
         return jsonify({'score': res.get('score', 0), 'feedback': res.get('feedback', '')}), 200
+    except AIGatewayError:
+        raise
     except Exception as e:
         current_app.logger.exception("internal error during AI scoring")
         # Return 500 so client can retry per policy
         return jsonify({'error': 'internal scoring error'}), 500
 
 
+def _fill_blank_prompt(specs):
+    lines = []
+    for sp in specs:
+        if sp.get('definition'):
+            lines.append(json.dumps({'word': sp['word'], 'definition': sp['definition']}, ensure_ascii=False))
+        elif sp.get('pos'):
+            lines.append(json.dumps({'word': sp['word'], 'pos': sp['pos']}, ensure_ascii=False))
+        else:
+            lines.append(json.dumps({'word': sp['word']}, ensure_ascii=False))
+    return (
+        "For each word below (one JSON object per line), create a single, clear sentence that uses the word "
+        "according to the given definition, or as the given part of speech, or otherwise its most common meaning, "
+        "with strong context clues for that meaning. "
+        "The word in the sentence must be in its simple form (the exact form provided), so that it is THE ANSWER for the question. "
+        "Then replace the word with '_____'.\n\n"
+        + "\n".join(lines)
+        + "\n\nRespond with JSON {\"items\": [{\"word\": \"<the word exactly as given>\", \"sentence\": \"...\"}]}, "
+        "with exactly one item per word."
+    )
+
+
+def _validate_fill_blank(spec, item):
+    sentence = item.get('sentence')
+    if not isinstance(sentence, str) or '_____' not in sentence:
+        return None
+    # The answer must not leak into the sentence
+    if re.search(r'\b' + re.escape(spec['word']) + r'\b', sentence, re.IGNORECASE):
+        return None
+    return {'sentence': sentence.strip()}
+
+
+def _fill_blanks_batch(data):
+    specs = []
+    for entry in data.get('words') or []:
+        if isinstance(entry, str):
+            entry = {'word': entry}
+        if not isinstance(entry, dict):
+            continue
+        w = (entry.get('word') or '').strip()
+        if w:
+            specs.append({'word': w,
+                          'definition': (entry.get('definition') or '').strip(),
+                          'pos': (entry.get('pos') or '').strip()})
+    if not specs:
+        return jsonify({'error': 'missing words'}), 400
+    try:
+        batch_size = int(data.get('batch_size') or 0) or None
+    except (TypeError, ValueError):
+        batch_size = None
+
+    user_id = g.current_user['_id']
+
+    def call(prompt):
+        return call_deepseek_api(
+            user_prompt=prompt,
+            user_id=user_id,
+            system_prompt="You are a helpful assistant.",
+            expect_json=True,
+            model='deepseek-chat',
+            priority=PRIORITY_GENERATION,
+            site='fill_blanks_batch'
+        )
+
+    results, errors = run_batched(specs, _fill_blank_prompt, call, _validate_fill_blank,
+                                  batch_size=batch_size, log=current_app.logger.warning)
+    items = []
+    for w in dict.fromkeys(sp['word'] for sp in specs):
+        if w in results:
+            items.append({'word': w, 'sentence': results[w]['sentence']})
+        else:
+            items.append({'word': w, 'error': errors.get(w) or 'generation failed'})
+    return jsonify({'items': items}), 200
+
+
 @ai_bp.route('/api/ai/fill-blanks', methods=['POST'])
 @token_required
 def generate_fill_in_blank_sentence():
@@ -387,8 +558,13 @@ def generate_fill_in_blank_sentence():
     Returns: { sentence: str }
 
     Uses five underscores '_____ ' as the blank.
+
+    Batch mode: { words: [str | {word, definition?, pos?}], batch_size?: int }
+    Returns: { items: [{word, sentence} | {word, error}] } in request order.
     """
     data = request.get_json(force=True) or {}
+    if isinstance(data.get('words'), list):
+        return _fill_blanks_batch(data)
     word = (data.get('word') or '').strip()
     definition = (data.get('definition') or '').strip()
     pos = (data.get('pos') or '').strip()
@@ -431,6 +607,8 @@ def generate_fill_in_blank_sentence():
             # Minimal safety fallback if AI returns malformed content
             sentence = "I _____ every day."
         return jsonify({'sentence': sentence}), 200
+    except AIGatewayError:
+        raise
     except json.JSONDecodeError as e:
         current_app.logger.error(f"AI fill-blanks JSON parse error: {e}")
         return jsonify({'error': 'AI响应解析失败。'}), 502
@@ -445,8 +623,9 @@ def ai_definition():
     """
     Generate a definition string for a given word, optionally guided by a hint.
     Prompt is kept identical to the requested format.
-    Expects JSON: { word: str, hint?: str }
+    Expects JSON: { word: str, hint?: str, no_cache?: bool }
     Returns: { definition: str }
+    Repeated requests are served from the AI cache; no_cache asks for a fresh answer.
     """
     data = request.get_json(force=True) or {}
     word = data.get("word")
@@ -486,7 +665,10 @@ def ai_definition():
             user_prompt=prompt,
             user_id=user_id,
             system_prompt="You are an English teaching assistant.",
-            expect_json=True
+            expect_json=True,
+            cache='definition',
+            bypass_cache=bool(data.get('no_cache')),
+            validate=lambda d: isinstance(d, dict) and isinstance(d.get('definition'), str) and bool(d['definition'])
         )
         # Expect JSON like {"definition": "..."}
         data = json.loads(response_str)
@@ -495,6 +677,8 @@ def ai_definition():
             current_app.logger.error(f"AI response for '{word}' malformed: {response_str}")
             return jsonify(error=f"AI response for '{word}' was malformed."), 502
         return jsonify({"definition": definition})
+    except AIGatewayError:
+        raise
     except Exception as e:
         current_app.logger.exception(f"Definition generation failed for '{word}': {e}")
         return jsonify(error="Internal server error."), 500
@@ -0,0 +1,115 @@
+"""
+Batched structured generation: several words per chat completion.
+
+Per-word generation repeated the same long system prompt once per word. Here the
+items are packed into one request that asks for
+    {"items": [{"word": <word exactly as given>, ...fields}]}
+and each returned item is matched back to its word and checked by the caller's
+validate(). Items that come back missing or invalid (or whose whole request
+failed) are retried in smaller chunks, half the size of the one they failed in,
+until they succeed or run out of attempts. Gateway rejections are not retried:
+the gateway has just said there is no room.
+"""
+import json
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .ai_gateway import AIGatewayError
+
+BATCH_SIZE = max(1, int(os.getenv('AI_BATCH_SIZE', '8')))
+# Attempts per word, counting the first one
+MAX_ATTEMPTS = max(1, int(os.getenv('AI_BATCH_MAX_ATTEMPTS', '3')))
+
+
+def _chunks(seq, size):
+    return [seq[i:i + size] for i in range(0, len(seq), size)]
+
+
+def _returned_items(raw):
+    """({word: item}, {lowercased word: item}) from a batched response (str or parsed dict)."""
+    data = json.loads(raw) if isinstance(raw, str) else raw
+    items = data.get('items') if isinstance(data, dict) else data
+    exact, folded = {}, {}
+    for it in (items if isinstance(items, list) else []):
+        if isinstance(it, dict) and isinstance(it.get('word'), str):
+            w = it['word'].strip()
+            exact.setdefault(w, it)
+            folded.setdefault(w.lower(), it)
+    return exact, folded
+
+
+def run_batched(specs, build_prompt, call, validate, batch_size=None, workers=1,
+                max_attempts=MAX_ATTEMPTS, log=None, on_item=None):
+    """
+    Generate one result per spec, batch_size specs per call.
+
+    specs:        list of dicts, each with a distinct 'word'
+    build_prompt: list of specs -> prompt text
+    call:         prompt -> response (JSON text or parsed dict); may raise
+    validate:     (spec, returned item) -> cleaned result, or None if unusable
+    workers:      chunks of one round that may run at the same time
+    on_item:      optional (word, result, error) callback, called on the calling
+                  thread as soon as each word succeeds or finally fails
+
+    Returns {word: result} for successes and {word: error message} for failures.
+    """
+    size = max(1, int(batch_size or BATCH_SIZE))
+    by_word = {}
+    for s in specs:
+        by_word.setdefault(s['word'], s)
+    results = {}
+    errors = {}
+    attempts = {w: 0 for w in by_word}
+    pending = [(c, size) for c in _chunks(list(by_word), size)]
+
+    def run_chunk(words):
+        try:
+            exact, folded = _returned_items(call(build_prompt([by_word[w] for w in words])))
+        except AIGatewayError as e:
+            return {}, {w: str(e) for w in words}, True
+        except Exception as e:
+            if log:
+                log(f"batch of {len(words)} failed: {e}")
+            return {}, {w: f'AI request failed: {e}' for w in words}, False
+        ok, bad = {}, {}
+        for w in words:
+            item = exact.get(w.strip()) or folded.get(w.strip().lower())
+            cleaned = validate(by_word[w], item) if item is not None else None
+            if cleaned is None:
+                bad[w] = 'missing from AI response' if item is None else 'invalid AI response'
+            else:
+                ok[w] = cleaned
+        return ok, bad, False
+
+    def settle(chunk, outcome):
+        words, chunk_size = chunk
+        ok, bad, final = outcome
+        results.update(ok)
+        if on_item:
+            for w, res in ok.items():
+                on_item(w, res, None)
+        retry = []
+        for w, msg in bad.items():
+            attempts[w] += 1
+            if final or attempts[w] >= max_attempts:
+                errors[w] = msg
+                if on_item:
+                    on_item(w, None, msg)
+            else:
+                retry.append(w)
+        if retry:
+            smaller = max(1, int(math.ceil(chunk_size / 2)))
+            pending.extend((c, smaller) for c in _chunks(retry, smaller))
+
+    while pending:
+        round_chunks, pending = pending, []
+        if workers > 1 and len(round_chunks) > 1:
+            with ThreadPoolExecutor(max_workers=min(workers, len(round_chunks))) as ex:
+                futures = {ex.submit(run_chunk, c[0]): c for c in round_chunks}
+                for fut in as_completed(futures):
+                    settle(futures[fut], fut.result())
+        else:
+            for c in round_chunks:
+                settle(c, run_chunk(c[0]))
+    return results, errors
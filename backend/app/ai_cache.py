@@ -0,0 +1,103 @@
+"""
+Content-addressed cache for DeepSeek responses.
+
+Many AI calls repeat exactly: a class typing the same answer to the same quiz
+sentence, or /api/ai/definition for a word defined yesterday. call_deepseek_api
+looks those up here before going upstream. Entries live in `ai_cache`:
+    { _id: sha256(model, system prompt, user prompt, expect_json),
+      site, model, response, hits, created_at, expires_at }
+and a TTL index on expires_at drops them. Caching is opt-in per call site: a
+site is a key of CACHE_POLICIES, which sets how long its answers stay valid.
+Generation sites that want varied output simply don't pass one.
+AI_CACHE_DISABLED=1 turns every lookup and store off.
+"""
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+
+import pytz
+
+AI_CACHE = 'ai_cache'
+
+_DAY = 24 * 3600
+# site -> seconds an answer stays valid
+CACHE_POLICIES = {
+    'grade_fill_blank': 30 * _DAY,
+    'grade_translation': 30 * _DAY,
+    'sentence_score': 30 * _DAY,
+    'explain_reordering': 30 * _DAY,
+    'definition': 7 * _DAY,
+}
+
+_DISABLED = os.getenv('AI_CACHE_DISABLED', '').lower() in ('1', 'true', 'yes', 'y')
+
+_cache_stats = {}
+_stats_lock = threading.Lock()
+
+
+def ensure_ai_cache_indexes(db):
+    try:
+        db[AI_CACHE].create_index([('expires_at', 1)], expireAfterSeconds=0)
+    except Exception:
+        pass
+
+
+def cache_key(model, system_prompt, user_prompt, expect_json):
+    raw = json.dumps([model, system_prompt, user_prompt, bool(expect_json)], ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def cache_enabled(site):
+    return not _DISABLED and site in CACHE_POLICIES
+
+
+def _count(site, field):
+    with _stats_lock:
+        row = _cache_stats.setdefault(site, {'hits': 0, 'misses': 0, 'stores': 0, 'bypassed': 0})
+        row[field] += 1
+
+
+def count_bypass(site):
+    _count(site, 'bypassed')
+
+
+def cache_get(db, site, key):
+    """Cached response text for key, or None (counted as a hit or a miss)."""
+    try:
+        now = datetime.now(pytz.utc)
+        # TTL deletion runs about once a minute, so check expiry here as well
+        doc = db[AI_CACHE].find_one_and_update(
+            {'_id': key, 'expires_at': {'$gt': now}},
+            {'$inc': {'hits': 1}},
+            projection={'response': 1}
+        )
+    except Exception:
+        doc = None
+    if doc and isinstance(doc.get('response'), str):
+        _count(site, 'hits')
+        return doc['response']
+    _count(site, 'misses')
+    return None
+
+
+def cache_put(db, site, key, model, response):
+    try:
+        now = datetime.now(pytz.utc)
+        db[AI_CACHE].update_one(
+            {'_id': key},
+            {'$set': {'site': site, 'model': model, 'response': response,
+                      'created_at': now, 'expires_at': now + timedelta(seconds=CACHE_POLICIES[site])},
+             '$setOnInsert': {'hits': 0}},
+            upsert=True
+        )
+        _count(site, 'stores')
+    except Exception:
+        pass
+
+
+def ai_cache_stats() -> dict:
+    """Snapshot of per-site cache counters for this process."""
+    with _stats_lock:
+        return {k: dict(v) for k, v in _cache_stats.items()}
@@ -0,0 +1,254 @@
+"""
+Admission control for upstream AI calls.
+
+Every DeepSeek request used to run straight from the request thread with no
+timeout, so a class submitting at once could tie up every worker thread. Calls
+now go through one per-process gateway:
+    - at most AI_MAX_CONCURRENCY requests are in flight; generation may only use
+      the slots left after AI_GRADING_RESERVED are kept back for grading
+    - a global token bucket (AI_GLOBAL_RATE/s, burst AI_GLOBAL_BURST) paces
+      starts, and a per-user bucket (AI_USER_RATE/min, burst AI_USER_BURST)
+      rejects a user's excess interactive calls at once with AIRateLimited
+      (429). Generation has its own, larger per-user bucket
+      (AI_USER_GENERATION_RATE/min, burst AI_USER_GENERATION_BURST) so one
+      admin's previews and generate-data runs cannot take the whole generation
+      share (the generation worker requeues a rejected job after Retry-After).
+      Grading is exempt: a quiz submission grades every answer at once and a
+      rejected call would be recorded as a wrong answer, so grading only waits
+      in the queue
+    - waiters queue by priority (grading, then interactive, then generation);
+      a full queue or a wait longer than AI_QUEUE_TIMEOUT raises AIBusy (503)
+    - each upstream request gets AI_REQUEST_TIMEOUT seconds
+Both errors subclass RuntimeError, which existing AI callers already handle;
+routes that want the fast 429/503 let them reach the app error handler.
+"""
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+PRIORITY_GRADING = 0
+PRIORITY_INTERACTIVE = 1
+PRIORITY_GENERATION = 2
+_PRIORITY_NAMES = {PRIORITY_GRADING: 'grading', PRIORITY_INTERACTIVE: 'interactive', PRIORITY_GENERATION: 'generation'}
+
+MAX_CONCURRENCY = max(1, int(os.getenv('AI_MAX_CONCURRENCY', '8')))
+GRADING_RESERVED = max(0, min(MAX_CONCURRENCY - 1, int(os.getenv('AI_GRADING_RESERVED', '2'))))
+MAX_QUEUE = max(0, int(os.getenv('AI_MAX_QUEUE', '32')))
+QUEUE_TIMEOUT = float(os.getenv('AI_QUEUE_TIMEOUT', '15'))
+REQUEST_TIMEOUT = float(os.getenv('AI_REQUEST_TIMEOUT', '60'))
+GLOBAL_RATE = float(os.getenv('AI_GLOBAL_RATE', '10'))
+GLOBAL_BURST = float(os.getenv('AI_GLOBAL_BURST', '20'))
+USER_RATE_PER_MIN = float(os.getenv('AI_USER_RATE', '30'))
+USER_BURST = float(os.getenv('AI_USER_BURST', '10'))
+USER_GENERATION_RATE_PER_MIN = float(os.getenv('AI_USER_GENERATION_RATE', '60'))
+USER_GENERATION_BURST = float(os.getenv('AI_USER_GENERATION_BURST', '30'))
+_MAX_USER_BUCKETS = 10000
+
+
+class AIGatewayError(RuntimeError):
+    status_code = 503
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = max(1, int(math.ceil(retry_after or 1)))
+
+
+class AIRateLimited(AIGatewayError):
+    status_code = 429
+
+
+class AIBusy(AIGatewayError):
+    status_code = 503
+
+
+class _TokenBucket:
+    def __init__(self, rate, burst, now):
+        self.rate = rate            # tokens per second; <= 0 means unlimited
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.stamp = now
+
+    def _refill(self, now):
+        if now > self.stamp:
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+
+    def take(self, now):
+        if self.rate <= 0:
+            return True
+        self._refill(now)
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+    def wait_time(self, now):
+        if self.rate <= 0:
+            return 0.0
+        self._refill(now)
+        return 0.0 if self.tokens >= 1.0 else (1.0 - self.tokens) / self.rate
+
+
+class AIGateway:
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, grading_reserved=GRADING_RESERVED,
+                 max_queue=MAX_QUEUE, queue_timeout=QUEUE_TIMEOUT, request_timeout=REQUEST_TIMEOUT,
+                 global_rate=GLOBAL_RATE, global_burst=GLOBAL_BURST,
+                 user_rate_per_min=USER_RATE_PER_MIN, user_burst=USER_BURST,
+                 user_generation_rate_per_min=USER_GENERATION_RATE_PER_MIN,
+                 user_generation_burst=USER_GENERATION_BURST):
+        self.max_concurrency = max_concurrency
+        self.grading_reserved = grading_reserved
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.request_timeout = request_timeout
+        # priority -> (tokens per second, burst) of its per-user bucket; grading has none
+        self._user_limits = {
+            PRIORITY_INTERACTIVE: (user_rate_per_min / 60.0, user_burst),
+            PRIORITY_GENERATION: (user_generation_rate_per_min / 60.0, user_generation_burst),
+        }
+        self._cond = threading.Condition()
+        self._global = _TokenBucket(global_rate, global_burst, time.monotonic())
+        self._users = OrderedDict()
+        self._waiting = []
+        self._seq = itertools.count()
+        self._active = 0
+        self._stats = {name: {'admitted': 0, 'rate_limited': 0, 'queue_full': 0, 'timed_out': 0, 'wait_ms': 0}
+                       for name in _PRIORITY_NAMES.values()}
+
+    def _slot_limit(self, priority):
+        if priority >= PRIORITY_GENERATION:
+            return self.max_concurrency - self.grading_reserved
+        return self.max_concurrency
+
+    def _queue_limit(self, priority):
+        # Generation may fill only half the queue so grading can still get in line
+        if priority >= PRIORITY_GENERATION:
+            return self.max_queue // 2
+        return self.max_queue
+
+    def _user_bucket(self, user_id, priority, now):
+        key = (priority, str(user_id))
+        bucket = self._users.get(key)
+        if bucket is None:
+            bucket = _TokenBucket(*self._user_limits[priority], now)
+            self._users[key] = bucket
+            if len(self._users) > _MAX_USER_BUCKETS:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(key)
+        return bucket
+
+    def _acquire(self, user_id, priority):
+        stats = self._stats[_PRIORITY_NAMES.get(priority, 'interactive')]
+        with self._cond:
+            now = time.monotonic()
+            if user_id is not None and self._user_limits.get(priority, (0, 0))[0] > 0:
+                bucket = self._user_bucket(user_id, priority, now)
+                if not bucket.take(now):
+                    stats['rate_limited'] += 1
+                    raise AIRateLimited('Too many AI requests, please slow down.', bucket.wait_time(now))
+            if len(self._waiting) >= self._queue_limit(priority):
+                stats['queue_full'] += 1
+                raise AIBusy('AI service is busy, please retry shortly.', 2)
+            entry = (priority, next(self._seq))
+            heapq.heappush(self._waiting, entry)
+            start = now
+            deadline = now + self.queue_timeout
+            try:
+                while True:
+                    now = time.monotonic()
+                    if (self._waiting[0] == entry and self._active < self._slot_limit(priority)
+                            and self._global.take(now)):
+                        heapq.heappop(self._waiting)
+                        self._active += 1
+                        stats['admitted'] += 1
+                        stats['wait_ms'] += int((now - start) * 1000)
+                        # The next waiter may be startable too
+                        self._cond.notify_all()
+                        return
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        stats['timed_out'] += 1
+                        raise AIBusy('Timed out waiting for the AI service.', 2)
+                    pause = remaining
+                    if self._waiting[0] == entry and self._active < self._slot_limit(priority):
+                        pause = min(remaining, max(0.01, self._global.wait_time(now)))
+                    self._cond.wait(pause)
+            except BaseException:
+                if entry in self._waiting:
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
+                    self._cond.notify_all()
+                raise
+
+    def try_acquire(self, priority=PRIORITY_INTERACTIVE):
+        """Take a slot only if one is free right now (nobody queued); True if taken."""
+        stats = self._stats[_PRIORITY_NAMES.get(priority, 'interactive')]
+        with self._cond:
+            now = time.monotonic()
+            if self._waiting or self._active >= self._slot_limit(priority) or not self._global.take(now):
+                return False
+            self._active += 1
+            stats['admitted'] += 1
+            return True
+
+    def _release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    def acquire(self, user_id=None, priority=PRIORITY_INTERACTIVE):
+        """Take one upstream slot (release() it when done); returns the timeout to pass to the client."""
+        self._acquire(user_id, priority)
+        return self.request_timeout
+
+    def release(self):
+        self._release()
+
+    @contextmanager
+    def slot(self, user_id=None, priority=PRIORITY_INTERACTIVE):
+        """Hold one upstream slot; yields the timeout to pass to the client."""
+        self._acquire(user_id, priority)
+        try:
+            yield self.request_timeout
+        finally:
+            self._release()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'active': self._active,
+                'waiting': len(self._waiting),
+                'max_concurrency': self.max_concurrency,
+                'grading_reserved': self.grading_reserved,
+                'max_queue': self.max_queue,
+                'by_priority': {k: dict(v) for k, v in self._stats.items()}
+            }
+
+
+gateway = AIGateway()
+
+
+def ai_slot(user_id=None, priority=PRIORITY_INTERACTIVE):
+    return gateway.slot(user_id=user_id, priority=priority)
+
+
+def ai_gateway_stats() -> dict:
+    """Snapshot of this process's gateway state and per-priority counters."""
+    return gateway.stats()
+
+
+def register_ai_gateway_errors(app):
+    from flask import jsonify
+
+    @app.errorhandler(AIGatewayError)
+    def _ai_gateway_error(e):
+        resp = jsonify({'message': str(e), 'retry_after': e.retry_after})
+        resp.status_code = e.status_code
+        resp.headers['Retry-After'] = str(e.retry_after)
+        return resp
@@ -0,0 +1,287 @@
+"""
+Timeouts, retries, a circuit breaker and hedging for DeepSeek chat completions.
+
+Both OpenAI clients (app/ai.py and extensions.ai_client) used the library
+defaults: a 10-minute read timeout and hidden retries, so a degraded upstream
+held every grading request until the socket gave up. Clients are now built by
+build_ai_client() with AI_CONNECT_TIMEOUT / AI_READ_TIMEOUT and no built-in
+retries, and every call goes through chat_completion(), which
+    - takes an ai_gateway slot per attempt (never sleeping while holding one)
+    - retries timeouts, connection errors, 429 and 5xx up to AI_RETRY_ATTEMPTS
+      more times with full-jitter exponential backoff
+    - counts consecutive failed calls in a per-process circuit breaker: after
+      AI_BREAKER_FAILURES it opens for AI_BREAKER_COOLDOWN seconds and calls
+      fail at once with AIUnavailable (an AIGatewayError, so routes answer 503
+      with Retry-After); then one probe call decides whether it closes again
+    - with hedge=True, sends a second identical request if the first has not
+      answered within the hedge delay and returns whichever finishes first.
+      Hedging is opt-in (AI_HEDGE_GRADING=1 turns it on for grading calls). The
+      delay is AI_HEDGE_DELAY if set, else the p95 of recent upstream latencies
+      for that priority (no hedging until AI_HEDGE_MIN_SAMPLES are seen), and at
+      most AI_HEDGE_MAX_FRACTION of hedgeable calls send a hedge. A hedge only
+      starts when a gateway slot is free at that moment, never by queueing.
+Gateway admission for the first request always happens on the calling thread,
+so AI_QUEUE_TIMEOUT and the fast 503 apply unchanged. The upstream call itself
+runs on the calling thread unless it may be hedged; then it moves to the hedge
+pool, but only when a pool thread is free (the pool never queues work), and the
+caller waits at most the request timeout for an answer.
+"""
+import math
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .ai_gateway import AIBusy, AIGatewayError, PRIORITY_GRADING, PRIORITY_INTERACTIVE, ai_slot, gateway
+
+CONNECT_TIMEOUT = float(os.getenv('AI_CONNECT_TIMEOUT', '5'))
+READ_TIMEOUT = float(os.getenv('AI_READ_TIMEOUT', '60'))
+RETRY_ATTEMPTS = max(0, int(os.getenv('AI_RETRY_ATTEMPTS', '2')))
+RETRY_BASE_DELAY = float(os.getenv('AI_RETRY_BASE_DELAY', '0.5'))
+RETRY_MAX_DELAY = float(os.getenv('AI_RETRY_MAX_DELAY', '8'))
+BREAKER_FAILURES = max(1, int(os.getenv('AI_BREAKER_FAILURES', '5')))
+BREAKER_COOLDOWN = float(os.getenv('AI_BREAKER_COOLDOWN', '30'))
+HEDGE_DELAY = float(os.getenv('AI_HEDGE_DELAY') or 0) or None
+HEDGE_MIN_DELAY = float(os.getenv('AI_HEDGE_MIN_DELAY', '1'))
+HEDGE_MIN_SAMPLES = max(1, int(os.getenv('AI_HEDGE_MIN_SAMPLES', '50')))
+HEDGE_MAX_FRACTION = float(os.getenv('AI_HEDGE_MAX_FRACTION', '0.05'))
+HEDGE_GRADING = os.getenv('AI_HEDGE_GRADING', '0').lower() in ('1', 'true', 'yes', 'y')
+HEDGE_WORKERS = max(2, int(os.getenv('AI_HEDGE_WORKERS', '32')))
+_LATENCY_WINDOW = 500
+
+# Hedged calls run here so an abandoned one never blocks a request thread;
+# _pool_free keeps submissions to free threads so nothing queues inside it
+_hedge_pool = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix='ai-hedge')
+_pool_free = threading.BoundedSemaphore(HEDGE_WORKERS)
+
+
+class AIUnavailable(AIGatewayError):
+    status_code = 503
+
+
+def _timeout(read=None):
+    import httpx
+    return httpx.Timeout(read or READ_TIMEOUT, connect=CONNECT_TIMEOUT)
+
+
+def build_ai_client(api_key, base_url):
+    from openai import OpenAI
+    return OpenAI(api_key=api_key, base_url=base_url, timeout=_timeout(), max_retries=0)
+
+
+def _retryable(exc):
+    import openai
+    if isinstance(exc, (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)):
+        return True
+    return isinstance(exc, openai.APIStatusError) and getattr(exc, 'status_code', 0) >= 500
+
+
+class CircuitBreaker:
+    def __init__(self, failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN):
+        self.failures = failures
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._consecutive = 0
+        self._opened_at = None
+        self._probing = False
+        self._stats = {'opened': 0, 'short_circuited': 0, 'successes': 0, 'failures': 0}
+
+    def before_call(self):
+        """Raise AIUnavailable while open; let one probe through once the cooldown is over."""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            remaining = self._opened_at + self.cooldown - time.monotonic()
+            if remaining <= 0 and not self._probing:
+                self._probing = True
+                return
+            self._stats['short_circuited'] += 1
+        raise AIUnavailable('AI service is temporarily unavailable, please retry shortly.', max(1, remaining))
+
+    def release_probe(self):
+        """The call never reached the upstream; let the next one probe instead."""
+        with self._lock:
+            self._probing = False
+
+    def record(self, ok):
+        with self._lock:
+            self._probing = False
+            if ok:
+                self._stats['successes'] += 1
+                self._consecutive = 0
+                self._opened_at = None
+                return
+            self._stats['failures'] += 1
+            self._consecutive += 1
+            if self._opened_at is not None or self._consecutive >= self.failures:
+                if self._opened_at is None:
+                    self._stats['opened'] += 1
+                # A failed probe starts a new cooldown
+                self._opened_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            if self._opened_at is None:
+                state = 'closed'
+            elif time.monotonic() - self._opened_at >= self.cooldown:
+                state = 'half_open'
+            else:
+                state = 'open'
+            return {'state': state, 'consecutive_failures': self._consecutive, **self._stats}
+
+
+breaker = CircuitBreaker()
+_hedge_stats = {'hedgeable': 0, 'sent': 0, 'won': 0, 'skipped_busy': 0}
+_hedge_lock = threading.Lock()
+_latencies = {}
+
+
+def _backoff(attempt):
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * math.pow(2, attempt)))
+
+
+def _record_latency(priority, seconds):
+    with _hedge_lock:
+        window = _latencies.get(priority)
+        if window is None:
+            window = _latencies[priority] = deque(maxlen=_LATENCY_WINDOW)
+        window.append(seconds)
+
+
+def _hedge_delay(priority):
+    """AI_HEDGE_DELAY, else the p95 upstream latency for priority; None while too few samples."""
+    if HEDGE_DELAY:
+        return HEDGE_DELAY
+    with _hedge_lock:
+        window = sorted(_latencies.get(priority) or ())
+    if len(window) < HEDGE_MIN_SAMPLES:
+        return None
+    return max(HEDGE_MIN_DELAY, window[int(0.95 * (len(window) - 1))])
+
+
+def _call(client, kwargs, timeout, priority):
+    started = time.monotonic()
+    response = client.chat.completions.create(timeout=_timeout(timeout), **kwargs)
+    _record_latency(priority, time.monotonic() - started)
+    return response
+
+
+def _attempt(client, user_id, priority, kwargs):
+    with ai_slot(user_id, priority) as timeout:
+        return _call(client, kwargs, timeout, priority)
+
+
+def _pooled_call(client, kwargs, timeout, priority):
+    """Run on the hedge pool with a gateway slot and a pool permit already held; frees both."""
+    try:
+        return _call(client, kwargs, timeout, priority)
+    finally:
+        gateway.release()
+        _pool_free.release()
+
+
+def _start_hedge(client, kwargs, timeout, priority):
+    """Submit a hedge if a pool thread and a gateway slot are free right now; else None."""
+    with _hedge_lock:
+        if _hedge_stats['sent'] + 1 > HEDGE_MAX_FRACTION * _hedge_stats['hedgeable']:
+            return None
+    if not _pool_free.acquire(blocking=False):
+        with _hedge_lock:
+            _hedge_stats['skipped_busy'] += 1
+        return None
+    if not gateway.try_acquire(priority):
+        _pool_free.release()
+        with _hedge_lock:
+            _hedge_stats['skipped_busy'] += 1
+        return None
+    with _hedge_lock:
+        _hedge_stats['sent'] += 1
+    return _hedge_pool.submit(_pooled_call, client, kwargs, timeout, priority)
+
+
+def _hedged_attempt(client, user_id, priority, kwargs):
+    """First finished of the request and a hedge sent after the hedge delay."""
+    delay = _hedge_delay(priority)
+    if delay is None or not _pool_free.acquire(blocking=False):
+        return _attempt(client, user_id, priority, kwargs)
+    try:
+        # Admission on the calling thread: queue timeout and fast 503 as usual
+        timeout = gateway.acquire(user_id, priority)
+    except BaseException:
+        _pool_free.release()
+        raise
+    with _hedge_lock:
+        _hedge_stats['hedgeable'] += 1
+    deadline = time.monotonic() + timeout + CONNECT_TIMEOUT
+    primary = _hedge_pool.submit(_pooled_call, client, kwargs, timeout, priority)
+    done, _ = wait([primary], timeout=delay)
+    if done:
+        return primary.result()
+    hedge = _start_hedge(client, kwargs, max(1.0, deadline - time.monotonic()), priority)
+    pending = {primary} if hedge is None else {primary, hedge}
+    error = None
+    while pending:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        for fut in done:
+            if fut.exception() is None:
+                if fut is hedge:
+                    with _hedge_lock:
+                        _hedge_stats['won'] += 1
+                return fut.result()
+            # The primary's error wins over the hedge's
+            if error is None or fut is primary:
+                error = fut.exception()
+    if error is not None and not pending:
+        raise error
+    raise AIBusy('Timed out waiting for the AI service.', 2)
+
+
+def chat_completion(client, user_id=None, priority=PRIORITY_INTERACTIVE, hedge=None, stats=None, **kwargs):
+    """
+    client.chat.completions.create(**kwargs) with the gateway, retries, breaker
+    and hedging (hedge=None: grading calls when AI_HEDGE_GRADING is on).
+    stats, if given, receives 'attempts'.
+    Raises AIGatewayError (including AIUnavailable) or the last upstream error.
+    """
+    if hedge is None:
+        hedge = HEDGE_GRADING and priority == PRIORITY_GRADING
+    attempts = 0
+    while True:
+        breaker.before_call()
+        attempts += 1
+        if stats is not None:
+            stats['attempts'] = attempts
+        try:
+            if hedge:
+                response = _hedged_attempt(client, user_id, priority, kwargs)
+            else:
+                response = _attempt(client, user_id, priority, kwargs)
+        except AIGatewayError:
+            breaker.release_probe()
+            raise
+        except Exception as e:
+            if not _retryable(e):
+                # The upstream answered (e.g. 400), so it is up
+                breaker.record(True)
+                raise
+            breaker.record(False)
+            if attempts > RETRY_ATTEMPTS:
+                raise
+            time.sleep(_backoff(attempts - 1))
+            continue
+        breaker.record(True)
+        return response
+
+
+def ai_resilience_stats() -> dict:
+    with _hedge_lock:
+        hedges = dict(_hedge_stats)
+    hedges['enabled_for_grading'] = HEDGE_GRADING
+    hedges['delay_grading'] = _hedge_delay(PRIORITY_GRADING)
+    return {'breaker': breaker.stats(), 'hedges': hedges,
+            'retry_attempts': RETRY_ATTEMPTS, 'connect_timeout': CONNECT_TIMEOUT, 'read_timeout': READ_TIMEOUT}
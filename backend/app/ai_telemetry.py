@@ -0,0 +1,128 @@
+"""
+Per-process telemetry for model calls.
+
+call_deepseek_api and the blueprint helpers (ai_call, _tool_json_call) record one
+entry per logical call: endpoint (the Flask endpoint, or the call site outside a
+request), site, model, prompt/completion tokens from the response usage, upstream
+latency, retries, how the JSON was parsed ('direct', 'fenced', 'balanced'), cache
+hit/miss/bypass, and the outcome ('ok', 'error', 'rejected', 'parse_error').
+Entries are folded into per-endpoint counters and a fixed-bucket latency histogram
+under one lock; nothing is written to stdout or the database. Cost is estimated
+from AI_PRICE_INPUT_PER_M / AI_PRICE_OUTPUT_PER_M (price per million tokens).
+"""
+import logging
+import os
+import threading
+
+from flask import has_request_context, request
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in ms; the last bucket catches everything slower
+LATENCY_BUCKETS_MS = (100, 250, 500, 1000, 2000, 5000, 10000, 20000, 60000)
+PRICE_INPUT_PER_M = float(os.getenv('AI_PRICE_INPUT_PER_M', '0.27'))
+PRICE_OUTPUT_PER_M = float(os.getenv('AI_PRICE_OUTPUT_PER_M', '1.10'))
+
+_endpoints = {}
+_lock = threading.Lock()
+
+
+def current_endpoint(site=None):
+    if has_request_context() and request.endpoint:
+        return request.endpoint
+    return site or 'background'
+
+
+def usage_tokens(response):
+    """(prompt_tokens, completion_tokens) from a chat completion, 0s if absent."""
+    usage = getattr(response, 'usage', None)
+    return int(getattr(usage, 'prompt_tokens', 0) or 0), int(getattr(usage, 'completion_tokens', 0) or 0)
+
+
+def _empty_row():
+    return {
+        'calls': 0,
+        'outcomes': {},
+        'sites': {},
+        'models': {},
+        'cache': {},
+        'parse': {},
+        'retries': 0,
+        'prompt_tokens': 0,
+        'completion_tokens': 0,
+        'latency_ms_total': 0,
+        'latency_ms_max': 0,
+        'latency_buckets': [0] * (len(LATENCY_BUCKETS_MS) + 1),
+    }
+
+
+def _bump(counter, key):
+    if key is not None:
+        counter[key] = counter.get(key, 0) + 1
+
+
+def record_ai_call(site=None, model=None, prompt_tokens=0, completion_tokens=0, latency_ms=0,
+                   retries=0, parse=None, cache=None, outcome='ok', endpoint=None):
+    endpoint = endpoint or current_endpoint(site)
+    latency_ms = max(0, int(latency_ms))
+    bucket = len(LATENCY_BUCKETS_MS)
+    for i, bound in enumerate(LATENCY_BUCKETS_MS):
+        if latency_ms <= bound:
+            bucket = i
+            break
+    with _lock:
+        row = _endpoints.get(endpoint)
+        if row is None:
+            row = _endpoints[endpoint] = _empty_row()
+        row['calls'] += 1
+        _bump(row['outcomes'], outcome)
+        _bump(row['sites'], site)
+        _bump(row['models'], model)
+        _bump(row['cache'], cache)
+        _bump(row['parse'], parse)
+        row['retries'] += int(retries or 0)
+        row['prompt_tokens'] += int(prompt_tokens or 0)
+        row['completion_tokens'] += int(completion_tokens or 0)
+        if cache != 'hit' and outcome != 'rejected':
+            # Only calls that went upstream count towards latency
+            row['latency_ms_total'] += latency_ms
+            row['latency_ms_max'] = max(row['latency_ms_max'], latency_ms)
+            row['latency_buckets'][bucket] += 1
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("ai call endpoint=%s site=%s model=%s outcome=%s cache=%s latency_ms=%s tokens=%s/%s retries=%s parse=%s",
+                     endpoint, site, model, outcome, cache, latency_ms, prompt_tokens, completion_tokens, retries, parse)
+
+
+def _percentile(buckets, q):
+    total = sum(buckets)
+    if not total:
+        return 0
+    seen = 0
+    for i, n in enumerate(buckets):
+        seen += n
+        if seen >= q * total:
+            return LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else None
+    return None
+
+
+def ai_telemetry_stats() -> list:
+    """Per-endpoint rows, busiest first; p50/p95 are histogram bucket upper bounds (None = over the last)."""
+    with _lock:
+        rows = {k: {**v, 'latency_buckets': list(v['latency_buckets']),
+                    **{f: dict(v[f]) for f in ('outcomes', 'sites', 'models', 'cache', 'parse')}}
+                for k, v in _endpoints.items()}
+    out = []
+    for endpoint, row in rows.items():
+        upstream = sum(row['latency_buckets'])
+        cost = (row['prompt_tokens'] * PRICE_INPUT_PER_M + row['completion_tokens'] * PRICE_OUTPUT_PER_M) / 1e6
+        out.append({
+            'endpoint': endpoint,
+            **row,
+            'latency_ms_avg': round(row['latency_ms_total'] / upstream, 1) if upstream > 0 else 0.0,
+            'latency_ms_p50': _percentile(row['latency_buckets'], 0.5),
+            'latency_ms_p95': _percentile(row['latency_buckets'], 0.95),
+            'latency_bucket_bounds_ms': list(LATENCY_BUCKETS_MS),
+            'estimated_cost': round(cost, 6)
+        })
+    out.sort(key=lambda r: r['calls'], reverse=True)
+    return out
@@ -1,8 +1,13 @@
 import json
 import random
 import re
+import time
 from flask import request, jsonify, Blueprint, current_app
 from openai import OpenAIError
+from ..ai_gateway import AIGatewayError, PRIORITY_GRADING, PRIORITY_INTERACTIVE, PRIORITY_GENERATION
+from ..ai_resilience import chat_completion
+from ..ai_telemetry import record_ai_call, usage_tokens
+from ..word_forms import local_fill_blank_verdict, local_fill_blank_feedback, count_grading_path
 
 ai_bp = Blueprint('ai', __name__, url_prefix='/ai')
 
@@ -21,17 +26,18 @@ SYSTEM_PROMPT = """
 {"feedback":"...","nogrammarissues":true,"score":}`
 """.strip()
 
-def _try_parse_json_loose(text: str) -> dict:
+def _parse_json_loose(text: str):
     """
     Tries to parse a JSON object from model output that may include prose or code fences.
     1) direct json.loads
     2) extract from ```json ... ``` fenced block
     3) extract the first balanced {...} object
+    Returns (object, path) where path is 'direct', 'fenced' or 'balanced'.
     Raises json.JSONDecodeError if all attempts fail.
     """
     # 1) Direct
     try:
-        return json.loads(text)
+        return json.loads(text), 'direct'
     except Exception:
         pass
 
@@ -40,7 +46,7 @@ def _try_parse_json_loose(text: str) -> dict:
     if m:
         candidate = m.group(1)
         try:
-            return json.loads(candidate)
+            return json.loads(candidate), 'fenced'
         except Exception:
             pass
 
@@ -68,66 +74,127 @@ def _try_parse_json_loose(text: str) -> dict:
                     if brace == 0:
                         candidate = text[start:i+1]
                         try:
-                            return json.loads(candidate)
+                            return json.loads(candidate), 'balanced'
                         except Exception:
                             break
     # All failed
     raise json.JSONDecodeError("Failed to parse JSON from model output.", text, 0)
 
 
-def ai_call(prompt: str, max_tokens: int | None = None) -> dict:
+def _try_parse_json_loose(text: str) -> dict:
+    """_parse_json_loose without the path."""
+    return _parse_json_loose(text)[0]
+
+
+def ai_call(prompt: str, max_tokens: int | None = None, priority: int = PRIORITY_INTERACTIVE, site: str | None = None) -> dict:
     """
     Makes a call to the AI model with response_format enforced as json_object.
     Robustness:
     - If content is empty or JSON parsing fails, retries once.
     - Falls back to loose JSON extraction as a last resort before failing.
-    May raise OpenAIError or json.JSONDecodeError to caller after retries.
+    The call (tokens over all attempts, latency, retries, parse path) is recorded in ai_telemetry.
+    May raise OpenAIError, json.JSONDecodeError or AIGatewayError to caller after retries.
     """
     last_err = None
-    for attempt in range(2):
-        rsp = current_app.ai_client.chat.completions.create(
-            model="deepseek-chat",
-            messages=[{"role": "system", "content": prompt}],
-            response_format={"type": "json_object"},
-        )
-        response_content = rsp.choices[0].message.content or ""
-        if not response_content:
-            current_app.logger.warning("AI returned empty content (attempt %s) for prompt; retrying...", attempt + 1)
-            last_err = json.JSONDecodeError("Empty AI content", "", 0)
-            continue
-        try:
-            return json.loads(response_content)
-        except json.JSONDecodeError as e:
-            last_err = e
+    prompt_tokens = completion_tokens = 0
+    latency_ms = 0.0
+    attempt = 0
+    retries = 0
+    try:
+        for attempt in range(2):
+            sent = {}
+            started = time.monotonic()
             try:
-                current_app.logger.warning("AI returned non-JSON content (attempt %s); trying loose parse.", attempt + 1)
-                return _try_parse_json_loose(response_content)
-            except json.JSONDecodeError as e2:
-                last_err = e2
+                rsp = chat_completion(
+                    current_app.ai_client,
+                    priority=priority,
+                    stats=sent,
+                    model="deepseek-chat",
+                    messages=[{"role": "system", "content": prompt}],
+                    response_format={"type": "json_object"},
+                )
+            finally:
+                latency_ms += (time.monotonic() - started) * 1000
+                retries += max(0, sent.get('attempts', 1) - 1) + (1 if attempt else 0)
+            p_tok, c_tok = usage_tokens(rsp)
+            prompt_tokens += p_tok
+            completion_tokens += c_tok
+            response_content = rsp.choices[0].message.content or ""
+            if not response_content:
+                current_app.logger.warning("AI returned empty content (attempt %s) for prompt; retrying...", attempt + 1)
+                last_err = json.JSONDecodeError("Empty AI content", "", 0)
+                continue
+            try:
+                result, path = _parse_json_loose(response_content)
+            except json.JSONDecodeError as e:
+                last_err = e
                 current_app.logger.warning("Loose parse failed (attempt %s).", attempt + 1)
                 # Loop to retry one more time
                 continue
+            record_ai_call(site=site, model="deepseek-chat", prompt_tokens=prompt_tokens,
+                           completion_tokens=completion_tokens, latency_ms=latency_ms,
+                           retries=retries, parse=path)
+            return result
+    except AIGatewayError:
+        record_ai_call(site=site, model="deepseek-chat", retries=retries, outcome='rejected')
+        raise
+    except Exception:
+        record_ai_call(site=site, model="deepseek-chat", prompt_tokens=prompt_tokens,
+                       completion_tokens=completion_tokens, latency_ms=latency_ms,
+                       retries=retries, outcome='error')
+        raise
     # After retries
+    record_ai_call(site=site, model="deepseek-chat", prompt_tokens=prompt_tokens,
+                   completion_tokens=completion_tokens, latency_ms=latency_ms,
+                   retries=retries, outcome='parse_error')
     raise last_err or json.JSONDecodeError("Failed to parse AI JSON.", "", 0)
 
 
-def _tool_json_call(sys_content: str, user_content: str, tools: list) -> dict:
+def _tool_json_call(sys_content: str, user_content: str, tools: list, priority: int = PRIORITY_INTERACTIVE, site: str | None = None) -> dict:
     """Call chat.completions with OpenAI tools and return parsed tool arguments as dict.
     Falls back to loose parsing of message.content if no tool call present."""
-    rsp = current_app.ai_client.chat.completions.create(
-        model="deepseek-chat",
-        messages=[
-            {"role": "system", "content": sys_content},
-            {"role": "user", "content": user_content},
-        ],
-        tools=tools,
-    )
+    sent = {}
+    started = time.monotonic()
+    try:
+        rsp = chat_completion(
+            current_app.ai_client,
+            priority=priority,
+            stats=sent,
+            model="deepseek-chat",
+            messages=[
+                {"role": "system", "content": sys_content},
+                {"role": "user", "content": user_content},
+            ],
+            tools=tools,
+        )
+    except AIGatewayError:
+        record_ai_call(site=site, model="deepseek-chat", outcome='rejected')
+        raise
+    except Exception:
+        record_ai_call(site=site, model="deepseek-chat", latency_ms=(time.monotonic() - started) * 1000,
+                       retries=max(0, sent.get('attempts', 1) - 1), outcome='error')
+        raise
+    latency_ms = (time.monotonic() - started) * 1000
+    retries = max(0, sent.get('attempts', 1) - 1)
+    prompt_tokens, completion_tokens = usage_tokens(rsp)
     msg = rsp.choices[0].message
     if getattr(msg, "tool_calls", None):
-        args_raw = msg.tool_calls[0].function.arguments
-        return _try_parse_json_loose(args_raw)
-    # Fallback
-    return _try_parse_json_loose(msg.content or "")
+        raw = msg.tool_calls[0].function.arguments
+    else:
+        # Fallback
+        raw = msg.content or ""
+    try:
+        result, path = _parse_json_loose(raw)
+    except json.JSONDecodeError:
+        record_ai_call(site=site, model="deepseek-chat", prompt_tokens=prompt_tokens,
+                       completion_tokens=completion_tokens, latency_ms=latency_ms, retries=retries,
+                       outcome='parse_error')
+        raise
+    if not getattr(msg, "tool_calls", None):
+        path = f'content_{path}'
+    record_ai_call(site=site, model="deepseek-chat", prompt_tokens=prompt_tokens,
+                   completion_tokens=completion_tokens, latency_ms=latency_ms, retries=retries, parse=path)
+    return result
 
 @ai_bp.route("/sentence-score", methods=['POST'])
 def ai_sentence_score():
@@ -145,7 +212,7 @@ def ai_sentence_score():
     
     try:
         full_prompt = SYSTEM_PROMPT + "\n\n" + prompt
-        result = ai_call(full_prompt) # no explicit token cap
+        result = ai_call(full_prompt, priority=PRIORITY_GRADING) # no explicit token cap
         # Consolidate feedback fields for frontend convenience
         if 'minimal_fix' in result and 'corrected_sentence' in result:
             result['feedback'] = f"Minimal Fix: {result['minimal_fix']}\nCorrected: {result['corrected_sentence']}"
@@ -361,9 +428,14 @@ def check_for_prompt_injection(user_answer: str) -> bool:
         'Respond with a JSON object with a single boolean field: `is_injection_attempt`.'
     )
     try:
-        result = ai_call(prompt)
+        result = ai_call(prompt, priority=PRIORITY_GRADING)
         return result.get("is_injection_attempt", False)
-    except (OpenAIError, json.JSONDecodeError) as e:
+    except (AIGatewayError, OpenAIError) as e:
+        # The service is down or saturated, not the answer suspicious: skip the check
+        # instead of marking every answer as an injection
+        current_app.logger.warning(f"AI prompt injection check skipped for answer '{user_answer}': {e}")
+        return False
+    except json.JSONDecodeError as e:
         current_app.logger.error(f"AI prompt injection check failed for answer '{user_answer}': {e}")
         # Fail safe: if the check fails, assume it might be an injection attempt.
         return True
@@ -384,13 +456,19 @@ def grade_fill_in_the_blank_with_explanation(prompt_sentence: str, user_answer:
         target_word: The intended base word for the blank.
 
     Returns:
-        A dictionary containing 'is_correct' (boolean) and 'feedback' (string).
+        A dictionary containing 'is_correct' (boolean), 'feedback' (string) and
+        'grading_path' ('local_<reason>' when settled from the word_forms table, else 'ai').
     """
-    if len(user_answer) == 0:
-        return{
-            "is_correct": False,
-            "feedback": "🥲"
+    verdict = local_fill_blank_verdict(current_app.db, user_answer, target_word)
+    if verdict is not None:
+        reason, is_correct, other = verdict
+        count_grading_path(f'local_{reason}')
+        return {
+            "is_correct": is_correct,
+            "feedback": "🥲" if reason == 'empty' else local_fill_blank_feedback(reason, user_answer, target_word, other),
+            "grading_path": f'local_{reason}'
         }
+    count_grading_path('ai')
     prompt = (
         "You are a strict but fair English teacher grading a fill-in-the-blank quiz. "
         "Your task is to evaluate the student's answer based on two criteria: "
@@ -408,17 +486,19 @@ def grade_fill_in_the_blank_with_explanation(prompt_sentence: str, user_answer:
 
     try:
         # Use a token limit that allows for a helpful explanation.
-        result = ai_call(prompt)
+        result = ai_call(prompt, priority=PRIORITY_GRADING)
         # Basic validation to ensure the AI returns the expected keys.
         if 'is_correct' not in result or 'feedback' not in result:
             raise json.JSONDecodeError("AI response missing required keys.", "", 0)
+        result['grading_path'] = 'ai'
         return result
     except (OpenAIError, json.JSONDecodeError) as e:
         current_app.logger.error(f"AI fill-in-the-blank grading failed for answer '{user_answer}': {e}")
         # Fallback response in case of AI error. Mark as incorrect.
         return {
             "is_correct": False,
-            "feedback": "Sorry, an error occurred while grading your answer. It has been marked as incorrect."
+            "feedback": "Sorry, an error occurred while grading your answer. It has been marked as incorrect.",
+            "grading_path": 'ai'
         }
 
 
@@ -469,8 +549,21 @@ def grade_and_explain_fill_in_the_blank(prompt_sentence: str, user_answer: str,
         is_primary_match: Boolean indicating if the user's answer matched the target word.
 
     Returns:
-        A dictionary containing 'is_correct' (boolean) and 'feedback' (string).
+        A dictionary containing 'is_correct' (boolean), 'feedback' (string) and 'grading_path'.
+        Exact matches, empty answers and answers that are another dictionary word get
+        local feedback ('local_<reason>'); only the rest ask the AI for an explanation.
     """
+    verdict = local_fill_blank_verdict(current_app.db, user_answer, correct_answer)
+    if verdict is not None and verdict[1] == is_primary_match:
+        reason, _, other = verdict
+        count_grading_path(f'local_{reason}')
+        return {
+            "is_correct": is_primary_match,
+            "feedback": local_fill_blank_feedback(reason, user_answer, correct_answer, other),
+            "grading_path": f'local_{reason}'
+        }
+    count_grading_path('ai')
+
     # Determine the grading scenario based on the primary match result
     if is_primary_match:
         # User's answer matches the expected word exactly.
@@ -503,16 +596,18 @@ def grade_and_explain_fill_in_the_blank(prompt_sentence: str, user_answer: str,
 
     try:
         # Use a slightly larger token limit to accommodate explanations
-        result = ai_call(prompt)
+        result = ai_call(prompt, priority=PRIORITY_GRADING)
         # Ensure the returned 'is_correct' aligns with the primary match check
         result['is_correct'] = is_primary_match
+        result['grading_path'] = 'ai'
         return result
     except (OpenAIError, json.JSONDecodeError) as e:
         current_app.logger.error(f"AI fill-in-the-blank explanation failed for answer '{user_answer}': {e}")
         # Fallback response
         return {
             "is_correct": is_primary_match,
-            "feedback": "Sorry, an error occurred while generating feedback for your answer."
+            "feedback": "Sorry, an error occurred while generating feedback for your answer.",
+            "grading_path": 'ai'
         }
 
 def _generate_all_stages_for_word_logic(word: str, definition: dict) -> dict:
@@ -543,7 +638,7 @@ def _generate_all_stages_for_word_logic(word: str, definition: dict) -> dict:
     )
 
     # Use a larger token limit to ensure all sentences can be generated.
-    result = ai_call(prompt)
+    result = ai_call(prompt, priority=PRIORITY_GENERATION)
 
     # Basic validation of the AI's output
     if 'stage1' not in result or 'stage3' not in result or 'stage4' not in result or \
@@ -0,0 +1,215 @@
+"""
+Roster-wide statistics for one or more classes.
+
+compute_class_stats() answers what get_class_stats used to compute per student
+(full user document, get_review_words, compute_user_quiz_completion: 4+ queries
+each) with a fixed set of set-based reads, whatever the roster size:
+    1. users aggregate      - to_be_mastered size and completion days in range
+    2. review_schedule      - students with a review due today
+    3. classes              - every class each student belongs to
+    4. quizzes              - published quizzes of those classes
+    5. results aggregate    - distinct attempted quizzes per username
+Today's lazy completion marks are written back with one bulk_write per
+collection; only students who newly finished both lists today get the
+(once-a-day) streak update.
+"""
+from datetime import datetime, timedelta
+
+import pytz
+
+from .review_schedule import REVIEW_SCHEDULE
+from .study_events import DAILY_ROLLUP
+from .streaks import record_streak_completion
+
+
+def class_start_date(class_doc, beijing_tz, fallback):
+    """Default range start: the class's earliest assigned batch, else fallback."""
+    try:
+        batches = class_doc.get('assignment_word_batches', []) or []
+        dates = [b.get('assigned_date') for b in batches if isinstance(b, dict) and b.get('assigned_date')]
+        if dates:
+            return datetime.strptime(min(dates), '%Y-%m-%d').astimezone(beijing_tz)
+    except Exception:
+        pass
+    return fallback
+
+
+def _roster_docs(db, student_ids, since_str):
+    pipeline = [
+        {'$match': {'_id': {'$in': student_ids}}},
+        {'$project': {
+            'username': 1,
+            'nickname': 1,
+            'tbm_count': {'$size': {'$ifNull': ['$to_be_mastered', []]}},
+            'learn_days': {'$filter': {
+                'input': {'$ifNull': ['$complete_exercise_day', []]},
+                'cond': {'$gte': ['$$this', since_str]}
+            }},
+            'review_days': {'$filter': {
+                'input': {'$ifNull': ['$complete_revision_day', []]},
+                'cond': {'$gte': ['$$this', since_str]}
+            }}
+        }}
+    ]
+    return {d['_id']: d for d in db.users.aggregate(pipeline)}
+
+
+def _students_with_due_reviews(db, student_ids, today_str):
+    """
+    Students with at least one review due today. Read-only equivalent of
+    roll_missed_reviews + next_due_date == today: an entry whose due day passed
+    is due today iff today is one of its remaining slots.
+    """
+    pipeline = [
+        {'$match': {
+            'user_id': {'$in': student_ids},
+            '$or': [
+                {'next_due_date': today_str},
+                {'next_due_date': {'$lt': today_str}, 'slots': today_str}
+            ]
+        }},
+        {'$group': {'_id': '$user_id'}}
+    ]
+    return set(d['_id'] for d in db[REVIEW_SCHEDULE].aggregate(pipeline))
+
+
+def _quiz_completion(db, roster):
+    """{student_id: completion_rate} with compute_user_quiz_completion's semantics."""
+    student_ids = list(roster.keys())
+    classes_of = {sid: set() for sid in student_ids}
+    for c in db.classes.find({'students': {'$in': student_ids}}, {'students': 1}):
+        for sid in (c.get('students') or []):
+            if sid in classes_of:
+                classes_of[sid].add(c['_id'])
+    all_class_ids = set().union(*classes_of.values()) if classes_of else set()
+    if not all_class_ids:
+        return {}
+    quizzes_of_class = {}
+    for q in db.quizzes.find({'status': 'published', 'class_ids': {'$in': list(all_class_ids)}}, {'class_ids': 1}):
+        for cid in (q.get('class_ids') or []):
+            quizzes_of_class.setdefault(cid, set()).add(str(q['_id']))
+    all_quiz_ids = set().union(*quizzes_of_class.values()) if quizzes_of_class else set()
+    if not all_quiz_ids:
+        return {}
+    usernames = [d.get('username') for d in roster.values() if d.get('username')]
+    attempted = {}
+    pipeline = [
+        {'$match': {'username': {'$in': usernames}, 'quiz_id': {'$in': list(all_quiz_ids)}}},
+        {'$group': {'_id': {'u': '$username', 'q': '$quiz_id'}}}
+    ]
+    for row in db.results.aggregate(pipeline):
+        key = row.get('_id') or {}
+        attempted.setdefault(key.get('u'), set()).add(key.get('q'))
+    rates = {}
+    for sid, doc in roster.items():
+        published = set()
+        for cid in classes_of.get(sid, ()):
+            published |= quizzes_of_class.get(cid, set())
+        if not published:
+            rates[sid] = 0
+            continue
+        done = len(attempted.get(doc.get('username'), set()) & published)
+        rates[sid] = round((done / len(published)) * 100)
+    return rates
+
+
+def compute_class_stats(db, classes, start_date_str=None, today=None, mark_completion=True):
+    """
+    Stats rows for each class in `classes` (class documents).
+    Returns ({class_id: [row, ...]}, newly_completed) where newly_completed maps
+    student_id -> {'learn': bool, 'review': bool} for today's lazy marks.
+    """
+    beijing_tz = pytz.timezone('Asia/Shanghai')
+    today = today or datetime.now(beijing_tz)
+    today_str = today.strftime('%Y-%m-%d')
+
+    ranges = {}
+    for c in classes:
+        if start_date_str:
+            start = datetime.strptime(start_date_str, '%Y-%m-%d').astimezone(beijing_tz)
+        else:
+            start = class_start_date(c, beijing_tz, today - timedelta(days=6))
+        start = start.replace(hour=0, minute=0, second=0, microsecond=0)
+        days = (today.date() - start.date()).days + 1
+        ranges[c['_id']] = (start.strftime('%Y-%m-%d'), days if days > 0 else 1)
+
+    student_ids = list(dict.fromkeys(sid for c in classes for sid in (c.get('students') or [])))
+    if not student_ids:
+        return {c['_id']: [] for c in classes}, {}
+    since_str = min(r[0] for r in ranges.values())
+
+    roster = _roster_docs(db, student_ids, since_str)
+    due = _students_with_due_reviews(db, list(roster.keys()), today_str)
+    quiz_rates = _quiz_completion(db, roster)
+
+    newly = {}
+    for sid, doc in roster.items():
+        learn_done = int(doc.get('tbm_count') or 0) == 0
+        review_done = sid not in due
+        doc['completed_today_learning'] = learn_done
+        doc['completed_today_review'] = review_done
+        learn_days = set(doc.get('learn_days') or [])
+        review_days = set(doc.get('review_days') or [])
+        mark = {'learn': learn_done and today_str not in learn_days,
+                'review': review_done and today_str not in review_days}
+        if mark['learn'] or mark['review']:
+            newly[sid] = mark
+        if learn_done:
+            learn_days.add(today_str)
+        if review_done:
+            review_days.add(today_str)
+        doc['learn_days'] = learn_days
+        doc['review_days'] = review_days
+
+    if mark_completion and newly:
+        from pymongo import UpdateOne
+        ops = []
+        for sid, mark in newly.items():
+            add = {}
+            if mark['learn']:
+                add['complete_exercise_day'] = today_str
+            if mark['review']:
+                add['complete_revision_day'] = today_str
+            ops.append(UpdateOne({'_id': sid}, {'$addToSet': add}))
+        db.users.bulk_write(ops, ordered=False)
+        now = datetime.now(pytz.utc)
+        rollup_ops = [
+            UpdateOne({'user_id': sid, 'date': today_str},
+                      {'$set': {'review_done': True, 'updated_at': now}}, upsert=True)
+            for sid, mark in newly.items() if mark['review']
+        ]
+        if rollup_ops:
+            try:
+                db[DAILY_ROLLUP].bulk_write(rollup_ops, ordered=False)
+            except Exception:
+                pass
+        for sid in newly:
+            doc = roster[sid]
+            if today_str in doc['learn_days'] and today_str in doc['review_days']:
+                try:
+                    record_streak_completion(db, sid, today_str)
+                except Exception:
+                    pass
+
+    out = {}
+    for c in classes:
+        start_str, total_days = ranges[c['_id']]
+        rows = []
+        for sid in dict.fromkeys(c.get('students') or []):
+            doc = roster.get(sid)
+            if not doc:
+                continue
+            learned = len([d for d in doc['learn_days'] if d >= start_str])
+            reviewed = len([d for d in doc['review_days'] if d >= start_str])
+            rows.append({
+                'student_id': str(sid),
+                'username': doc.get('username'),
+                'nickname': doc.get('nickname', ''),
+                'completed_today_learning': doc['completed_today_learning'],
+                'completed_today_review': doc['completed_today_review'],
+                'learning_completion_rate': round(learned / total_days * 100, 2),
+                'review_completion_rate': round(reviewed / total_days * 100, 2),
+                'assignment_completion_rate': round(quiz_rates.get(sid, 0), 2)
+            })
+        out[c['_id']] = rows
+    return out, newly
@@ -0,0 +1,240 @@
+"""
+Maintenance commands, run with the Flask CLI from backend/:
+    flask --app app <command> [options]
+"""
+import json
+
+import click
+from flask import current_app
+
+
+def register_commands(app):
+    @app.cli.command('migrate-study-logs')
+    @click.option('--batch-size', default=1000, show_default=True, help='Events per insert_many.')
+    @click.option('--keep-legacy', is_flag=True, help='Do not unset users.study_logs after copying.')
+    @click.option('--dry-run', is_flag=True, help='Only count what would be migrated.')
+    def migrate_study_logs_command(batch_size, keep_legacy, dry_run):
+        """Move users.study_logs arrays into the study_events collection."""
+        from .study_events import migrate_study_logs
+        summary = migrate_study_logs(
+            current_app.db,
+            batch_size=max(1, batch_size),
+            keep_legacy=keep_legacy,
+            dry_run=dry_run,
+            log=click.echo
+        )
+        click.echo(json.dumps(summary, ensure_ascii=False))
+
+    @app.cli.command('rebuild-study-rollup')
+    @click.option('--user-id', 'user_ids', multiple=True, help='Limit to these user ids (repeatable).')
+    def rebuild_study_rollup_command(user_ids):
+        """Recompute daily_study_rollup from study_events and completion records."""
+        from bson.objectid import ObjectId
+        from .study_events import rebuild_daily_rollups
+        ids = [ObjectId(u) for u in user_ids] if user_ids else None
+        summary = rebuild_daily_rollups(current_app.db, user_ids=ids, log=click.echo)
+        click.echo(json.dumps(summary, ensure_ascii=False))
+
+    @app.cli.command('migrate-review-schedule')
+    @click.option('--keep-legacy', is_flag=True, help='Do not unset words_mastered[].review_date after copying.')
+    @click.option('--dry-run', is_flag=True, help='Only count what would be migrated.')
+    def migrate_review_schedule_command(keep_legacy, dry_run):
+        """Convert words_mastered review_date arrays into the review_schedule collection."""
+        from .review_schedule import migrate_review_dates
+        summary = migrate_review_dates(current_app.db, keep_legacy=keep_legacy, dry_run=dry_run, log=click.echo)
+        click.echo(json.dumps(summary, ensure_ascii=False))
+
+    @app.cli.command('rebuild-streaks')
+    def rebuild_streaks_command():
+        """Recompute users' streak state and today's streak_distribution."""
+        from .streaks import rebuild_streaks
+        today_str = _today_str()
+        summary = rebuild_streaks(current_app.db, today_str, log=click.echo)
+        click.echo(json.dumps(summary, ensure_ascii=False))
+
+    @app.cli.command('rebuild-word-tags')
+    @click.option('--batch-size', default=1000, show_default=True, help='Documents per insert_many.')
+    def rebuild_word_tags_command(batch_size):
+        """Recompute the word_tags projection from every wordbook's entries."""
+        from .word_tags import rebuild_word_tags
+        summary = rebuild_word_tags(current_app.db, batch_size=max(1, batch_size), log=click.echo)
+        click.echo(json.dumps(summary, ensure_ascii=False))
+
+    @app.cli.command('sync-word-forms')
+    @click.option('--rebuild', is_flag=True, help='Regenerate every entry, not just missing words.')
+    @click.option('--batch-size', default=1000, show_default=True, help='Documents per bulk_write.')
+    def sync_word_forms_command(rebuild, batch_size):
+        """Generate the word_forms inflection table for dictionary words."""
+        from .word_forms import sync_word_forms
+        summary = sync_word_forms(current_app.db, rebuild=rebuild, batch_size=max(1, batch_size), log=click.echo)
+        click.echo(json.dumps(summary, ensure_ascii=False))
+
+    @app.cli.command('nightly-maintenance')
+    def nightly_maintenance_command():
+        """Run the nightly maintenance now (ignores whether it already ran today)."""
+        from .maintenance import run_nightly_maintenance
+        summary = run_nightly_maintenance(current_app.db, _today_str())
+        click.echo(json.dumps(summary, ensure_ascii=False, default=str))
+
+    @app.cli.command('cleanup-ghosts')
+    @click.option('--dry-run', is_flag=True, help='Report what would be removed without writing.')
+    @click.option('--batch-size', default=500, show_default=True, help='Documents per batch.')
+    @click.option('--max-batches', default=0, show_default=True, help='Stop after N batches (0 = until done).')
+    @click.option('--restart', is_flag=True, help='Start a new pass instead of resuming.')
+    def cleanup_ghosts_command(dry_run, batch_size, max_batches, restart):
+        """Remove invalid/duplicate words and ghost wordbook entries (resumable)."""
+        from .ghost_cleanup import run_ghost_cleanup
+        summary = run_ghost_cleanup(
+            current_app.db,
+            dry_run=dry_run,
+            batch_size=max(1, batch_size),
+            max_batches=max_batches or None,
+            restart=restart,
+            log=click.echo
+        )
+        click.echo(json.dumps(summary, ensure_ascii=False, default=str))
+
+    @app.cli.command('generation-worker')
+    @click.option('--poll-interval', default=2.0, show_default=True, help='Seconds to sleep when the queue is empty.')
+    @click.option('--once', is_flag=True, help='Exit once the queue is empty instead of polling.')
+    @click.option('--worker-id', default=None, help='Lease owner name (default: host:pid).')
+    def generation_worker_command(poll_interval, once, worker_id):
+        """Run queued word-generation jobs from generation_jobs."""
+        from .generation_jobs import run_worker
+        processed = run_worker(
+            current_app._get_current_object(),
+            current_app.db,
+            worker_id=worker_id,
+            poll_interval=max(0.1, poll_interval),
+            once=once,
+            log=click.echo
+        )
+        click.echo(json.dumps({'processed': processed}))
+
+    @app.cli.command('pregenerate-words')
+    @click.option('--file', 'word_file', type=click.File('r', encoding='utf-8'), help='Word list, one per line (- for stdin).')
+    @click.option('--wordbook-id', default=None, help='Generate the entries of this wordbook instead.')
+    @click.option('--workers', default=4, show_default=True, help='Words generated at the same time.')
+    @click.option('--words-per-minute', default=0.0, show_default=True, help='Start at most this many words a minute (0 = no limit).')
+    @click.option('--flush-size', default=25, show_default=True, help='Generated words per bulk_write.')
+    @click.option('--max-attempts', default=3, show_default=True, help='Attempts per word.')
+    @click.option('--restart', is_flag=True, help='Start a new summary instead of resuming.')
+    def pregenerate_words_command(word_file, wordbook_id, workers, words_per_minute, flush_size, max_attempts, restart):
+        """Generate and insert dictionary words missing from a word list or wordbook."""
+        from .word_pregeneration import read_word_list, wordbook_words, source_id, run_pregeneration
+        if bool(word_file) == bool(wordbook_id):
+            raise click.UsageError('Pass exactly one of --file or --wordbook-id.')
+        if word_file:
+            words = read_word_list(word_file)
+        else:
+            words = wordbook_words(current_app.db, wordbook_id)
+        summary = run_pregeneration(
+            current_app._get_current_object(),
+            current_app.db,
+            words,
+            source_id(words=words, wordbook_id=wordbook_id),
+            workers=max(1, workers),
+            words_per_minute=words_per_minute,
+            flush_size=max(1, flush_size),
+            max_attempts=max(1, max_attempts),
+            restart=restart,
+            log=click.echo
+        )
+        click.echo(json.dumps(summary, ensure_ascii=False, default=str))
+
+    @app.cli.command('rebuild-tts-index')
+    def rebuild_tts_index_command():
+        """Re-create the TTS cache index from the audio files on disk."""
+        from .tts_cache import get_tts_cache
+        summary = get_tts_cache().rebuild(log=click.echo)
+        click.echo(json.dumps(summary, ensure_ascii=False))
+
+    @app.cli.command('prewarm-tts')
+    @click.option('--file', 'word_file', type=click.File('r', encoding='utf-8'), help='Word list, one per line (- for stdin).')
+    @click.option('--wordbook-id', default=None, help="Warm this wordbook's entries.")
+    @click.option('--class-id', default=None, help="Warm this class's assigned words.")
+    @click.option('--recent-days', default=0, show_default=True, help='Warm words added to the dictionary in the last N days.')
+    @click.option('--workers', default=4, show_default=True, help='Clips synthesized at the same time.')
+    @click.option('--per-minute', default=120.0, show_default=True, help='Start at most this many clips a minute (0 = no limit).')
+    @click.option('--max-attempts', default=3, show_default=True, help='Attempts per clip.')
+    @click.option('--restart', is_flag=True, help='Start a new summary instead of resuming.')
+    def prewarm_tts_command(word_file, wordbook_id, class_id, recent_days, workers, per_minute, max_attempts, restart):
+        """Synthesize and cache the TTS audio missing for a word list, wordbook, class or recent words."""
+        from .tts_prewarm import class_words, recent_words, run_prewarm
+        from .word_pregeneration import read_word_list, source_id, wordbook_words
+        db = current_app.db
+        if sum(1 for opt in (word_file, wordbook_id, class_id, recent_days > 0) if opt) != 1:
+            raise click.UsageError('Pass exactly one of --file, --wordbook-id, --class-id or --recent-days.')
+        if word_file:
+            words = read_word_list(word_file)
+            source = source_id(words=words)
+        elif wordbook_id:
+            words = wordbook_words(db, wordbook_id)
+            source = source_id(wordbook_id=wordbook_id)
+        elif class_id:
+            words = class_words(db, class_id)
+            source = f'class:{class_id}'
+        else:
+            words = recent_words(db, recent_days)
+            source = f'recent:{recent_days}d'
+        summary = run_prewarm(
+            db,
+            words,
+            source,
+            workers=max(1, workers),
+            per_minute=per_minute,
+            max_attempts=max(1, max_attempts),
+            restart=restart,
+            log=click.echo
+        )
+        click.echo(json.dumps(summary, ensure_ascii=False, default=str))
+
+    @app.cli.command('tts-stub-server')
+    @click.option('--host', default='127.0.0.1', show_default=True)
+    @click.option('--port', default=8765, show_default=True)
+    @click.option('--latency-ms', default=150.0, show_default=True, help='Delay before each answer.')
+    @click.option('--jitter-ms', default=0.0, show_default=True, help='Extra random delay up to this much.')
+    @click.option('--fail-rate', default=0.0, show_default=True, help='Share of calls answered with a 503.')
+    def tts_stub_server_command(host, port, latency_ms, jitter_ms, fail_rate):
+        """Serve a local stand-in for the Volcano TTS API (point VOLCANO_TTS_URL at it)."""
+        from .tts_stub import make_stub_server, stub_url
+        server = make_stub_server(host, port, latency_ms=latency_ms, jitter_ms=jitter_ms, fail_rate=fail_rate)
+        click.echo(f"TTS stub listening on {stub_url(server)}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+    @app.cli.command('bench-tts')
+    @click.option('--url', default=None, help='TTS endpoint to call (default: an in-process stub).')
+    @click.option('--requests', 'n_requests', default=200, show_default=True)
+    @click.option('--concurrency', default=20, show_default=True)
+    @click.option('--latency-ms', default=150.0, show_default=True, help='Stub latency (in-process stub only).')
+    @click.option('--fresh-connections', is_flag=True, help='New client per call instead of the shared pool.')
+    def bench_tts_command(url, n_requests, concurrency, latency_ms, fresh_connections):
+        """Measure TTS client throughput and latency against a stub (or --url)."""
+        import threading
+        from .tts_stub import make_stub_server, run_benchmark, stub_url
+        server = None
+        if not url:
+            server = make_stub_server(latency_ms=latency_ms)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            url = stub_url(server)
+        try:
+            summary = run_benchmark(url, requests=max(1, n_requests), concurrency=max(1, concurrency),
+                                    fresh_connections=fresh_connections)
+            if server is not None:
+                summary['stub_requests'] = server.requests
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+        click.echo(json.dumps(summary, ensure_ascii=False))
+
+
+def _today_str():
+    import pytz
+    from datetime import datetime
+    return datetime.now(pytz.timezone('Asia/Shanghai')).strftime('%Y-%m-%d')
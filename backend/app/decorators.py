@@ -1,7 +1,8 @@
 from functools import wraps
 from flask import request, jsonify, current_app, g
 import jwt
-from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from .session import get_session_user
 
 def token_required(f):
     @wraps(f)
@@ -19,17 +20,22 @@ def token_required(f):
         try:
             data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
             user_id = data['user_id']
-            
-            user = current_app.db.users.find_one({'_id': ObjectId(user_id)})
-            
+
+            # Slim record from the per-process session cache; no Mongo read on a hit
+            user = get_session_user(user_id)
+
             if not user:
                  return jsonify({'message': 'User not found'}), 401
-            
+
+            # Role changed since the token was issued: force a fresh login
+            if data.get('role') and data.get('role') != user.get('role'):
+                return jsonify({'message': 'Session expired'}), 401
+
             g.current_user = user
 
         except jwt.ExpiredSignatureError:
             return jsonify({'message': 'Token expired'}), 401
-        except jwt.InvalidTokenError:
+        except (jwt.InvalidTokenError, InvalidId):
             return jsonify({'message': 'Invalid token'}), 401
         
         return f(*args, **kwargs)
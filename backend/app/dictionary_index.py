@@ -0,0 +1,114 @@
+"""
+Per-process index of every word in the dictionary (`words` collection).
+
+Handlers used to run words.find({}, {'word': 1}) on each request just to test
+membership. The index keeps the word set and a lowercase -> word map in memory
+and reloads them only when the dictionary version changes. The version is a
+counter in the `app_meta` collection ({_id: 'dictionary_version', version: N});
+anything that inserts, renames or deletes words calls bump_dictionary_version()
+so every worker picks the change up on its next check.
+"""
+import os
+import threading
+import time
+
+APP_META = 'app_meta'
+_VERSION_ID = 'dictionary_version'
+
+# How often (seconds) a worker re-reads the version stamp; 0 checks on every call
+_VERSION_CHECK_INTERVAL = float(os.getenv('DICTIONARY_VERSION_CHECK_INTERVAL', '2'))
+
+_index_lock = threading.Lock()
+_index = {
+    'version': None,       # version the words/lower sets were loaded at
+    'checked_at': 0.0,     # last time the stamp was read
+    'words': frozenset(),
+    'lower': {}            # lowercase -> canonical word (first seen wins)
+}
+
+
+def ensure_dictionary_indexes(db):
+    try:
+        # Word lookups by value (practice, add_word duplicate check, cleanup)
+        db.words.create_index([('word', 1)])
+    except Exception:
+        pass
+
+
+def _read_version(db):
+    doc = db[APP_META].find_one({'_id': _VERSION_ID}, {'version': 1}) or {}
+    return int(doc.get('version') or 0)
+
+
+def bump_dictionary_version(db):
+    """Mark the dictionary as changed; call after any write to `words`."""
+    try:
+        doc = db[APP_META].find_one_and_update(
+            {'_id': _VERSION_ID},
+            {'$inc': {'version': 1}},
+            upsert=True,
+            return_document=True
+        ) or {}
+    except Exception:
+        doc = {}
+    with _index_lock:
+        # Force this worker to reload on its next lookup
+        _index['checked_at'] = 0.0
+        _index['version'] = None
+    return int(doc.get('version') or 0)
+
+
+def _load(db, version):
+    words = set()
+    lower = {}
+    for doc in db.words.find({}, {'_id': 0, 'word': 1}):
+        w = doc.get('word')
+        if not isinstance(w, str) or not w:
+            continue
+        words.add(w)
+        lw = w.lower()
+        # Prefer the all-lowercase spelling when several words fold together
+        if lw not in lower or w == lw:
+            lower[lw] = w
+    with _index_lock:
+        _index['words'] = frozenset(words)
+        _index['lower'] = lower
+        _index['version'] = version
+        _index['checked_at'] = time.time()
+
+
+def _current(db):
+    now = time.time()
+    with _index_lock:
+        fresh = _index['version'] is not None and (now - _index['checked_at']) < _VERSION_CHECK_INTERVAL
+        if fresh:
+            return _index['words'], _index['lower']
+    version = _read_version(db)
+    with _index_lock:
+        if _index['version'] == version:
+            _index['checked_at'] = now
+            return _index['words'], _index['lower']
+    _load(db, version)
+    with _index_lock:
+        return _index['words'], _index['lower']
+
+
+def dictionary_words(db):
+    """Frozen set of every word in the dictionary."""
+    return _current(db)[0]
+
+
+def resolve_word(db, word):
+    """
+    Dictionary spelling of `word`: the exact match if present, otherwise a
+    case-insensitive match (lowercase form preferred), otherwise None.
+    """
+    if not isinstance(word, str) or not word:
+        return None
+    words, lower = _current(db)
+    if word in words:
+        return word
+    lw = word.lower()
+    if lw in words:
+        return lw
+    return lower.get(lw)
@@ -6,9 +6,9 @@ from datetime import datetime, date
 from bson import ObjectId
 from flask.json.provider import JSONProvider
 from flask_cors import CORS
-from openai import OpenAI
 from pymongo import MongoClient
 from pymongo.errors import PyMongoError
+from .ai_resilience import build_ai_client
 
 # ---------- Custom JSON Encoder for ObjectId ----------
 class MongoJSONProvider(JSONProvider):
@@ -86,7 +86,8 @@ def init_extensions(app):
     if not api_key:
         logger.error("DEEPSEEK_API_KEY not set in environment")
         raise SystemExit("❌ DEEPSEEK_API_KEY not set")
-    ai_client = OpenAI(api_key=api_key, base_url="https://api.deepseek.com")
+    # Bounded connect/read timeouts and no hidden retries (see ai_resilience)
+    ai_client = build_ai_client(api_key=api_key, base_url="https://api.deepseek.com")
     app.ai_client = ai_client
     logger.info("✅ AI client initialized.")
 
@@ -0,0 +1,227 @@
+"""
+Durable queue for word-content generation.
+
+/api/words/generate-data used to run all 13 AI sections on threads inside the
+web worker, so a restart lost everything. A job document in `generation_jobs`
+now carries the work:
+    { kind: 'word_data', key: <word>, user_id, status, active, sections: {name: value},
+      result, error, attempts, next_run_at, lease_until, worker, created_at, updated_at,
+      finished_at, expires_at }
+status goes queued -> running -> done | failed. A separate worker process
+(`flask --app app generation-worker`) claims jobs under a lease, renewed by a
+heartbeat while the job runs, and stores each section as soon as it is generated;
+a job whose worker died is claimed again when its lease runs out and skips the
+sections it already has. Every write is conditioned on still holding the lease,
+so a worker that lost it cannot overwrite the new owner's result. Enqueueing is
+idempotent: while a job for a word is queued or running (active: true) the same
+job is returned. Finished jobs are dropped by a TTL index a week later.
+"""
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+from .ai_gateway import AIGatewayError
+from .word_generation import run_word_generation, section_names
+
+GENERATION_JOBS = 'generation_jobs'
+KIND_WORD_DATA = 'word_data'
+
+LEASE_SECONDS = int(os.getenv('GENERATION_JOB_LEASE_SECONDS', '120'))
+MAX_ATTEMPTS = int(os.getenv('GENERATION_JOB_MAX_ATTEMPTS', '3'))
+_KEEP_FINISHED = timedelta(days=7)
+
+
+def _now():
+    return datetime.now(pytz.utc)
+
+
+def ensure_generation_job_indexes(db):
+    try:
+        coll = db[GENERATION_JOBS]
+        coll.create_index([('kind', 1), ('key', 1)], unique=True,
+                          partialFilterExpression={'active': True}, name='active_job_per_key')
+        coll.create_index([('status', 1), ('next_run_at', 1)])
+        coll.create_index([('status', 1), ('lease_until', 1)])
+        coll.create_index([('expires_at', 1)], expireAfterSeconds=0)
+    except Exception:
+        pass
+
+
+def enqueue_word_data_job(db, word, user_id):
+    """Queue generation for word, or return the job already queued/running for it."""
+    from pymongo import ReturnDocument
+    from pymongo.errors import DuplicateKeyError
+    now = _now()
+    for _ in range(2):
+        try:
+            return db[GENERATION_JOBS].find_one_and_update(
+                {'kind': KIND_WORD_DATA, 'key': word, 'active': True},
+                {'$setOnInsert': {
+                    'user_id': user_id,
+                    'status': 'queued',
+                    'sections': {},
+                    'attempts': 0,
+                    'next_run_at': now,
+                    'lease_until': None,
+                    'created_at': now,
+                    'updated_at': now
+                }},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # Lost an upsert race; the other insert is the job
+            continue
+    return db[GENERATION_JOBS].find_one({'kind': KIND_WORD_DATA, 'key': word, 'active': True})
+
+
+def job_status(job):
+    """Public view of a job document for the polling endpoint."""
+    names = section_names()
+    sections = job.get('sections') or {}
+    out = {
+        'job_id': str(job['_id']),
+        'word': job.get('key'),
+        'status': job.get('status'),
+        'attempts': job.get('attempts', 0),
+        'sections_done': sum(1 for n in names if n in sections),
+        'sections_total': len(names),
+        'created_at': job.get('created_at'),
+        'updated_at': job.get('updated_at')
+    }
+    if job.get('status') == 'done':
+        out['result'] = job.get('result')
+    if job.get('error'):
+        out['error'] = job.get('error')
+    return out
+
+
+def claim_job(db, worker_id):
+    """Take the oldest runnable job (queued and due, or running with an expired lease)."""
+    from pymongo import ReturnDocument
+    now = _now()
+    return db[GENERATION_JOBS].find_one_and_update(
+        {'$or': [
+            {'status': 'queued', 'next_run_at': {'$lte': now}},
+            {'status': 'running', 'lease_until': {'$lt': now}}
+        ]},
+        {'$set': {'status': 'running', 'worker': worker_id,
+                  'lease_until': now + timedelta(seconds=LEASE_SECONDS), 'updated_at': now}},
+        sort=[('created_at', 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def _checkpointer(db, job, worker_id):
+    """section(name, fn) hook: reuse a stored section, else generate and store it once."""
+    stored = dict(job.get('sections') or {})
+
+    def section(name, fn):
+        if name in stored:
+            return stored[name]
+        value = fn()
+        now = _now()
+        res = db[GENERATION_JOBS].update_one(
+            {'_id': job['_id'], 'worker': worker_id, f'sections.{name}': {'$exists': False}},
+            {'$set': {f'sections.{name}': value, 'updated_at': now,
+                      'lease_until': now + timedelta(seconds=LEASE_SECONDS)}}
+        )
+        if res.matched_count == 0:
+            # Lease lost or section written by another worker: keep the stored copy
+            doc = db[GENERATION_JOBS].find_one({'_id': job['_id']}, {'sections': 1}) or {}
+            value = (doc.get('sections') or {}).get(name, value)
+        stored[name] = value
+        return value
+
+    return section
+
+
+def _heartbeat(db, job, worker_id):
+    """Keep renewing the job's lease until the returned event is set."""
+    stop = threading.Event()
+    interval = max(1.0, LEASE_SECONDS / 3.0)
+
+    def run():
+        while not stop.wait(interval):
+            now = _now()
+            try:
+                res = db[GENERATION_JOBS].update_one(
+                    {'_id': job['_id'], 'worker': worker_id, 'status': 'running'},
+                    {'$set': {'lease_until': now + timedelta(seconds=LEASE_SECONDS), 'updated_at': now}}
+                )
+            except Exception:
+                continue
+            if res.matched_count == 0:
+                return
+
+    threading.Thread(target=run, name=f"generation-lease-{job['_id']}", daemon=True).start()
+    return stop
+
+
+def _update_owned(db, job, worker_id, fields):
+    """$set fields on the job unless another worker has claimed it since."""
+    db[GENERATION_JOBS].update_one({'_id': job['_id'], 'worker': worker_id, 'status': 'running'},
+                                   {'$set': fields})
+
+
+def _finish(db, job, worker_id, fields):
+    now = _now()
+    fields.update({'active': False, 'lease_until': None, 'updated_at': now,
+                   'finished_at': now, 'expires_at': now + _KEEP_FINISHED})
+    _update_owned(db, job, worker_id, fields)
+
+
+def run_job(app, db, job, worker_id, log=None):
+    """Run one claimed job to completion, failure or a retry later."""
+    heartbeat = _heartbeat(db, job, worker_id)
+    try:
+        if job.get('kind') != KIND_WORD_DATA:
+            raise ValueError(f"unknown job kind {job.get('kind')!r}")
+        result = run_word_generation(app, job['key'], job.get('user_id'),
+                                     section=_checkpointer(db, job, worker_id))
+        _finish(db, job, worker_id, {'status': 'done', 'result': result, 'error': None})
+        if log:
+            log(f"job {job['_id']} ({job['key']}) done")
+    except AIGatewayError as e:
+        # Not the job's fault: try again once the gateway has room
+        now = _now()
+        _update_owned(db, job, worker_id, {
+            'status': 'queued', 'lease_until': None, 'updated_at': now,
+            'next_run_at': now + timedelta(seconds=e.retry_after)})
+    except Exception as e:
+        attempts = int(job.get('attempts') or 0) + 1
+        if attempts >= MAX_ATTEMPTS:
+            _finish(db, job, worker_id, {'status': 'failed', 'attempts': attempts, 'error': str(e)})
+        else:
+            now = _now()
+            _update_owned(db, job, worker_id, {
+                'status': 'queued', 'attempts': attempts, 'error': str(e), 'lease_until': None,
+                'updated_at': now, 'next_run_at': now + timedelta(seconds=30 * attempts)})
+        if log:
+            log(f"job {job['_id']} ({job.get('key')}) attempt {attempts} failed: {e}")
+    finally:
+        heartbeat.set()
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def run_worker(app, db, worker_id=None, poll_interval=2.0, once=False, log=None):
+    """Claim and run jobs until stopped (or, with once, until the queue is empty)."""
+    worker_id = worker_id or default_worker_id()
+    ensure_generation_job_indexes(db)
+    processed = 0
+    while True:
+        job = claim_job(db, worker_id)
+        if job is None:
+            if once:
+                return processed
+            time.sleep(poll_interval)
+            continue
+        run_job(app, db, job, worker_id, log=log)
+        processed += 1
@@ -0,0 +1,173 @@
+"""
+Incremental ghost / duplicate cleanup for the dictionary and wordbooks.
+
+Used to run inside GET /api/words on every page load. It is now a job that walks
+the collections in _id order in batches, in three phases:
+    invalid_words    words whose 'word' is missing, blank or contains non-ASCII
+    duplicate_words  extra documents sharing a 'word' (the lowest _id is kept)
+    wordbooks        entries pointing at words not in the dictionary, and repeats
+The position (phase, last _id) and running summary are kept in app_meta
+('ghost_cleanup', or 'ghost_cleanup:dry' for dry runs), so a run with a batch
+budget picks up where the previous one stopped. A finished pass starts over on
+the next run. Dry runs report what would change without writing anything else.
+"""
+import re
+from datetime import datetime
+
+import pytz
+
+from .dictionary_index import APP_META, dictionary_words, bump_dictionary_version
+from .word_tags import refresh_wordbook_tags
+
+PHASES = ('invalid_words', 'duplicate_words', 'wordbooks')
+_SAMPLE_LIMIT = 20
+_NON_ASCII = re.compile(r'[^\x00-\x7F]')
+
+
+def is_invalid_word(w):
+    return not isinstance(w, str) or not w.strip() or bool(_NON_ASCII.search(w))
+
+
+def _empty_summary():
+    return {
+        'invalid_words_deleted': 0,
+        'duplicate_words_deleted': 0,
+        'wordbooks_affected': 0,
+        'entries_removed': 0,
+        'wordbook_duplicate_entries_removed': 0,
+        'samples': []
+    }
+
+
+def _sample(summary, item):
+    if len(summary['samples']) < _SAMPLE_LIMIT:
+        summary['samples'].append(item)
+
+
+def _load_state(db, state_id, restart):
+    state = None if restart else db[APP_META].find_one({'_id': state_id})
+    if not state or state.get('finished_at'):
+        state = {
+            '_id': state_id,
+            'phase': PHASES[0],
+            'last_id': None,
+            'summary': _empty_summary(),
+            'started_at': datetime.now(pytz.utc),
+            'finished_at': None
+        }
+    return state
+
+
+def _batch(coll, last_id, batch_size, projection):
+    query = {'_id': {'$gt': last_id}} if last_id is not None else {}
+    return list(coll.find(query, projection).sort('_id', 1).limit(batch_size))
+
+
+def _invalid_words_step(db, docs, summary, dry_run):
+    ids = []
+    for d in docs:
+        if is_invalid_word(d.get('word')):
+            ids.append(d['_id'])
+            _sample(summary, {'phase': 'invalid_words', 'id': str(d['_id']), 'word': d.get('word')})
+    if ids and not dry_run:
+        db.words.delete_many({'_id': {'$in': ids}})
+    summary['invalid_words_deleted'] += len(ids)
+    return len(ids)
+
+
+def _duplicate_words_step(db, docs, summary, dry_run):
+    words = list(set(d.get('word') for d in docs if isinstance(d.get('word'), str)))
+    if not words:
+        return 0
+    keep = {}
+    for d in db.words.find({'word': {'$in': words}}, {'_id': 1, 'word': 1}):
+        w = d.get('word')
+        if w not in keep or d['_id'] < keep[w]:
+            keep[w] = d['_id']
+    ids = [d['_id'] for d in docs if isinstance(d.get('word'), str) and keep.get(d.get('word')) not in (None, d['_id'])]
+    for d in docs:
+        if d['_id'] in ids:
+            _sample(summary, {'phase': 'duplicate_words', 'id': str(d['_id']), 'word': d.get('word')})
+    if ids and not dry_run:
+        db.words.delete_many({'_id': {'$in': ids}})
+    summary['duplicate_words_deleted'] += len(ids)
+    return len(ids)
+
+
+def _wordbooks_step(db, docs, summary, dry_run):
+    existing = dictionary_words(db)
+    for wb in docs:
+        entries = wb.get('entries', []) or []
+        seen = set()
+        deduped = []
+        removed_ghosts = 0
+        removed_dups = 0
+        for e in entries:
+            w = e.get('word') if isinstance(e, dict) else None
+            if not w or w not in existing or is_invalid_word(w):
+                removed_ghosts += 1
+                continue
+            if w in seen:
+                removed_dups += 1
+                continue
+            seen.add(w)
+            deduped.append(e)
+        if removed_ghosts or removed_dups:
+            if not dry_run:
+                db.wordbooks.update_one({'_id': wb['_id']}, {'$set': {'entries': deduped}})
+                refresh_wordbook_tags(db, wb['_id'])
+            summary['wordbooks_affected'] += 1
+            summary['entries_removed'] += removed_ghosts
+            summary['wordbook_duplicate_entries_removed'] += removed_dups
+            _sample(summary, {'phase': 'wordbooks', 'id': str(wb['_id']),
+                              'ghosts': removed_ghosts, 'duplicates': removed_dups})
+    return 0
+
+
+_STEPS = {
+    'invalid_words': ('words', {'_id': 1, 'word': 1}, _invalid_words_step),
+    'duplicate_words': ('words', {'_id': 1, 'word': 1}, _duplicate_words_step),
+    'wordbooks': ('wordbooks', {'entries': 1}, _wordbooks_step),
+}
+
+
+def run_ghost_cleanup(db, dry_run=False, batch_size=500, max_batches=None, restart=False, log=None):
+    """
+    Advance the cleanup by up to max_batches batches (None = until done).
+    Returns the pass summary plus 'phase', 'done' and 'dry_run'.
+    """
+    state_id = 'ghost_cleanup:dry' if dry_run else 'ghost_cleanup'
+    state = _load_state(db, state_id, restart)
+    summary = state.get('summary') or _empty_summary()
+    batches = 0
+    words_deleted = 0
+    while state['phase'] is not None and (max_batches is None or batches < max_batches):
+        coll_name, projection, step = _STEPS[state['phase']]
+        docs = _batch(db[coll_name], state.get('last_id'), batch_size, projection)
+        if not docs:
+            idx = PHASES.index(state['phase'])
+            state['phase'] = PHASES[idx + 1] if idx + 1 < len(PHASES) else None
+            state['last_id'] = None
+            if state['phase'] == 'wordbooks' and words_deleted:
+                # Make the wordbook pass see the cleaned dictionary
+                bump_dictionary_version(db)
+                words_deleted = 0
+            continue
+        changed = step(db, docs, summary, dry_run)
+        if not dry_run:
+            words_deleted += changed
+        state['last_id'] = docs[-1]['_id']
+        batches += 1
+        if log:
+            log(f"{state['phase']}: batch {batches} up to {state['last_id']}")
+    if words_deleted:
+        bump_dictionary_version(db)
+    done = state['phase'] is None
+    now = datetime.now(pytz.utc)
+    db[APP_META].replace_one({'_id': state_id}, {
+        **state,
+        'summary': summary,
+        'updated_at': now,
+        'finished_at': now if done else None
+    }, upsert=True)
+    return {**summary, 'phase': state['phase'], 'done': done, 'dry_run': bool(dry_run), 'batches': batches}
@@ -0,0 +1,107 @@
+"""
+Nightly maintenance, run once per Shanghai day by whichever web worker claims it
+first (see create_app). The claim is app_meta 'nightly:<date>' with a lease
+(lease_until, NIGHTLY_LEASE_SECONDS) that the runner renews between steps; a day
+whose run has no finished_at once the lease has expired (the worker died or was
+recycled) is claimed again. Every step is safe to repeat. Each step is
+independent and failures are logged, not raised.
+"""
+import logging
+import os
+import socket
+from datetime import datetime, timedelta
+
+import pytz
+
+from .dictionary_index import APP_META
+
+logger = logging.getLogger(__name__)
+
+# Earliest Shanghai hour the nightly run may start
+NIGHTLY_HOUR = int(os.getenv('NIGHTLY_MAINTENANCE_HOUR', '0'))
+# Batches of the ghost cleanup per night (0 disables; the pass resumes next night)
+GHOST_CLEANUP_NIGHTLY_BATCHES = int(os.getenv('GHOST_CLEANUP_NIGHTLY_BATCHES', '200'))
+NIGHTLY_LEASE_SECONDS = int(os.getenv('NIGHTLY_LEASE_SECONDS', '1800'))
+
+
+def _owner():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim_nightly_run(db, date_str):
+    """True if this process won the right to run date_str's maintenance (unfinished, lease free)."""
+    now = datetime.now(pytz.utc)
+    try:
+        db[APP_META].update_one(
+            {'_id': f'nightly:{date_str}', 'finished_at': {'$exists': False},
+             '$or': [{'lease_until': {'$lt': now}}, {'lease_until': {'$exists': False}}]},
+            {'$set': {'started_at': now, 'owner': _owner(),
+                      'lease_until': now + timedelta(seconds=NIGHTLY_LEASE_SECONDS)},
+             '$inc': {'attempts': 1}},
+            upsert=True
+        )
+        return True
+    except Exception:
+        # Duplicate key on the upsert: finished, or leased by another worker
+        return False
+
+
+def _renew_lease(db, date_str):
+    try:
+        db[APP_META].update_one({'_id': f'nightly:{date_str}', 'owner': _owner()}, {'$set': {
+            'lease_until': datetime.now(pytz.utc) + timedelta(seconds=NIGHTLY_LEASE_SECONDS)}})
+    except Exception:
+        pass
+
+
+def run_nightly_maintenance(db, today_str):
+    from .streaks import roll_streaks
+    from .review_schedule import roll_missed_reviews
+    from .ghost_cleanup import run_ghost_cleanup
+    from .word_forms import sync_word_forms
+    summary = {}
+    steps = [
+        ('streaks_reset', lambda: roll_streaks(db, today_str)),
+        ('reviews_rolled', lambda: roll_missed_reviews(db, today_str)),
+        ('word_forms', lambda: sync_word_forms(db)),
+    ]
+    if GHOST_CLEANUP_NIGHTLY_BATCHES > 0:
+        steps.append(('ghost_cleanup', lambda: run_ghost_cleanup(db, max_batches=GHOST_CLEANUP_NIGHTLY_BATCHES)))
+    for name, step in steps:
+        try:
+            summary[name] = step()
+        except Exception as e:
+            logger.error(f"nightly maintenance step {name} failed: {e}")
+            summary[name] = None
+        _renew_lease(db, today_str)
+    try:
+        db[APP_META].update_one({'_id': f'nightly:{today_str}'}, {
+            '$set': {'finished_at': datetime.now(pytz.utc), 'summary': summary},
+            '$unset': {'lease_until': ''}
+        }, upsert=True)
+    except Exception:
+        pass
+    return summary
+
+
+def maybe_run_nightly(db):
+    """Run today's maintenance if it is due, unfinished and not leased by another worker."""
+    now_sh = datetime.now(pytz.timezone('Asia/Shanghai'))
+    if now_sh.hour < NIGHTLY_HOUR:
+        return None
+    today_str = now_sh.strftime('%Y-%m-%d')
+    state = db[APP_META].find_one({'_id': f'nightly:{today_str}'}, {'finished_at': 1, 'lease_until': 1})
+    if state and (state.get('finished_at') or _lease_held(state)):
+        return None
+    if not claim_nightly_run(db, today_str):
+        return None
+    return run_nightly_maintenance(db, today_str)
+
+
+def _lease_held(state):
+    lease = state.get('lease_until')
+    if lease is None:
+        return False
+    if lease.tzinfo is None:
+        lease = pytz.utc.localize(lease)
+    return lease > datetime.now(pytz.utc)
@@ -0,0 +1,217 @@
+"""
+Spaced-repetition schedule, one document per (user, word):
+    { user_id, word, date_mastered, slots: ['YYYY-MM-DD', ...], stage, next_due_date,
+      review_times, last_reviewed, updated_at }
+
+`slots` holds the review dates that have not been consumed yet (what used to be
+words_mastered.review_date), `stage` counts the reviews done on a due day (missed
+slots are dropped without counting) and `next_due_date` is the earliest slot on
+or after the last roll, or None once the ladder is done.
+With the (user_id, next_due_date) index "due today", "overdue" and "due in the
+next N days" are range queries instead of scans over words_mastered.
+"""
+from datetime import datetime, timedelta
+
+import pytz
+
+REVIEW_SCHEDULE = 'review_schedule'
+REVIEW_INTERVALS = [1, 3, 5, 7, 15, 30, 60, 90]
+REVIEW_STAGES = len(REVIEW_INTERVALS)
+
+
+def ensure_review_schedule_indexes(db):
+    try:
+        coll = db[REVIEW_SCHEDULE]
+        coll.create_index([('user_id', 1), ('word', 1)], unique=True)
+        coll.create_index([('user_id', 1), ('next_due_date', 1)])
+        # Global roll of missed reviews (roll_missed_reviews without user_id)
+        coll.create_index([('next_due_date', 1)])
+    except Exception:
+        pass
+
+
+def _next_after(slots, date_str):
+    """Split slots into (consumed <= date_str, remaining > date_str)."""
+    done = [s for s in slots if s <= date_str]
+    rest = sorted(s for s in slots if s > date_str)
+    return done, rest
+
+
+def schedule_mastered_words(db, user_id, words, mastery_date):
+    """(Re)start the review ladder for freshly mastered words."""
+    from pymongo import ReplaceOne
+    mastered_str = mastery_date.strftime('%Y-%m-%d')
+    slots = [(mastery_date + timedelta(days=d)).strftime('%Y-%m-%d') for d in REVIEW_INTERVALS]
+    now = datetime.now(pytz.utc)
+    ops = []
+    for w in dict.fromkeys(words or []):
+        if not isinstance(w, str) or not w:
+            continue
+        ops.append(ReplaceOne({'user_id': user_id, 'word': w}, {
+            'user_id': user_id,
+            'word': w,
+            'date_mastered': mastered_str,
+            'slots': list(slots),
+            'stage': 0,
+            'next_due_date': slots[0],
+            'review_times': 0,
+            'updated_at': now
+        }, upsert=True))
+    if ops:
+        db[REVIEW_SCHEDULE].bulk_write(ops, ordered=False)
+    return len(ops)
+
+
+def record_review(db, user_id, word, result, today_str, tomorrow_str):
+    """
+    Apply a review outcome. Consumes every slot up to today but advances stage
+    by one, so missed reviews don't count as done; a 'fail' also schedules an
+    extra review tomorrow, a 'pass' counts towards review_times.
+    Returns None if the word has no schedule, else whether anything changed.
+    """
+    doc = db[REVIEW_SCHEDULE].find_one({'user_id': user_id, 'word': word})
+    if not doc:
+        return None
+    slots = list(doc.get('slots') or [])
+    if result == 'fail' and tomorrow_str not in slots:
+        slots.append(tomorrow_str)
+    done, rest = _next_after(slots, today_str)
+    changed = bool(done) or len(rest) != len(doc.get('slots') or []) or result == 'pass'
+    if not changed:
+        return False
+    update = {'$set': {
+        'slots': rest,
+        'stage': min(REVIEW_STAGES, int(doc.get('stage') or 0) + (1 if done else 0)),
+        'next_due_date': rest[0] if rest else None,
+        'last_reviewed': today_str,
+        'updated_at': datetime.now(pytz.utc)
+    }}
+    if result == 'pass':
+        update['$inc'] = {'review_times': 1}
+    db[REVIEW_SCHEDULE].update_one({'_id': doc['_id']}, update)
+    return True
+
+
+def roll_missed_reviews(db, today_str, user_id=None):
+    """
+    Move next_due_date of entries whose due day passed unreviewed to their next
+    slot on/after today (missed slots stay in `slots` until the next review),
+    matching the old behaviour where a missed review_date was simply skipped.
+    """
+    query = {'next_due_date': {'$lt': today_str}}
+    if user_id is not None:
+        query['user_id'] = user_id
+    res = db[REVIEW_SCHEDULE].update_many(query, [{
+        '$set': {
+            'next_due_date': {'$min': {'$filter': {
+                'input': '$slots',
+                'cond': {'$gte': ['$$this', today_str]}
+            }}}
+        }
+    }])
+    return getattr(res, 'modified_count', 0)
+
+
+def _due_query(user_id, date_str):
+    """
+    Entries due on date_str without writing: next_due_date == date_str, or a due
+    day that passed before the nightly roll_missed_reviews ran and date_str is
+    one of the remaining slots (indexed on user_id, next_due_date).
+    """
+    return {
+        'user_id': user_id,
+        '$or': [
+            {'next_due_date': date_str},
+            {'next_due_date': {'$lt': date_str}, 'slots': date_str}
+        ]
+    }
+
+
+def due_review_words(db, user_id, date_str):
+    """Words due for review on date_str."""
+    cur = db[REVIEW_SCHEDULE].find(_due_query(user_id, date_str), {'word': 1}).sort('_id', 1)
+    return [d.get('word') for d in cur if d.get('word')]
+
+
+def has_due_reviews(db, user_id, date_str):
+    return db[REVIEW_SCHEDULE].find_one(_due_query(user_id, date_str), {'_id': 1}) is not None
+
+
+def overdue_review_words(db, user_id, today_str):
+    """Words with a review slot before today that was never done."""
+    cur = db[REVIEW_SCHEDULE].find({'user_id': user_id, 'slots': {'$lt': today_str}}, {'word': 1}).sort('_id', 1)
+    return [d.get('word') for d in cur if d.get('word')]
+
+
+def upcoming_review_counts(db, user_id, start_str, end_str):
+    """{date: count} of words whose next review falls within [start_str, end_str]."""
+    pipeline = [
+        {'$match': {'user_id': user_id, 'next_due_date': {'$gte': start_str, '$lte': end_str}}},
+        {'$group': {'_id': '$next_due_date', 'count': {'$sum': 1}}},
+        {'$sort': {'_id': 1}}
+    ]
+    return {d['_id']: d['count'] for d in db[REVIEW_SCHEDULE].aggregate(pipeline)}
+
+
+def schedule_map(db, user_id, words=None):
+    """{word: schedule doc} for a user, optionally limited to `words`."""
+    query = {'user_id': user_id}
+    if words is not None:
+        query['word'] = {'$in': list(words)}
+    cur = db[REVIEW_SCHEDULE].find(query, {'_id': 0, 'word': 1, 'slots': 1, 'stage': 1, 'review_times': 1, 'next_due_date': 1})
+    return {d.get('word'): d for d in cur}
+
+
+def remove_scheduled_words(db, words, user_id=None):
+    query = {'word': {'$in': list(words)}}
+    if user_id is not None:
+        query['user_id'] = user_id
+    return getattr(db[REVIEW_SCHEDULE].delete_many(query), 'deleted_count', 0)
+
+
+def migrate_review_dates(db, keep_legacy=False, dry_run=False, log=None):
+    """
+    One-shot conversion of words_mastered[].review_date arrays into review_schedule.
+    Re-runnable: entries are upserted per (user_id, word).
+    """
+    from pymongo import UpdateOne
+    ensure_review_schedule_indexes(db)
+    today_str = datetime.now(pytz.timezone('Asia/Shanghai')).strftime('%Y-%m-%d')
+    summary = {'users': 0, 'entries': 0, 'dry_run': bool(dry_run)}
+    now = datetime.now(pytz.utc)
+    cur = db.users.find({'words_mastered.review_date': {'$exists': True}}, {'words_mastered': 1}, no_cursor_timeout=True)
+    try:
+        for u in cur:
+            uid = u['_id']
+            ops = []
+            for e in (u.get('words_mastered') or []):
+                if not isinstance(e, dict) or not isinstance(e.get('word'), str) or not e.get('word'):
+                    continue
+                slots = sorted(set(s for s in (e.get('review_date') or []) if isinstance(s, str)))
+                upcoming = [s for s in slots if s >= today_str]
+                ops.append(UpdateOne({'user_id': uid, 'word': e.get('word')}, {'$set': {
+                    'user_id': uid,
+                    'word': e.get('word'),
+                    'date_mastered': e.get('date_mastered'),
+                    'slots': slots,
+                    'stage': max(0, REVIEW_STAGES - len(slots)),
+                    'next_due_date': upcoming[0] if upcoming else None,
+                    'review_times': int(e.get('review_times') or 0),
+                    'updated_at': now
+                }}, upsert=True))
+            summary['users'] += 1
+            summary['entries'] += len(ops)
+            if dry_run:
+                continue
+            if ops:
+                db[REVIEW_SCHEDULE].bulk_write(ops, ordered=False)
+            if not keep_legacy:
+                db.users.update_one({'_id': uid}, {'$unset': {
+                    'words_mastered.$[].review_date': '',
+                    'words_mastered.$[].review_times': ''
+                }})
+            if log:
+                log(f"user {uid}: {len(ops)} entries")
+    finally:
+        cur.close()
+    return summary
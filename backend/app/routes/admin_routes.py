@@ -1,7 +1,17 @@
 from flask import Blueprint, request, jsonify, g, current_app
 from bson.objectid import ObjectId
 from ..decorators import admin_required, token_required, superadmin_required
+from ..session import invalidate_user, user_doc_stats
 from .student_routes import get_review_words
+from ..study_events import load_study_events, load_daily_rollups
+from ..dictionary_index import dictionary_words, resolve_word
+from ..word_tags import refresh_wordbook_tags
+from ..ai_cache import ai_cache_stats
+from ..ai_gateway import ai_gateway_stats
+from ..ai_resilience import ai_resilience_stats
+from ..ai_telemetry import ai_telemetry_stats
+from ..word_forms import fill_blank_grading_stats
+from ..tts_cache import get_tts_cache
 import re
 import pytz
 from datetime import datetime, timedelta
@@ -116,6 +126,7 @@ def set_student_nickname(student_id):
         if not stu:
             return jsonify({'message': 'Student not found'}), 404
         current_app.db.users.update_one({'_id': sid}, {'$set': {'nickname': nickname}})
+        invalidate_user(sid)
         return jsonify({'message': 'Nickname updated', 'nickname': nickname}), 200
     except Exception as e:
         return jsonify({'message': 'Update failed', 'error': str(e)}), 500
@@ -172,7 +183,7 @@ def add_words_secret_box(box_id):
             continue
 
     # filter by dictionary
-    existing = set(d.get('word') for d in current_app.db.words.find({'word': {'$in': words}}, {'word':1})) if words else set()
+    existing = dictionary_words(current_app.db)
     valid = [w for w in words if w in existing]
     invalid = [w for w in words if w not in existing]
 
@@ -186,6 +197,7 @@ def add_words_secret_box(box_id):
 
     if new_entries:
         current_app.db.wordbooks.update_one({'_id': oid}, {'$push': {'entries': {'$each': new_entries}}})
+        refresh_wordbook_tags(current_app.db, oid)
 
     return jsonify({'message': 'Added', 'added': len(new_entries), 'invalid_count': len(invalid), 'invalid_words': invalid}), 200
 
@@ -205,6 +217,7 @@ def remove_words_secret_box(box_id):
     if not wb:
         return jsonify({'message':'Not found'}), 404
     current_app.db.wordbooks.update_one({'_id': oid}, {'$pull': {'entries': {'word': {'$in': words}}}})
+    refresh_wordbook_tags(current_app.db, oid)
     return jsonify({'message':'Removed'}), 200
 
 @admin_bp.route('/api/admin/students/<student_id>/overview', methods=['GET'])
@@ -214,7 +227,7 @@ def get_student_overview(student_id):
         sid = ObjectId(student_id)
     except Exception:
         return jsonify({'message':'Invalid student id'}), 400
-    stu = current_app.db.users.find_one({'_id': sid, 'role':'user'})
+    stu = current_app.db.users.find_one({'_id': sid, 'role':'user'}, {'study_logs': 0})
     if not stu:
         return jsonify({'message':'Student not found'}), 404
     tbm_entries = stu.get('to_be_mastered', []) or []
@@ -245,21 +258,25 @@ def get_student_overview(student_id):
 
     beijing_tz = pytz.timezone('Asia/Shanghai')
     today = datetime.now(beijing_tz).date()
-    # Determine first activity day from student's logs
-    logs = (stu.get('study_logs') or [])
+    # One range query over the student's daily rollups; optional ?days=N bounds the window
+    try:
+        days = int(request.args.get('days') or 0)
+    except Exception:
+        days = 0
+    start_str = (today - timedelta(days=days - 1)).strftime('%Y-%m-%d') if days > 0 else None
+    try:
+        rollups = load_daily_rollups(current_app.db, sid, start_str, today.strftime('%Y-%m-%d'))
+    except Exception:
+        rollups = []
+    # Determine first activity day
     first_date = None
-    for lg in logs:
-        try:
-            if not isinstance(lg, dict):
-                continue
-            dstr = lg.get('date')
-            if not dstr:
+    for r in rollups:
+        if (r.get('learned') or 0) > 0 or (r.get('reviewed') or 0) > 0:
+            try:
+                first_date = datetime.strptime(r.get('date'), '%Y-%m-%d').date()
+                break
+            except Exception:
                 continue
-            dval = datetime.strptime(dstr, '%Y-%m-%d').date()
-            if (first_date is None) or (dval < first_date):
-                first_date = dval
-        except Exception:
-            continue
     if first_date is None:
         # Still return secret_wordbook_title for UI banner even when no logs yet
         # Reuse detection logic below to compute title
@@ -330,42 +347,28 @@ def get_student_overview(student_id):
                     secret_set.add(e.get('word'))
     except Exception:
         pass
-    for lg in logs:
-        if not isinstance(lg, dict):
+    for r in rollups:
+        d = r.get('date')
+        if d not in counts:
             continue
-        d = lg.get('date')
-        t = lg.get('type')
-        if d in counts:
-            if t == 'learn':
-                w = lg.get('word')
-                # Always count total learned
-                counts[d]['learned'] += 1
-                if isinstance(w, str) and w:
-                    counts[d]['learned_words'].append(w)
-                    if w in secret_set:
-                        counts[d]['secret_learned_words'].append(w)
-                    else:
-                        counts[d]['other_learned_words'].append(w)
-                # Track completed assigned words (learned words that were assigned by teacher)
-                try:
-                    if isinstance(w, str) and w in teacher_words:
-                        counts[d]['assigned_completed_words'].append(w)
-                except Exception:
-                    pass
-            elif t == 'review':
-                counts[d]['reviewed'] += 1
-                w = lg.get('word')
-                if isinstance(w, str) and w:
-                    counts[d]['reviewed_words'].append(w)
-
-    # Mark days completed revision based on student's record
-    try:
-        completed_days = set((stu.get('complete_revision_day') or []))
-        for d in dates:
-            if d in completed_days:
-                counts[d]['review_done'] = True
-    except Exception:
-        pass
+        # Always count total learned
+        counts[d]['learned'] = int(r.get('learned') or 0)
+        counts[d]['reviewed'] = int(r.get('reviewed') or 0)
+        counts[d]['review_done'] = bool(r.get('review_done'))
+        for w in (r.get('learned_words') or []):
+            if not (isinstance(w, str) and w):
+                continue
+            counts[d]['learned_words'].append(w)
+            if w in secret_set:
+                counts[d]['secret_learned_words'].append(w)
+            else:
+                counts[d]['other_learned_words'].append(w)
+            # Track completed assigned words (learned words that were assigned by teacher)
+            if w in teacher_words:
+                counts[d]['assigned_completed_words'].append(w)
+        for w in (r.get('reviewed_words') or []):
+            if isinstance(w, str) and w:
+                counts[d]['reviewed_words'].append(w)
 
     # Align today's status with live schedule (same as student view)
     try:
@@ -437,7 +440,7 @@ def get_student_daily_wordlist(student_id):
     except Exception:
         return jsonify({'message': 'Invalid student id'}), 400
 
-    stu = current_app.db.users.find_one({'_id': sid, 'role': 'user'}, {'study_logs': 1})
+    stu = current_app.db.users.find_one({'_id': sid, 'role': 'user'}, {'_id': 1})
     if not stu:
         return jsonify({'message': 'Student not found'}), 404
 
@@ -448,7 +451,7 @@ def get_student_daily_wordlist(student_id):
 
     # Collect learned words for the day
     learned = []
-    for lg in (stu.get('study_logs') or []):
+    for lg in load_study_events(current_app.db, sid, date_str, date_str, 'learn'):
         try:
             if not isinstance(lg, dict):
                 continue
@@ -489,6 +492,7 @@ def set_student_tier(student_id):
     if tier not in ['tier_1','tier_2','tier_3']:
         return jsonify({'message':'Invalid tier'}), 400
     current_app.db.users.update_one({'_id': sid}, {'$set': {'tier': tier}})
+    invalidate_user(sid)
     return jsonify({'message':'Updated', 'tier': tier}), 200
 
 @admin_bp.route('/api/admin/students/<student_id>/learning-goal', methods=['PUT'])
@@ -522,7 +526,7 @@ def assign_words_to_student(student_id):
     words = data.get('words')
     if not words or not isinstance(words, list):
         return jsonify({'message':'Missing word list'}), 400
-    valid = set(w.get('word') for w in current_app.db.words.find({'word': {'$in': words}}, {'word':1}))
+    valid = dictionary_words(current_app.db)
     words = [w for w in words if isinstance(w, str) and w in valid]
     if not words:
         return jsonify({'message':'No valid words'}), 400
@@ -585,12 +589,6 @@ def create_or_update_secret_wordbook(student_id):
     if words:
         # Normalize and dedup
         words = sorted({w for w in words if isinstance(w, str) and w})
-        existing_exact = set(doc.get('word') for doc in current_app.db.words.find({'word': {'$in': words}}, {'word': 1}))
-        missing = [w for w in words if w not in existing_exact]
-        lower_candidates = sorted({w.lower() for w in missing})
-        existing_lower = set()
-        if lower_candidates:
-            existing_lower = set(doc.get('word') for doc in current_app.db.words.find({'word': {'$in': lower_candidates}}, {'word': 1}))
 
         wb_doc = current_app.db.wordbooks.find_one({'_id': wb_id}) or {}
         entries = wb_doc.get('entries') or []
@@ -606,11 +604,8 @@ def create_or_update_secret_wordbook(student_id):
 
         new_entries = []
         for w in words:
-            if w in existing_exact:
-                key = w
-            else:
-                lw = w.lower()
-                key = lw if lw in existing_lower else None
+            # Exact dictionary match, else case-insensitive
+            key = resolve_word(current_app.db, w)
             if key and key not in already:
                 max_number += 1
                 new_entries.append({'number': max_number, 'word': key, 'tags': []})
@@ -620,6 +615,7 @@ def create_or_update_secret_wordbook(student_id):
 
         if new_entries:
             current_app.db.wordbooks.update_one({'_id': wb_id}, {'$push': {'entries': {'$each': new_entries}}})
+            refresh_wordbook_tags(current_app.db, wb_id)
             added = len(new_entries)
 
     # Track this wordbook (retain student's other follows) and lock by teacher
@@ -667,20 +663,10 @@ def create_secret_box():
     entries = []
     if words:
         words = sorted({w for w in words if isinstance(w, str) and w})
-        existing = set(doc.get('word') for doc in current_app.db.words.find({'word': {'$in': words}}, {'word': 1}))
-        missing = [w for w in words if w not in existing]
-        lower_candidates = sorted({w.lower() for w in missing})
-        existing_lower = set()
-        if lower_candidates:
-            existing_lower = set(doc.get('word') for doc in current_app.db.words.find({'word': {'$in': lower_candidates}}, {'word': 1}))
         n = 0
         seen = set()
         for w in words:
-            if w in existing:
-                key = w
-            else:
-                lw = w.lower()
-                key = lw if lw in existing_lower else None
+            key = resolve_word(current_app.db, w)
             if key and key not in seen:
                 n += 1
                 entries.append({'number': n, 'word': key, 'tags': []})
@@ -694,6 +680,8 @@ def create_secret_box():
         'creator_id': teacher_id,
         'accessibility': 'teacher_secret'
     })
+    if entries:
+        refresh_wordbook_tags(current_app.db, res.inserted_id)
     return jsonify({'_id': str(res.inserted_id), 'title': title, 'count': len(entries)}), 201
 
 @admin_bp.route('/api/admin/secret-boxes/<box_id>', methods=['DELETE'])
@@ -707,6 +695,7 @@ def delete_secret_box(box_id):
     res = current_app.db.wordbooks.delete_one({'_id': bid, 'creator_id': teacher_id, 'accessibility': 'teacher_secret'})
     if res.deleted_count == 0:
         return jsonify({'message': 'Wordbook not found or no permission'}), 404
+    refresh_wordbook_tags(current_app.db, bid)
     return jsonify({'message': 'Deleted'}), 200
 
 # ===== Public wordbooks for admin (teacher) =====
@@ -845,6 +834,7 @@ def assign_secret_from_box(student_id):
             already.add(w)
     if new_entries:
         current_app.db.wordbooks.update_one({'_id': wb_id}, {'$push': {'entries': {'$each': new_entries}}})
+        refresh_wordbook_tags(current_app.db, wb_id)
 
     # Track this wordbook for the student (retain others) and lock by teacher
     current_app.db.users.update_one({'_id': sid}, {'$addToSet': {'tracked_wordbooks': wb_id}})
@@ -901,3 +891,64 @@ def superadmin_users():
         return jsonify(users), 200
     except Exception as e:
         return jsonify({'message': 'Failed to fetch user data', 'error': str(e)}), 500
+
+@admin_bp.route('/api/superadmin/user-doc-stats', methods=['GET'])
+@superadmin_required
+def superadmin_user_doc_stats():
+    """Per-endpoint users-collection reads (queries and BSON bytes) seen by this worker process."""
+    stats = user_doc_stats()
+    rows = []
+    for endpoint, row in stats.items():
+        reqs = row.get('requests') or 0
+        rows.append({
+            'endpoint': endpoint,
+            'requests': reqs,
+            'queries': row.get('queries', 0),
+            'bytes': row.get('bytes', 0),
+            'avg_bytes': int((row.get('bytes', 0) / reqs) if reqs else 0)
+        })
+    rows.sort(key=lambda r: r['bytes'], reverse=True)
+    return jsonify(rows), 200
+
+@admin_bp.route('/api/superadmin/ai-cache-stats', methods=['GET'])
+@superadmin_required
+def superadmin_ai_cache_stats():
+    """Per-site AI response cache hits/misses seen by this worker process."""
+    stats = ai_cache_stats()
+    rows = []
+    for site, row in stats.items():
+        lookups = (row.get('hits') or 0) + (row.get('misses') or 0)
+        rows.append({
+            'site': site,
+            'hits': row.get('hits', 0),
+            'misses': row.get('misses', 0),
+            'stores': row.get('stores', 0),
+            'bypassed': row.get('bypassed', 0),
+            'hit_rate': round(row.get('hits', 0) / lookups, 3) if lookups else 0.0
+        })
+    rows.sort(key=lambda r: r['hits'] + r['misses'], reverse=True)
+    return jsonify(rows), 200
+
+@admin_bp.route('/api/superadmin/ai-gateway-stats', methods=['GET'])
+@superadmin_required
+def superadmin_ai_gateway_stats():
+    """In-flight/queued AI calls, per-priority admission counters and circuit-breaker state for this worker process."""
+    return jsonify({**ai_gateway_stats(), **ai_resilience_stats()}), 200
+
+@admin_bp.route('/api/superadmin/ai-telemetry', methods=['GET'])
+@superadmin_required
+def superadmin_ai_telemetry():
+    """Per-endpoint AI call counts, tokens, estimated cost and latency histogram for this worker process."""
+    return jsonify(ai_telemetry_stats()), 200
+
+@admin_bp.route('/api/superadmin/fill-blank-grading-stats', methods=['GET'])
+@superadmin_required
+def superadmin_fill_blank_grading_stats():
+    """Fill-blank answers graded locally vs by AI in this worker process."""
+    return jsonify(fill_blank_grading_stats()), 200
+
+@admin_bp.route('/api/superadmin/tts-cache-stats', methods=['GET'])
+@superadmin_required
+def superadmin_tts_cache_stats():
+    """TTS cache size and this worker's upstream fetches vs. misses served by a shared fetch."""
+    return jsonify(get_tts_cache().stats()), 200
@@ -5,6 +5,10 @@ from flask import Blueprint, request, jsonify, current_app
 from werkzeug.security import check_password_hash, generate_password_hash
 import pytz
 from ..decorators import superadmin_required
+from ..session import session_claims, invalidate_user
+from ..study_events import mark_rollup_review_done
+from ..review_schedule import has_due_reviews
+from ..streaks import record_streak_completion
 
 auth_bp = Blueprint('auth_bp', __name__)
 
@@ -66,7 +70,6 @@ def register():
             'tier': 'tier_3',
             'to_be_mastered': [],
             'words_mastered': [],
-            'study_logs': [],
             'last_login': None,
             'login_days': [],
         }
@@ -101,14 +104,10 @@ def login():
             if user.get('role') == 'user':
                 # Determine if to_be_mastered is empty and today's review list is empty
                 tbm_empty = len(user.get('to_be_mastered', []) or []) == 0
-                # Compute today's review list by scanning words_mastered.review_date for today
+                # Today's review list comes from the indexed review schedule
                 beijing_tz = pytz.timezone('Asia/Shanghai')
                 today_str = datetime.now(beijing_tz).strftime('%Y-%m-%d')
-                rvw_empty = True
-                for w in (user.get('words_mastered', []) or []):
-                    if today_str in (w.get('review_date') or []):
-                        rvw_empty = False
-                        break
+                rvw_empty = not has_due_reviews(current_app.db, user['_id'], today_str)
                 if tbm_empty and rvw_empty:
                     current_app.db.users.update_one(
                         {'_id': user['_id']},
@@ -117,6 +116,8 @@ def login():
                             'complete_revision_day': today_str
                         }}
                     )
+                    mark_rollup_review_done(current_app.db, user['_id'], today_str)
+                    record_streak_completion(current_app.db, user['_id'], today_str)
         except Exception:
             # Non-critical; ignore failures
             pass
@@ -133,8 +134,7 @@ def login():
             pass
 
         token = jwt.encode({
-            'user_id': str(user['_id']),
-            'role': user.get('role', 'user'),
+            **session_claims(user),
             'exp': datetime.now(timezone.utc) + timedelta(hours=24)
         }, current_app.config['SECRET_KEY'], algorithm="HS256")
 
@@ -191,8 +191,7 @@ def superadmin_login():
         pass
 
     token = jwt.encode({
-        'user_id': str(user['_id']),
-        'role': 'superadmin',
+        **session_claims(user),
         'exp': datetime.now(timezone.utc) + timedelta(hours=24)
     }, current_app.config['SECRET_KEY'], algorithm="HS256")
     return jsonify({'token': token}), 200
@@ -244,9 +243,10 @@ def superadmin_approve_teacher():
                 return jsonify({'message': 'Invalid user_id'}), 400
         else:
             query['username'] = username
-        result = current_app.db.users.update_one(query, {'$set': {'approved': True}})
-        if result.matched_count == 0:
+        result = current_app.db.users.find_one_and_update(query, {'$set': {'approved': True}}, projection={'_id': 1})
+        if not result:
             return jsonify({'message': 'No pending teacher found'}), 404
+        invalidate_user(result.get('_id'))
         return jsonify({'message': 'Approved'}), 200
     except Exception:
         return jsonify({'message': 'Approval failed'}), 500
@@ -279,8 +279,7 @@ def superadmin_impersonate():
         # Build token using target's role
         role = target.get('role', 'user')
         token = jwt.encode({
-            'user_id': str(target['_id']),
-            'role': role,
+            **session_claims(target),
             'exp': datetime.now(timezone.utc) + timedelta(hours=24)
         }, current_app.config['SECRET_KEY'], algorithm="HS256")
 
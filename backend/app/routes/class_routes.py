@@ -2,8 +2,10 @@ from flask import Blueprint, request, jsonify, g, current_app
 from bson.objectid import ObjectId
 from werkzeug.security import generate_password_hash
 from ..decorators import admin_required
-from .student_routes import get_review_words
-from .quiz_routes import compute_user_quiz_completion
+from ..dictionary_index import dictionary_words
+from ..class_stats import compute_class_stats
+from ..word_tags import refresh_wordbook_tags
+from ..tts_prewarm import class_words, prewarm_status, start_prewarm
 import pytz
 from datetime import datetime, timedelta
 from bson.objectid import ObjectId
@@ -717,7 +719,7 @@ def assign_from_wordbook_to_student(class_id, student_id):
     for e in (user_doc.get('words_mastered') or []):
         w = e.get('word') if isinstance(e, dict) else e
         if isinstance(w, str): existing.add(w)
-    valid_words = set(doc.get('word') for doc in current_app.db.words.find({}, {'word': 1}) if doc.get('word'))
+    valid_words = dictionary_words(current_app.db)
     entries = wb.get('entries') or []
     entries_sorted = sorted(entries, key=lambda e: e.get('number', 0))
     candidates = []
@@ -780,111 +782,42 @@ def get_class_stats(class_id):
     - Assignment completion rates.
     """
     try:
-        # --- Date Range Setup ---
-        start_date_str = request.args.get('start_date')
-        beijing_tz = pytz.timezone('Asia/Shanghai')
-
-        # 1. Get the class first (used to determine default start date from first assignment)
         target_class, err = _get_class_if_teacher(class_id)
         if err:
             return err
+        # Range defaults to the class's first assigned batch, else the last 7 days
+        stats, _ = compute_class_stats(current_app.db, [target_class], request.args.get('start_date'))
+        return jsonify(stats.get(target_class['_id']) or []), 200
 
-        # Determine default start date: earliest assigned_date from class-level batches
-        default_start = None
-        try:
-            batches = target_class.get('assignment_word_batches', []) or []
-            dates = [b.get('assigned_date') for b in batches if isinstance(b, dict) and b.get('assigned_date')]
-            if dates:
-                earliest = min(dates)
-                default_start = datetime.strptime(earliest, '%Y-%m-%d').astimezone(beijing_tz)
-        except Exception:
-            default_start = None
-
-        if start_date_str:
-            start_date = datetime.strptime(start_date_str, '%Y-%m-%d').astimezone(beijing_tz)
-        elif default_start:
-            start_date = default_start
-        else:
-            # Fallback to the last 7 days
-            start_date = datetime.now(beijing_tz) - timedelta(days=6)
-
-        end_date = datetime.now(beijing_tz)
-        # Ensure start_date is at the beginning of the day
-        start_date = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
-
-        total_days_in_range = (end_date.date() - start_date.date()).days + 1
-        if total_days_in_range <= 0:
-            total_days_in_range = 1
-
-        # 2. Get the class's student IDs
-        student_ids = target_class.get('students', [])
-        if not student_ids:
-            return jsonify([]), 200
-
-        # 3. Get all student documents at once for efficiency
-        students_cursor = current_app.db.users.find({'_id': {'$in': student_ids}})
-        students_map = {s['_id']: s for s in students_cursor}
-
-        # Assignment completion now unified to quiz completion; no legacy submissions lookup
-
-        # 6. Combine all data for the final response
-        final_stats = []
-        start_date_str_for_compare = start_date.strftime('%Y-%m-%d')
-
-        for student_id, student_doc in students_map.items():
-            # Real-time stats
-            completed_today_learning = len(student_doc.get('to_be_mastered', [])) == 0
-            review_words = get_review_words(student_doc)
-            completed_today_review = len(review_words) == 0
-
-            # --- Lazy, in-app daily completion tracking (no crontab) ---
-            # If student has cleared today's tasks, persist today's date into the arrays.
-            today_str = datetime.now(beijing_tz).strftime('%Y-%m-%d')
-            updated_learn_days = set(student_doc.get('complete_exercise_day', []) or [])
-            updated_review_days = set(student_doc.get('complete_revision_day', []) or [])
-
-            if completed_today_learning and today_str not in updated_learn_days:
-                try:
-                    current_app.db.users.update_one({'_id': student_id}, {'$addToSet': {'complete_exercise_day': today_str}})
-                    updated_learn_days.add(today_str)
-                except Exception as _:
-                    pass
-            if completed_today_review and today_str not in updated_review_days:
-                try:
-                    current_app.db.users.update_one({'_id': student_id}, {'$addToSet': {'complete_revision_day': today_str}})
-                    updated_review_days.add(today_str)
-                except Exception as _:
-                    pass
-
-            # Historical stats derived from recorded days (including today's lazy add)
-            learning_days_completed = [d for d in updated_learn_days if d >= start_date_str_for_compare]
-            review_days_completed = [d for d in updated_review_days if d >= start_date_str_for_compare]
+    except Exception as e:
+        current_app.logger.error(f"获取班级统计数据时出错: {e}")
+        return jsonify({'message': '获取班级统计数据时发生内部错误', 'error': str(e)}), 500
 
-            learning_rate = (len(learning_days_completed) / total_days_in_range * 100)
-            review_rate = (len(review_days_completed) / total_days_in_range * 100)
 
-            # Quiz-based completion stats (unified)
+@class_bp.route('/api/classes/stats', methods=['GET'])
+@admin_required
+def get_multi_class_stats():
+    """
+    Same rows as /api/classes/<id>/stats for several classes in one pass.
+    Query: class_ids (comma-separated; default: all classes of the teacher), start_date
+    Returns: { class_id: [row, ...] }
+    """
+    teacher_id = g.current_user.get('_id')
+    try:
+        raw = [c.strip() for c in (request.args.get('class_ids') or '').split(',') if c.strip()]
+        query = {'teachers': teacher_id}
+        if raw:
             try:
-                comp = compute_user_quiz_completion(student_doc.get('username'))
-                assignment_rate = comp.get('completion_rate', 0)
+                query['_id'] = {'$in': [ObjectId(c) for c in raw]}
             except Exception:
-                assignment_rate = 0
-
-            final_stats.append({
-                'student_id': str(student_id),
-                'username': student_doc['username'],
-                'nickname': student_doc.get('nickname', ''),
-                'completed_today_learning': completed_today_learning,
-                'completed_today_review': completed_today_review,
-                'learning_completion_rate': round(learning_rate, 2),
-                'review_completion_rate': round(review_rate, 2),
-                'assignment_completion_rate': round(assignment_rate, 2)
-            })
-            
-        return jsonify(final_stats), 200
-
+                return jsonify({'message': '无效的班级ID格式'}), 400
+        classes = list(current_app.db.classes.find(query, {'students': 1, 'assignment_word_batches': 1}))
+        if raw and len(classes) != len(set(raw)):
+            return jsonify({'message': '无权限访问部分班级或班级不存在'}), 403
+        stats, _ = compute_class_stats(current_app.db, classes, request.args.get('start_date'))
+        return jsonify({str(cid): rows for cid, rows in stats.items()}), 200
     except Exception as e:
-        current_app.logger.error(f"获取班级统计数据时出错: {e}")
+        current_app.logger.error(f"获取多个班级统计数据时出错: {e}")
         return jsonify({'message': '获取班级统计数据时发生内部错误', 'error': str(e)}), 500
 
 @class_bp.route('/api/classes/<class_id>/exams', methods=['GET'])
@@ -1052,6 +985,7 @@ def set_class_secret_from_box(class_id):
                     continue
         if new_entries:
             current_app.db.wordbooks.update_one({'_id': wb_id}, {'$push': {'entries': {'$each': new_entries}}})
+            refresh_wordbook_tags(current_app.db, wb_id)
 
         # Track this wordbook (retain student's other follows) and lock by teacher
         current_app.db.users.update_one({'_id': sid}, {'$addToSet': {'tracked_wordbooks': wb_id}})
@@ -1108,3 +1042,27 @@ def get_student_exam_history(class_id, student_id):
     except Exception as e:
         current_app.logger.error(f"获取学生测验历史时出错: {e}")
         return jsonify({'message': '获取学生测验历史时发生内部错误', 'error': str(e)}), 500
+
+
+@class_bp.route('/api/classes/<class_id>/tts-prewarm', methods=['POST', 'GET'])
+@admin_required
+def prewarm_class_tts(class_id):
+    """
+    POST: synthesize the audio missing for the class's assigned words in the
+    background (202). GET: progress of the last run.
+    """
+    target_class, err = _get_class_if_teacher(class_id)
+    if err:
+        return err
+    source = f'class:{class_id}'
+    if request.method == 'GET':
+        status = prewarm_status(current_app.db, source)
+        if status is None:
+            return jsonify({'message': 'No pre-warm run for this class'}), 404
+        return jsonify(status), 200
+    words = class_words(current_app.db, class_id)
+    try:
+        started = start_prewarm(current_app.db, words, source)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 503
+    return jsonify({'source': source, 'words': len(words), 'started': started}), 202
@@ -1,88 +1,158 @@
 from flask import Blueprint, request, jsonify, g, current_app
 from bson.objectid import ObjectId
 from ..decorators import admin_required
+from ..ai_gateway import AIGatewayError, gateway, PRIORITY_GENERATION
+from ..ai_batch import run_batched
+from ..sse import EventSink, wants_event_stream, event_stream_response
 import pytz
 from datetime import datetime
 import json
 
 exam_bp = Blueprint('exam_bp', __name__)
 
-@exam_bp.route('/api/exams/generate-preview', methods=['POST'])
-@admin_required
-def generate_exam_preview():
-    """
-    Generates a preview of an exam with fill-in-the-blank and translation questions.
-    Uses a single AI call per word for efficiency and consistency.
-    """
-    data = request.get_json()
-    words = data.get('words')
-
-    if not words:
-        return jsonify({'message': 'Words list is required'}), 400
-
-    system_prompt = """
+_PREVIEW_SYSTEM_PROMPT = """
     You are an expert curriculum designer creating English materials for Grade 7 students in mainland China.
     Your response MUST be a single, valid JSON object and nothing else. Do not include any text, explanations, or markdown formatting before or after the JSON object.
     All generated content must be simple enough for a Grade 7 student to understand.
     """
-    
-    questions = []
-    try:
-        from ..ai import call_deepseek_api
-        user_id = g.current_user['_id']
 
-        for word in words:
-            word_doc = current_app.db.words.find_one({'word': word})
-            if not word_doc:
-                continue
 
-            word_root = word_doc.get('word_root', word.split('(')[0])
-            definition_cn = word_doc.get('definition_cn', '')
+def _preview_prompt(specs):
+    listing = "\n".join(
+        json.dumps({'word': sp['word'], 'root': sp['root'], 'meaning_cn': sp['meaning_cn']}, ensure_ascii=False)
+        for sp in specs
+    )
+    return f"""
+            For each word below (one JSON object per line: the word as given, its root form and its Chinese meaning),
+            generate two sentences for a Grade 7 learner using the root form:
 
-            user_prompt = f"""
-            For the word \"{word_root}\" (Chinese meaning: {definition_cn}), generate two sentences for a Grade 7 learner:
+            {listing}
 
-            Requirements:
+            Requirements for every word:
             - The two sentences must be different in context.
             - The translation sentence should be extremely simple and easy to translate.
             - The fill-in-the-blank sentence and the translation sentence must NOT be direct translations of each other.
             - Avoid difficult vocabulary in the translation sentence.
 
-            Return JSON with the following structure:
+            Return JSON with exactly one item per word, in this structure:
             {{
-              "fill_in_blank": "An English sentence appropriate for a Grade 7 learner where the word {word_root} is replaced by '_____'.",
-              "translation": "A very simple Chinese sentence to be translated into an English sentence using {word_root}."
+              "items": [
+                {{
+                  "word": "The word exactly as given above.",
+                  "fill_in_blank": "An English sentence appropriate for a Grade 7 learner where the root form is replaced by '_____'.",
+                  "translation": "A very simple Chinese sentence to be translated into an English sentence using the root form."
+                }}
+              ]
             }}
             """
 
-            response_str = call_deepseek_api(
-                user_prompt=user_prompt,
-                system_prompt=system_prompt,
-                expect_json=True,
-                model='deepseek-chat',
-                user_id=user_id
-            )
-            
-            response_data = json.loads(response_str)
-
-            questions.append({
-                'word': word,
-                'fill_in_blank': {
-                    'sentence': response_data.get('fill_in_blank', '').strip()
-                },
-                'translation': {
-                    'sentence': response_data.get('translation', '').strip()
-                }
-            })
 
-        return jsonify(questions), 200
+def _validate_preview_item(spec, item):
+    fill = item.get('fill_in_blank')
+    translation = item.get('translation')
+    if not isinstance(fill, str) or '___' not in fill:
+        return None
+    if not isinstance(translation, str) or not translation.strip():
+        return None
+    return {'fill_in_blank': fill.strip(), 'translation': translation.strip()}
 
-    except json.JSONDecodeError as e:
-        current_app.logger.error(f"AI response JSON parsing failed: {e}")
-        return jsonify({'message': 'Failed to parse AI response', 'error': str(e)}), 500
-    except Exception as e:
-        current_app.logger.error(f"Error in generate_exam_preview: {e}")
-        return jsonify({'message': 'Failed to generate quiz preview', 'error': str(e)}), 500
+
+@exam_bp.route('/api/exams/generate-preview', methods=['POST'])
+@admin_required
+def generate_exam_preview():
+    """
+    Generates a preview of an exam with fill-in-the-blank and translation questions.
+    Distinct words are packed into batched AI calls (batch_size per call, default
+    AI_BATCH_SIZE); the batches run concurrently within the AI gateway's generation
+    budget. Words that fail (unknown word, AI error, bad item) come back with an
+    'error' field and empty sentences instead of failing the whole preview.
+    With ?stream=1 (or Accept: text/event-stream) each word is sent as a 'question'
+    server-sent event when it is ready, then 'result' carries the full list.
+    """
+    data = request.get_json() or {}
+    words = data.get('words')
+
+    if not words or not isinstance(words, list):
+        return jsonify({'message': 'Words list is required'}), 400
+
+    # Distinct words, first-seen order
+    unique_words = list(dict.fromkeys(w for w in words if isinstance(w, str) and w))
+    if not unique_words:
+        return jsonify({'message': 'Words list is required'}), 400
+
+    try:
+        batch_size = int(data.get('batch_size') or 0) or None
+    except (TypeError, ValueError):
+        batch_size = None
+
+    from ..ai import call_deepseek_api
+    user_id = g.current_user['_id']
+    app = current_app._get_current_object()
+
+    def question(w, res, error):
+        res = res or {}
+        item = {
+            'word': w,
+            'fill_in_blank': {'sentence': res.get('fill_in_blank', '')},
+            'translation': {'sentence': res.get('translation', '')}
+        }
+        if error:
+            item['error'] = error
+        return item
+
+    def produce(sink):
+        try:
+            word_docs = {}
+            for doc in current_app.db.words.find({'word': {'$in': unique_words}}, {'word': 1, 'word_root': 1, 'definition_cn': 1}):
+                word_docs.setdefault(doc.get('word'), doc)
+
+            specs = []
+            for w in unique_words:
+                doc = word_docs.get(w)
+                if doc:
+                    specs.append({'word': w, 'root': doc.get('word_root', w.split('(')[0]), 'meaning_cn': doc.get('definition_cn', '')})
+                else:
+                    sink.emit('question', question(w, None, 'Word not found in dictionary'))
+
+            def call(prompt):
+                with app.app_context():
+                    return call_deepseek_api(
+                        user_prompt=prompt,
+                        system_prompt=_PREVIEW_SYSTEM_PROMPT,
+                        expect_json=True,
+                        model='deepseek-chat',
+                        user_id=user_id,
+                        priority=PRIORITY_GENERATION,
+                        site='exam_preview'
+                    )
+
+            results, errors = run_batched(
+                specs, _preview_prompt, call, _validate_preview_item,
+                batch_size=batch_size,
+                workers=max(1, gateway.max_concurrency - gateway.grading_reserved),
+                log=current_app.logger.warning,
+                on_item=lambda w, res, error: sink.emit('question', question(w, res, error))
+            )
+
+            questions = []
+            for w in unique_words:
+                if w not in word_docs:
+                    questions.append(question(w, None, 'Word not found in dictionary'))
+                else:
+                    questions.append(question(w, results.get(w), errors.get(w)))
+            return questions, 200
+
+        except AIGatewayError:
+            # Answered as 429/503 with Retry-After (or an SSE error event)
+            raise
+        except Exception as e:
+            current_app.logger.error(f"Error in generate_exam_preview: {e}")
+            return {'message': 'Failed to generate quiz preview', 'error': str(e)}, 500
+
+    if wants_event_stream():
+        return event_stream_response(produce)
+    body, status = produce(EventSink())
+    return jsonify(body), status
 
 
 @exam_bp.route('/api/exams/drafts', methods=['POST'])
@@ -1,18 +1,16 @@
-from flask import Blueprint, jsonify, g, current_app, request, Response
+from flask import Blueprint, jsonify, g, current_app, request, Response, send_file
 from ..decorators import token_required, admin_required
+from ..ghost_cleanup import run_ghost_cleanup
+from ..tts_cache import get_tts_cache
+from ..tts_upstream import (
+    TTSUpstreamError, access_token, clip_ext, default_app_cfg, default_audio_cfg, default_user_cfg,
+    fetch_tts_audio, request_headers, tts_cache_key, tts_url
+)
 import os
-import json
-import hashlib
-from pathlib import Path
 from urllib import request as urlrequest
 from urllib.error import URLError, HTTPError
-import base64
-import time
 import traceback
 import uuid
-from urllib import request as _ureq
-from urllib import error as _uerr
-import json as _json
 
 misc_bp = Blueprint('misc_bp', __name__)
 
@@ -37,143 +35,37 @@ def admin_resource():
 @admin_required
 def cleanup_ghosts():
     """
-    One-click cleanup for ghost data across admin-managed collections.
-    - Removes invalid word documents (missing/empty 'word').
-    - Removes ghost entries from all wordbooks (entries.word not in words collection).
-    Returns a summary of changes.
+    Advance the ghost cleanup job (see app.ghost_cleanup) on demand.
+    - Removes invalid word documents (missing/empty/non-ASCII 'word') and duplicate words.
+    - Removes ghost and duplicate entries from all wordbooks.
+    Body (all optional): dry_run (bool), max_batches (default 10, 0 = until done),
+    batch_size (default 500), restart (bool, start a new pass).
+    Returns the summary of the current pass with its phase and whether it finished.
     """
-    summary = {
-        'invalid_words_deleted': 0,
-        'duplicate_words_deleted': 0,
-        'wordbooks_affected': 0,
-        'entries_removed': 0,
-        'wordbook_duplicate_entries_removed': 0
-    }
-
-    try:
-        # 1) Delete invalid word docs (missing/empty/non-ASCII)
-        res = current_app.db.words.delete_many({
-            '$or': [
-                {'word': {'$exists': False}},
-                {'word': {'$type': 10}},  # null
-                {'word': ''},
-                {'word': {'$regex': '^\\s+$'}},
-                {'word': {'$regex': '[^\\x00-\\x7F]'}}  # contains non-ASCII characters
-            ]
-        })
-        summary['invalid_words_deleted'] = getattr(res, 'deleted_count', 0)
-
-        # 2) Deduplicate words collection by identical 'word' value
-        try:
-            dup_groups = list(current_app.db.words.aggregate([
-                { '$group': { '_id': '$word', 'ids': { '$push': '$_id' }, 'count': { '$sum': 1 } } },
-                { '$match': { 'count': { '$gt': 1 } } }
-            ]))
-            to_delete_ids = []
-            for grp in dup_groups:
-                ids = grp.get('ids', [])
-                if not ids:
-                    continue
-                # Keep the earliest inserted (min ObjectId), delete the rest
-                keep_id = min(ids)
-                to_delete_ids.extend([i for i in ids if i != keep_id])
-            if to_delete_ids:
-                del_res = current_app.db.words.delete_many({'_id': {'$in': to_delete_ids}})
-                summary['duplicate_words_deleted'] = getattr(del_res, 'deleted_count', len(to_delete_ids))
-        except Exception:
-            pass
-
-        # 3) Build existing words set
-        existing_words = set(
-            doc.get('word') for doc in current_app.db.words.find({}, {'word': 1}) if doc.get('word')
-        )
-
-        # 4) Remove ghost and duplicate entries from all wordbooks
-        cursor = current_app.db.wordbooks.find({}, {'entries': 1})
-        for wb in cursor:
-            entries = wb.get('entries', []) or []
-            # Remove ghost entries
-            book_words = [e.get('word') for e in entries if isinstance(e, dict) and e.get('word')]
-            ghost_set = set(w for w in book_words if w not in existing_words)
-            removed_ghosts = 0
-            if ghost_set:
-                before = len(entries)
-                entries = [e for e in entries if e.get('word') not in ghost_set]
-                removed_ghosts = before - len(entries)
-            # Deduplicate identical word entries (keep first occurrence)
-            seen = set()
-            deduped = []
-            removed_dups = 0
-            for e in entries:
-                w = e.get('word') if isinstance(e, dict) else None
-                if not w:
-                    continue
-                if w in seen:
-                    removed_dups += 1
-                    continue
-                seen.add(w)
-                deduped.append(e)
-            if removed_ghosts or removed_dups:
-                current_app.db.wordbooks.update_one({'_id': wb['_id']}, {'$set': {'entries': deduped}})
-                summary['wordbooks_affected'] += 1
-                summary['entries_removed'] += removed_ghosts
-                summary['wordbook_duplicate_entries_removed'] += removed_dups
-
-        return jsonify({'message': 'Ghost cleanup completed', 'summary': summary}), 200
-    except Exception as e:
-        return jsonify({'message': 'Ghost cleanup failed', 'error': str(e), 'summary': summary}), 500
+    data = request.get_json(silent=True) or {}
 
+    def _flag(name):
+        v = data.get(name, request.args.get(name))
+        return str(v).lower() in ('1', 'true', 'yes', 'y')
 
-def _tts_cache_dir() -> Path:
-    d = Path(os.getenv('TTS_CACHE_DIR', '/tmp/piper_cache'))
     try:
-        d.mkdir(parents=True, exist_ok=True)
+        max_batches = int(data.get('max_batches', request.args.get('max_batches', 10)))
+        batch_size = int(data.get('batch_size', request.args.get('batch_size', 500)))
     except Exception:
-        pass
-    return d
-
-
-def _tts_cache_key(voice_type: str, encoding: str, speed_ratio: float, text: str) -> str:
-    base = f"{voice_type}|{encoding}|{speed_ratio}|{text}".encode('utf-8')
-    return hashlib.sha1(base).hexdigest()
-
+        return jsonify({'message': 'Invalid max_batches or batch_size'}), 400
 
-def _tts_cache_path(key: str, encoding: str) -> Path:
-    ext = '.mp3' if encoding.lower() == 'mp3' else (
-        '.wav' if encoding.lower() == 'wav' else (
-            '.ogg' if encoding.lower() == 'ogg' else f".{encoding.lower()}"
-        )
-    )
-    return _tts_cache_dir() / f"{key}{ext}"
-
-
-def _prune_cache(max_bytes: int):
-    d = _tts_cache_dir()
     try:
-        files = [p for p in d.iterdir() if p.is_file()]
-    except Exception:
-        return
-    total = 0
-    infos = []
-    for f in files:
-        try:
-            s = f.stat()
-            total += s.st_size
-            infos.append((f, s.st_mtime, s.st_size))
-        except Exception:
-            continue
-    if total <= max_bytes:
-        return
-    # delete oldest by mtime until under limit
-    infos.sort(key=lambda x: x[1])
-    for f, _, size in infos:
-        try:
-            f.unlink(missing_ok=True)
-        except Exception:
-            pass
-        total -= size
-        if total <= max_bytes:
-            break
+        summary = run_ghost_cleanup(
+            current_app.db,
+            dry_run=_flag('dry_run'),
+            batch_size=max(1, min(batch_size, 5000)),
+            max_batches=max_batches if max_batches > 0 else None,
+            restart=_flag('restart')
+        )
+        message = 'Ghost cleanup completed' if summary.get('done') else 'Ghost cleanup in progress'
+        return jsonify({'message': message, 'summary': summary}), 200
+    except Exception as e:
+        return jsonify({'message': 'Ghost cleanup failed', 'error': str(e)}), 500
 
 
 def _infer_content_type(encoding: str) -> str:
@@ -187,20 +79,66 @@ def _infer_content_type(encoding: str) -> str:
     return 'application/octet-stream'
 
 
-def _cache_key(text: str, voice: str, encoding: str, speed: float) -> str:
-    return _tts_cache_key(voice, encoding, speed, text)
+_TTS_KEY_LEN = 40  # sha1 hex
 
 
-def _cache_path_for(key: str, encoding: str) -> Path:
-    return _tts_cache_path(key, encoding)
+def _tts_audio_url(key: str, ext: str) -> str:
+    return f"/api/tts/audio/{key}.{ext}"
 
 
-def _prune_cache_if_needed():
+def _send_tts_clip(cache, path, key: str, ext: str):
+    """
+    Serve a cached clip without reading it into Python: nginx sends the file when
+    TTS_ACCEL_REDIRECT_PREFIX names an internal location aliased to the cache root,
+    otherwise send_file hands it to the server's file wrapper (sendfile). Either way
+    the response carries a strong ETag (the cache key plus the file's mtime, so a
+    clip regenerated after eviction gets a new one), Last-Modified and a long
+    Cache-Control; conditional GETs get 304 and Range requests 206.
+    """
+    mime = _infer_content_type(ext)
+    max_age = int(os.getenv('TTS_HTTP_MAX_AGE', str(30 * 24 * 3600)))
+    st = path.stat()
+    etag = f"{key}-{int(st.st_mtime):x}"
+    accel_prefix = os.getenv('TTS_ACCEL_REDIRECT_PREFIX', '').strip()
+    if accel_prefix:
+        rel = path.relative_to(cache.root).as_posix()
+        resp = Response(status=200, mimetype=mime)
+        resp.headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + rel
+        resp.set_etag(etag)
+        resp.last_modified = int(st.st_mtime)
+        resp.cache_control.public = True
+        resp.cache_control.max_age = max_age
+        resp = resp.make_conditional(request)
+    else:
+        resp = send_file(str(path), mimetype=mime, conditional=True, etag=etag,
+                         last_modified=st.st_mtime, max_age=max_age)
+    resp.cache_control.immutable = True
+    resp.headers['Content-Disposition'] = f'inline; filename="speech.{ext}"'
+    resp.headers['X-TTS-Key'] = key
+    resp.headers['Content-Location'] = _tts_audio_url(key, ext)
+    return resp
+
+
+@misc_bp.route('/api/tts/audio/<name>', methods=['GET'])
+def tts_audio(name):
+    """
+    Cached clip by key (<sha1>.<ext>, as returned in X-TTS-Key / Content-Location
+    by /api/tts/say). Public and cacheable so browsers and CDNs can keep it; it
+    only serves clips that are already cached and never calls the TTS provider.
+    """
+    key, dot, ext = name.partition('.')
+    if (not dot or len(key) != _TTS_KEY_LEN or not ext.isalnum()
+            or any(c not in '0123456789abcdef' for c in key)):
+        return jsonify({'error': 'invalid audio key'}), 404
+    cache = get_tts_cache()
     try:
-        max_bytes = int(os.getenv('TTS_CACHE_MAX_BYTES', str(3 * 1024 * 1024 * 1024)))
-    except Exception:
-        max_bytes = 3 * 1024 * 1024 * 1024
-    _prune_cache(max_bytes)
+        path = cache.get(key, ext)
+    except Exception as e:
+        current_app.logger.warning(f"[TTS] cache lookup failed key={key}: {e}")
+        path = None
+    if path is None:
+        return jsonify({'error': 'audio not found'}), 404
+    return _send_tts_clip(cache, path, key, ext)
 
 
 def _mask_token(tok: str) -> str:
@@ -233,10 +171,13 @@ def tts_say():
     - Simple payload: { text, length_scale? }
     - Vendor schema: { app, user, audio, request }
     - Upstream requires Authorization: Bearer;ACCESS_TOKEN and appid/token in body.app
+    - as_url: true answers { key, url } once the clip is cached instead of the
+      audio; url is the public GET /api/tts/audio/<key>.<ext>, which browsers cache
     Defaults: voice BV503_streaming, encoding mp3, rate 24000
     """
     data = request.get_json(silent=True) or {}
     text = (data.get('text') or '').strip()
+    as_url = bool(data.get('as_url'))
 
     app_cfg = data.get('app') or {}
     user_cfg = data.get('user') or {}
@@ -250,41 +191,25 @@ def tts_say():
         except Exception:
             length_scale = 1.0
         # For max compatibility with working curl, do NOT send speed_ratio/text_type here
-        audio_cfg = {
-            'voice_type': os.getenv('VOLCANO_VOICE_TYPE', 'BV503_streaming') or 'BV503_streaming',
-            'encoding': os.getenv('TTS_DEFAULT_ENCODING', 'mp3'),
-            'rate': int(os.getenv('TTS_DEFAULT_RATE', '24000')),
-        }
+        audio_cfg = default_audio_cfg()
         req_cfg = {
             'reqid': str(uuid.uuid4()),
             'text': text,
             'operation': 'query',
         }
-        app_cfg = {
-            'appid': os.getenv('TTS_APP_ID', '') or os.getenv('VOLCANO_APP_ID', ''),
-            'token': os.getenv('TTS_ACCESS_TOKEN', '') or os.getenv('VOLCANO_TOKEN', ''),
-            'cluster': os.getenv('VOLCANO_CLUSTER', os.getenv('TTS_CLUSTER', 'volcano_tts')),
-        }
-        user_cfg = {'uid': os.getenv('VOLCANO_UID', 'demo_user')}
+        app_cfg = default_app_cfg()
+        user_cfg = default_user_cfg()
 
     # Required fields and defaults
     text = (req_cfg.get('text') or text).strip()
     if not text:
         return jsonify({'error': 'text is required'}), 400
     if not app_cfg:
-        app_cfg = {
-            'appid': os.getenv('TTS_APP_ID', '') or os.getenv('VOLCANO_APP_ID', ''),
-            'token': os.getenv('TTS_ACCESS_TOKEN', '') or os.getenv('VOLCANO_TOKEN', ''),
-            'cluster': os.getenv('VOLCANO_CLUSTER', os.getenv('TTS_CLUSTER', 'volcano_tts')),
-        }
+        app_cfg = default_app_cfg()
     if not user_cfg:
-        user_cfg = {'uid': os.getenv('VOLCANO_UID', 'demo_user')}
+        user_cfg = default_user_cfg()
     if not audio_cfg:
-        audio_cfg = {
-            'voice_type': os.getenv('VOLCANO_VOICE_TYPE', 'BV503_streaming') or 'BV503_streaming',
-            'encoding': os.getenv('TTS_DEFAULT_ENCODING', 'mp3'),
-            'rate': int(os.getenv('TTS_DEFAULT_RATE', '24000')),
-        }
+        audio_cfg = default_audio_cfg()
     if not req_cfg:
         req_cfg = {
             'reqid': str(uuid.uuid4()),
@@ -304,67 +229,41 @@ def tts_say():
     except Exception:
         speed_ratio = 1.0
 
-    key = _cache_key(text, voice_type, encoding, speed_ratio)
-    ext = 'mp3' if encoding == 'mp3' else ('wav' if encoding == 'wav' else ('ogg' if encoding in ('ogg', 'ogg_opus') else encoding))
-    cache_path = _cache_path_for(key, ext)
+    key = tts_cache_key(voice_type, encoding, speed_ratio, text)
+    ext = clip_ext(encoding)
+    cache = get_tts_cache()
     try:
-        current_app.logger.info(f"[TTS] cache lookup key={key} path={cache_path}")
-    except Exception:
-        pass
-    if cache_path.exists():
-        try:
-            now = time.time(); os.utime(cache_path, (now, now))
-        except Exception:
-            pass
-        mime = 'audio/wav' if ext == 'wav' else ('audio/mpeg' if ext == 'mp3' else ('audio/ogg' if ext in ('ogg', 'opus', 'ogg_opus') else 'application/octet-stream'))
-        return Response(cache_path.read_bytes(), mimetype=mime, headers={'Content-Disposition': f'inline; filename="speech.{ext}"'})
-
-    volcano_url = os.getenv('VOLCANO_TTS_URL') or 'https://openspeech.bytedance.com/api/v1/tts'
+        cache_path = cache.get(key, ext)
+    except Exception as e:
+        current_app.logger.warning(f"[TTS] cache lookup failed key={key}: {e}")
+        cache_path = None
+    if cache_path is not None:
+        if as_url:
+            return jsonify({'key': key, 'url': _tts_audio_url(key, ext)}), 200
+        return _send_tts_clip(cache, cache_path, key, ext)
+
+    volcano_url = tts_url()
     payload = {'app': app_cfg, 'user': user_cfg, 'audio': audio_cfg, 'request': req_cfg}
-    access_token = (app_cfg.get('token') or os.getenv('TTS_ACCESS_TOKEN', '') or os.getenv('VOLCANO_TOKEN', '')).strip()
-    if not app_cfg.get('appid') or not access_token:
+    token = access_token(app_cfg)
+    if not app_cfg.get('appid') or not token:
         return jsonify({'error': 'missing appid or access token'}), 400
-    headers = {'Content-Type': 'application/json', 'Authorization': f'Bearer;{access_token}'}
-
-    try:
-        req = _ureq.Request(volcano_url, data=_json.dumps(payload, ensure_ascii=False).encode('utf-8'), headers=headers)
-        with _ureq.urlopen(req, timeout=60) as resp:
-            body = resp.read()
-            try:
-                parsed = _json.loads(body.decode('utf-8'))
-            except Exception:
-                return jsonify({'error': 'TTS returned non-JSON'}), 502
-    except _uerr.HTTPError as e:
-        return jsonify({'error': f'TTS HTTP error: {e.code}', 'detail': e.read().decode('utf-8', 'ignore')}), 502
-    except _uerr.URLError as e:
-        return jsonify({'error': f'TTS network error: {e.reason}'}), 502
-    except Exception as e:
-        return jsonify({'error': f'TTS call failed: {e}'}), 502
-
-    code = parsed.get('code')
-    if code != 3000:
-        return jsonify({'error': 'TTS service error', 'code': code, 'message': parsed.get('message'), 'upstream': parsed}), 502
+    headers = request_headers(token)
 
-    b64 = parsed.get('data')
-    if not b64:
-        return jsonify({'error': 'TTS response missing audio data', 'upstream': parsed}), 502
+    # Concurrent misses for the same clip share one upstream call (and the
+    # cache evicts LRU clips itself once over budget)
     try:
-        audio_bytes = base64.b64decode(b64)
-    except Exception:
-        return jsonify({'error': 'Failed to decode audio data'}), 502
-
-    # Persist and prune cache
-    tmp = cache_path.with_suffix(cache_path.suffix + '.tmp')
-    try:
-        tmp.write_bytes(audio_bytes)
-        os.replace(tmp, cache_path)
-    except Exception:
+        cache_path, audio_bytes = cache.fetch_through(key, ext, lambda: fetch_tts_audio(volcano_url, payload, headers))
+    except TTSUpstreamError as e:
+        return jsonify(e.body), 502
+    if as_url:
+        if cache_path is None:
+            return jsonify({'error': 'audio could not be cached, request it without as_url'}), 503
+        return jsonify({'key': key, 'url': _tts_audio_url(key, ext)}), 200
+    if cache_path is not None:
         try:
-            if tmp.exists():
-                tmp.unlink(missing_ok=True)  # type: ignore[arg-type]
-        except Exception:
-            pass
-    _prune_cache_if_needed()
-
-    mime = 'audio/wav' if ext == 'wav' else ('audio/mpeg' if ext == 'mp3' else ('audio/ogg' if ext in ('ogg', 'ogg_opus') else 'application/octet-stream'))
-    return Response(audio_bytes, mimetype=mime, headers={'Content-Disposition': f'inline; filename="speech.{ext}"'})
+            return _send_tts_clip(cache, cache_path, key, ext)
+        except Exception as e:
+            current_app.logger.warning(f"[TTS] cached clip unavailable key={key}: {e}")
+    if audio_bytes is None:
+        return jsonify({'error': 'cached audio unavailable, please retry'}), 503
+    return Response(audio_bytes, mimetype=_infer_content_type(ext), headers={'Content-Disposition': f'inline; filename="speech.{ext}"'})
@@ -1,71 +1,24 @@
 from flask import Blueprint, request, jsonify, g, current_app
 from bson.objectid import ObjectId
 from ..decorators import token_required, admin_required
+from ..session import invalidate_user, load_user_fields
+from ..review_schedule import (
+    schedule_mastered_words, record_review, due_review_words, overdue_review_words,
+    upcoming_review_counts, schedule_map, remove_scheduled_words, REVIEW_STAGES
+)
+from ..dictionary_index import dictionary_words, resolve_word
+from ..streaks import record_streak_completion, streak_percentile
+from ..study_events import record_study_events, load_daily_rollups, get_daily_rollup, mark_rollup_review_done, secret_word_set
+from ..word_tags import refresh_wordbook_tags
 import pytz
 from datetime import datetime, timedelta
 import random
 from werkzeug.security import generate_password_hash
 import json
-import time
-from collections import Counter
 
 
 student_bp = Blueprint('student_bp', __name__)
 
-# --- lightweight, extensible cache for streak distribution ---
-# Caches all users' current streak (ending today) values for a short TTL.
-# For multi-process deployments, consider replacing with Redis or Mongo materialized view.
-_streak_cache = {
-    'date': None,          # 'YYYY-MM-DD' for which the cache is valid
-    'computed_at': 0.0,    # epoch seconds when cache was computed
-    'hist': {},            # histogram {streak_value: count}
-}
-
-def _is_cache_valid(today_str: str, ttl_seconds: int = 60) -> bool:
-    try:
-        if _streak_cache.get('date') != today_str:
-            return False
-        return (time.time() - float(_streak_cache.get('computed_at') or 0)) < ttl_seconds
-    except Exception:
-        return False
-
-def _build_streak_histogram(db, today_date) -> dict:
-    """Scan users to build a histogram of current streak values ending at today_date."""
-    def _to_date(s):
-        try:
-            return datetime.strptime(s, '%Y-%m-%d').date()
-        except Exception:
-            return None
-    hist = Counter()
-    cur = db.users.find({}, {'complete_exercise_day': 1, 'complete_revision_day': 1})
-    for ud in cur:
-        try:
-            ex = set((ud.get('complete_exercise_day') or []))
-            rv = set((ud.get('complete_revision_day') or []))
-            inter = ex.intersection(rv)
-            ds = sorted([_to_date(s) for s in inter if _to_date(s) is not None])
-            ds_set = set(ds)
-            cur_s = 0
-            cursor = today_date
-            while cursor in ds_set:
-                cur_s += 1
-                cursor = cursor - timedelta(days=1)
-            hist[cur_s] += 1
-        except Exception:
-            # treat as 0 streak if malformed
-            hist[0] += 1
-    return dict(hist)
-
-def _get_streak_histogram(db, today_date, today_str, ttl_seconds: int = 60) -> dict:
-    if _is_cache_valid(today_str, ttl_seconds):
-        return _streak_cache.get('hist') or {}
-    # rebuild
-    hist = _build_streak_histogram(db, today_date)
-    _streak_cache['date'] = today_str
-    _streak_cache['computed_at'] = time.time()
-    _streak_cache['hist'] = hist
-    return hist
-
 @student_bp.route('/api/student/dashboard-summary', methods=['GET'])
 @token_required
 def get_student_dashboard_summary():
@@ -75,16 +28,17 @@ def get_student_dashboard_summary():
     user = g.current_user
     if user.get('role') != 'user':
         return jsonify({'message': 'Students only'}), 403
+    # Study fields are not part of the slim session record; load them in one query
+    user = load_user_fields('words_mastered', 'to_be_mastered', 'vocab_mission', 'learning_goal',
+                            'first_login', 'tracked_wordbooks', 'linked_teachers')
 
     # Ensure words_mastered is always a list; also perform ghost-word cleanup
     try:
-        # Refresh latest user doc for accurate cleanup
-        user_db = current_app.db.users.find_one({'_id': user.get('_id')}) or {}
-        words_mastered = user_db.get('words_mastered', []) or []
-        to_be_mastered = user_db.get('to_be_mastered', []) or []
+        words_mastered = user.get('words_mastered', []) or []
+        to_be_mastered = user.get('to_be_mastered', []) or []
 
         # Build set of valid words from words collection
-        valid_words = set(w.get('word') for w in current_app.db.words.find({}, {'word': 1}))
+        valid_words = dictionary_words(current_app.db)
 
         def extract_word(x):
             if isinstance(x, dict):
@@ -109,6 +63,9 @@ def get_student_dashboard_summary():
                 {'_id': user.get('_id')},
                 {'$set': {'words_mastered': wm_filtered, 'to_be_mastered': tbm_dedup_cross}}
             )
+            ghost_mastered = [extract_word(e) for e in words_mastered if extract_word(e) not in valid_words]
+            if ghost_mastered:
+                remove_scheduled_words(current_app.db, ghost_mastered, user_id=user.get('_id'))
             # Reload latest user after mutation to ensure response matches DB
             user = current_app.db.users.find_one({'_id': user.get('_id')}) or user
             words_mastered = user.get('words_mastered', []) or []
@@ -156,45 +113,28 @@ def get_student_dashboard_summary():
     # Study goal quick stats (lightweight; detailed stats via /api/student/study-stats)
     beijing_tz = pytz.timezone('Asia/Shanghai')
     today_str = datetime.now(beijing_tz).strftime('%Y-%m-%d')
-    logs = user.get('study_logs', []) or []
-    today_learned = 0
+    try:
+        today_rollup = get_daily_rollup(current_app.db, user.get('_id'), today_str)
+    except Exception:
+        today_rollup = {}
+    today_learned = int(today_rollup.get('learned') or 0)
     # Secret wordbook detection: only for students bound to teacher(s).
     # Prefer unique tracked own-private wordbook; fallback to legacy title match
     secret_set = set()
     try:
-        udoc = current_app.db.users.find_one({'_id': user.get('_id')}, {'tracked_wordbooks':1, 'linked_teachers':1}) or {}
-        linked = udoc.get('linked_teachers') or []
-        if isinstance(linked, list) and len(linked) > 0:
-            tracked = [oid for oid in (udoc.get('tracked_wordbooks') or []) if oid]
-            tracked_docs = list(current_app.db.wordbooks.find({'_id': {'$in': tracked}}, {'_id':1,'title':1,'creator_id':1,'accessibility':1,'entries.word':1})) if tracked else []
-            own_priv = [w for w in tracked_docs if w.get('creator_id') == user.get('_id') and w.get('accessibility') == 'private']
-            candidate = own_priv[0] if len(own_priv) >= 1 else current_app.db.wordbooks.find_one({'creator_id': user.get('_id'), 'accessibility': 'private', 'title': '秘制词库'}, {'entries.word': 1})
-            if candidate:
-                for e in (candidate.get('entries') or []):
-                    if isinstance(e, dict) and isinstance(e.get('word'), str):
-                        secret_set.add(e.get('word'))
+        secret_set = secret_word_set(current_app.db, user.get('_id'), user) or set()
     except Exception:
         pass
-    secret_today_learned = 0
+    secret_today_learned = int(today_rollup.get('secret_learned') or 0) if secret_set else 0
     has_secret = False
     secret_wordbook_completed = False
     # Whether the student is linked to any teacher
     has_teacher = False
     try:
-        udoc = current_app.db.users.find_one({'_id': user.get('_id')}, {'linked_teachers': 1}) or {}
-        lt = udoc.get('linked_teachers') or []
+        lt = user.get('linked_teachers') or []
         has_teacher = isinstance(lt, list) and len(lt) > 0
     except Exception:
         has_teacher = False
-    for lg in logs:
-        if isinstance(lg, dict) and lg.get('date') == today_str and lg.get('type') == 'learn':
-            today_learned += 1
-            w = lg.get('word')
-            try:
-                if isinstance(w, str) and w in secret_set:
-                    secret_today_learned += 1
-            except Exception:
-                pass
     daily_goal = user.get('learning_goal', 0) or 0
     # Goal is measured against secret wordbook if exists; else total
     goal_basis = secret_today_learned if secret_set else today_learned
@@ -215,6 +155,22 @@ def get_student_dashboard_summary():
         has_secret = False
         secret_wordbook_completed = False
 
+    # Attach the review schedule (remaining dates, review count) to each mastered entry
+    try:
+        sched = schedule_map(current_app.db, user.get('_id'))
+        enriched = []
+        for e in words_mastered:
+            if isinstance(e, dict) and e.get('word') in sched:
+                item = dict(e)
+                item['review_date'] = sched[e.get('word')].get('slots') or []
+                item['review_times'] = sched[e.get('word')].get('review_times') or 0
+                enriched.append(item)
+            else:
+                enriched.append(e)
+        words_mastered = enriched
+    except Exception:
+        pass
+
     return jsonify({
         'to_be_mastered': tbm_entries,
         'words_mastered': words_mastered,
@@ -254,18 +210,14 @@ def master_word():
         {'$pull': {'to_be_mastered': {'word': {'$in': words_to_master}}}}
     )
 
-    # 2. Add the words to 'words_mastered' with a review schedule
+    # 2. Add the words to 'words_mastered'; the review dates live in review_schedule
     beijing_tz = pytz.timezone('Asia/Shanghai')
     mastery_date = datetime.now(beijing_tz)
-    
-    review_intervals = [1, 3, 5, 7, 15, 30, 60, 90]
-    review_dates = [(mastery_date + timedelta(days=d)).strftime('%Y-%m-%d') for d in review_intervals]
 
     mastery_entries = [
         {
             'word': word_name,
-            'date_mastered': mastery_date.strftime('%Y-%m-%d'),
-            'review_date': review_dates
+            'date_mastered': mastery_date.strftime('%Y-%m-%d')
         }
         for word_name in words_to_master
     ]
@@ -278,13 +230,15 @@ def master_word():
         {'_id': user_id},
         {'$addToSet': {'words_mastered': {'$each': mastery_entries}}}
     )
+    schedule_mastered_words(current_app.db, user_id, words_to_master, mastery_date)
     # Study logs: record learned words for today
     try:
         beijing_tz = pytz.timezone('Asia/Shanghai')
         today_str = datetime.now(beijing_tz).strftime('%Y-%m-%d')
-        logs = [{'date': today_str, 'word': w, 'type': 'learn'} for w in words_to_master]
-        if logs:
-            current_app.db.users.update_one({'_id': user_id}, {'$push': {'study_logs': {'$each': logs}}})
+        udoc = load_user_fields('linked_teachers', 'tracked_wordbooks', 'learning_goal')
+        record_study_events(current_app.db, user_id, words_to_master, 'learn', today_str,
+                            secret_words=secret_word_set(current_app.db, user_id, udoc),
+                            goal=udoc.get('learning_goal', 0) or 0)
     except Exception:
         pass
     # After mastering, check daily completion status
@@ -312,12 +266,7 @@ def get_review_words(student_doc=None):
     beijing_tz = pytz.timezone('Asia/Shanghai')
     today_str = datetime.now(beijing_tz).strftime('%Y-%m-%d')
 
-    words_mastered = user.get('words_mastered', [])
-    
-    review_words = []
-    for word_entry in words_mastered:
-        if today_str in word_entry.get('review_date', []):
-            review_words.append(word_entry['word'])
+    review_words = due_review_words(current_app.db, user.get('_id'), today_str)
 
     # If called as an API endpoint, return JSON. Otherwise, return the list.
     if student_doc is None:
@@ -326,40 +275,76 @@ def get_review_words(student_doc=None):
         return review_words
 
 
+@student_bp.route('/api/student/review-schedule', methods=['GET'])
+@token_required
+def get_review_schedule():
+    """
+    Review outlook for the current student.
+    Query: days (default 7, max 90)
+    Returns: { due_today: [word], overdue: [word], upcoming: [{date, count}] }
+    """
+    user = g.current_user
+    if user.get('role') != 'user':
+        return jsonify({'message': '仅学生可访问'}), 403
+    try:
+        days = int(request.args.get('days', 7))
+    except Exception:
+        days = 7
+    days = max(1, min(days, 90))
+    try:
+        beijing_tz = pytz.timezone('Asia/Shanghai')
+        today = datetime.now(beijing_tz)
+        today_str = today.strftime('%Y-%m-%d')
+        end_str = (today + timedelta(days=days)).strftime('%Y-%m-%d')
+        due_today = due_review_words(current_app.db, user.get('_id'), today_str)
+        overdue = overdue_review_words(current_app.db, user.get('_id'), today_str)
+        upcoming = upcoming_review_counts(current_app.db, user.get('_id'), today_str, end_str)
+        return jsonify({
+            'due_today': due_today,
+            'overdue': overdue,
+            'upcoming': [{'date': d, 'count': c} for d, c in sorted(upcoming.items())]
+        }), 200
+    except Exception as e:
+        current_app.logger.error(f"Error review-schedule: {e}")
+        return jsonify({'message': '获取复习计划失败', 'error': str(e)}), 500
+
+
 @student_bp.route('/api/student/study-stats', methods=['GET'])
 @token_required
 def get_study_stats():
     """
-    Returns daily study counts for the last N days (default 30),
-    including learned_count, reviewed_count, and whether today's review is empty.
-    Also returns current learning_goal and computed streak of days meeting the goal.
+    Returns daily study counts from the first study day (or the last N days when
+    ?days=N is given), including learned_count, reviewed_count, and whether today's
+    review is empty. Also returns current learning_goal and computed streak of days meeting the goal.
     """
     user = g.current_user
     if user.get('role') != 'user':
         return jsonify({'message': 'Students only'}), 403
 
     try:
-        # Reload fresh user doc
-        user_doc = current_app.db.users.find_one({'_id': user.get('_id')}) or {}
-        logs = user_doc.get('study_logs', []) or []
+        user_doc = load_user_fields('learning_goal', 'linked_teachers', 'tracked_wordbooks')
 
         beijing_tz = pytz.timezone('Asia/Shanghai')
         today = datetime.now(beijing_tz).date()
+        today_str = today.strftime('%Y-%m-%d')
+        try:
+            days = int(request.args.get('days') or 0)
+        except Exception:
+            days = 0
+        start_str = (today - timedelta(days=days - 1)).strftime('%Y-%m-%d') if days > 0 else None
 
-        # Determine the first day that has any study/review log; if none, return empty
+        # One range query over the per-day rollups (bounded by the window, not account age)
+        rollups = load_daily_rollups(current_app.db, user.get('_id'), start_str, today_str)
+
+        # Determine the first day that has any study/review activity; if none, return empty
         first_date = None
-        for lg in logs:
-            try:
-                if not isinstance(lg, dict):
-                    continue
-                dstr = lg.get('date')
-                if not dstr:
+        for r in rollups:
+            if (r.get('learned') or 0) > 0 or (r.get('reviewed') or 0) > 0:
+                try:
+                    first_date = datetime.strptime(r.get('date'), '%Y-%m-%d').date()
+                    break
+                except Exception:
                     continue
-                dval = datetime.strptime(dstr, '%Y-%m-%d').date()
-                if (first_date is None) or (dval < first_date):
-                    first_date = dval
-            except Exception:
-                continue
 
         if first_date is None:
             return jsonify({
@@ -374,47 +359,22 @@ def get_study_stats():
         dates = [(first_date + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(0, days_span + 1)]
         # Initialize daily buckets
         counts = {d: {'date': d, 'learned': 0, 'reviewed': 0, 'learned_words': [], 'reviewed_words': [], 'review_done': False} for d in dates}
+        secret_counts = {}
 
-        for lg in logs:
-            if not isinstance(lg, dict):
-                continue
-            d = lg.get('date')
-            t = lg.get('type')
+        for r in rollups:
+            d = r.get('date')
             if d in counts:
-                if t == 'learn':
-                    counts[d]['learned'] += 1
-                    w = lg.get('word')
-                    if isinstance(w, str) and w:
-                        counts[d]['learned_words'].append(w)
-                elif t == 'review':
-                    counts[d]['reviewed'] += 1
-                    w = lg.get('word')
-                    if isinstance(w, str) and w:
-                        counts[d]['reviewed_words'].append(w)
-
-        # Build secret set if applicable (only when linked_teachers exists)
-        secret_set = set()
+                counts[d]['learned'] = int(r.get('learned') or 0)
+                counts[d]['reviewed'] = int(r.get('reviewed') or 0)
+                counts[d]['learned_words'] = [w for w in (r.get('learned_words') or []) if isinstance(w, str) and w]
+                counts[d]['reviewed_words'] = [w for w in (r.get('reviewed_words') or []) if isinstance(w, str) and w]
+                counts[d]['review_done'] = bool(r.get('review_done'))
+                secret_counts[d] = int(r.get('secret_learned') or 0)
+
+        # Secret wordbook applies only when linked_teachers exists
         has_secret = False
         try:
-            if isinstance(user_doc.get('linked_teachers') or [], list) and len(user_doc.get('linked_teachers') or []) > 0:
-                tracked = [oid for oid in (user_doc.get('tracked_wordbooks') or []) if oid]
-                tracked_docs = list(current_app.db.wordbooks.find({'_id': {'$in': tracked}}, {'_id':1,'title':1,'creator_id':1,'accessibility':1,'entries.word':1})) if tracked else []
-                own_priv = [w for w in tracked_docs if w.get('creator_id') == user.get('_id') and w.get('accessibility') == 'private']
-                candidate = own_priv[0] if len(own_priv) >= 1 else current_app.db.wordbooks.find_one({'creator_id': user.get('_id'), 'accessibility': 'private', 'title': '秘制词库'}, {'entries.word': 1})
-                if candidate:
-                    has_secret = True
-                    for e in (candidate.get('entries') or []):
-                        if isinstance(e, dict) and isinstance(e.get('word'), str):
-                            secret_set.add(e.get('word'))
-        except Exception:
-            pass
-
-        # Per-day review completion flag (based on user's completion record)
-        try:
-            completed_days = set((user_doc.get('complete_revision_day') or []))
-            for d in dates:
-                if d in completed_days:
-                    counts[d]['review_done'] = True
+            has_secret = secret_word_set(current_app.db, user.get('_id'), user_doc) is not None
         except Exception:
             pass
 
@@ -428,28 +388,15 @@ def get_study_stats():
         if goal > 0:
             # iterate backward from today until a day fails
             for d in reversed(dates):
-                basis = 0
-                if has_secret:
-                    try:
-                        basis = len([w for w in counts[d]['learned_words'] if isinstance(w, str) and w in secret_set])
-                    except Exception:
-                        basis = 0
-                else:
-                    basis = counts[d]['learned']
+                basis = secret_counts.get(d, 0) if has_secret else counts[d]['learned']
                 if basis >= goal:
                     streak += 1
                 else:
                     break
 
         # Today breakdown
-        today_str = today.strftime('%Y-%m-%d')
         today_total_learned = counts.get(today_str, {}).get('learned', 0)
-        today_secret_learned = 0
-        if has_secret:
-            try:
-                today_secret_learned = len([w for w in counts.get(today_str, {}).get('learned_words', []) if isinstance(w, str) and w in secret_set])
-            except Exception:
-                today_secret_learned = 0
+        today_secret_learned = secret_counts.get(today_str, 0) if has_secret else 0
 
         return jsonify({
             'by_day': [counts[d] for d in dates],
@@ -473,7 +420,7 @@ def set_learning_goal():
         return jsonify({'message': 'Students only'}), 403
     # If learning goal is locked by class, block changes from student side
     try:
-        fresh = current_app.db.users.find_one({'_id': user.get('_id')}, {'learning_goal_locked': 1, 'learning_goal_locked_by_class': 1}) or {}
+        fresh = load_user_fields('learning_goal_locked', 'learning_goal_locked_by_class')
         if fresh.get('learning_goal_locked') is True or fresh.get('learning_goal_locked_by_class'):
             return jsonify({'message': 'Learning goal is managed by your class and cannot be changed by student'}), 403
     except Exception:
@@ -570,7 +517,7 @@ def get_learning_preference():
     user = g.current_user
     if user.get('role') != 'user':
         return jsonify({'message': 'Students only'}), 403
-    doc = current_app.db.users.find_one({'_id': user.get('_id')}, {'learning_preference': 1}) or {}
+    doc = load_user_fields('learning_preference')
     pref = (doc.get('learning_preference') or {})
     # normalize ObjectId
     out = {}
@@ -694,7 +641,7 @@ def maybe_mark_daily_completion(user_id, user_doc=None):
     Uses $addToSet; safe to call multiple times.
     """
     try:
-        user = user_doc or current_app.db.users.find_one({'_id': user_id})
+        user = user_doc or current_app.db.users.find_one({'_id': user_id}, {'to_be_mastered.word': 1, 'learning_goal': 1})
         if not user:
             return
         tbm_empty = len(user.get('to_be_mastered', []) or []) == 0
@@ -727,6 +674,14 @@ def maybe_mark_daily_completion(user_id, user_doc=None):
                 current_app.db.users.update_one({'_id': user_id}, {'$push': {'daily_goal_records': {'date': today_str, 'goal': goal_val}}})
             except Exception:
                 pass
+            try:
+                mark_rollup_review_done(current_app.db, user_id, today_str, goal_val)
+            except Exception:
+                pass
+            try:
+                record_streak_completion(current_app.db, user_id, today_str)
+            except Exception:
+                pass
     except Exception:
         pass
 
@@ -745,13 +700,7 @@ def get_student_compact_stats():
         return jsonify({'message': 'Students only'}), 403
 
     try:
-        user_doc = current_app.db.users.find_one({'_id': user.get('_id')}, {
-            'complete_exercise_day': 1,
-            'complete_revision_day': 1,
-            'learning_goal': 1,
-            'study_logs': 1,
-            'daily_goal_records': 1
-        }) or {}
+        user_doc = load_user_fields('complete_exercise_day', 'complete_revision_day', 'learning_goal')
 
         beijing_tz = pytz.timezone('Asia/Shanghai')
         today = datetime.now(beijing_tz).date()
@@ -793,21 +742,17 @@ def get_student_compact_stats():
 
         today_achieved = (today in days_set)
 
-        # Today's learned count (from logs) and today's goal snapshot if exists
-        today_learned = 0
-        for lg in (user_doc.get('study_logs') or []):
-            try:
-                if isinstance(lg, dict) and lg.get('type') == 'learn' and lg.get('date') == today_str:
-                    today_learned += 1
-            except Exception:
-                pass
+        # Today's learned count and goal snapshot (taken when the day was completed) from the rollup
+        try:
+            today_rollup = get_daily_rollup(current_app.db, user.get('_id'), today_str)
+        except Exception:
+            today_rollup = {}
+        today_learned = int(today_rollup.get('learned') or 0)
 
         today_goal = None
         try:
-            for rec in (user_doc.get('daily_goal_records') or []):
-                if isinstance(rec, dict) and rec.get('date') == today_str:
-                    today_goal = int(rec.get('goal') or 0)
-                    break
+            if today_rollup.get('review_done') and today_rollup.get('goal') is not None:
+                today_goal = int(today_rollup.get('goal') or 0)
         except Exception:
             today_goal = None
         if today_goal is None:
@@ -816,13 +761,10 @@ def get_student_compact_stats():
             except Exception:
                 today_goal = 0
 
-        # Percentile: proportion of users with current_streak less than this user's
-        # Percentile with lightweight cache: build histogram once per TTL
+        # Percentile: proportion of users with current_streak less than this user's,
+        # read from today's shared streak_distribution histogram
         try:
-            hist = _get_streak_histogram(current_app.db, today, today_str, ttl_seconds=60)
-            total = sum(hist.values()) or 0
-            below = sum(cnt for streak_val, cnt in hist.items() if (streak_val or 0) < current_streak)
-            better_than_pct = int((below * 100) / total) if total > 0 else 0
+            better_than_pct = streak_percentile(current_app.db, today_str, current_streak)
         except Exception:
             better_than_pct = 0
 
@@ -859,33 +801,15 @@ def update_word_review():
     beijing_tz = pytz.timezone('Asia/Shanghai')
     today = datetime.now(beijing_tz)
     today_str = today.strftime('%Y-%m-%d')
-    
-    update_query = {}
-    
-    if result == 'pass':
-        # Pre-test passed: increment review count and remove today's review date.
-        update_query = {
-            '$inc': {'words_mastered.$.review_times': 1},
-            '$pull': {'words_mastered.$.review_date': today_str}
-        }
-    elif result == 'fail':
-        # Pre-test failed, re-learned: remove today's date and add tomorrow's.
-        tomorrow_str = (today + timedelta(days=1)).strftime('%Y-%m-%d')
-        update_query = {
-            '$pull': {'words_mastered.$.review_date': today_str},
-            '$addToSet': {'words_mastered.$.review_date': tomorrow_str}
-        }
+    tomorrow_str = (today + timedelta(days=1)).strftime('%Y-%m-%d')
 
-    # Use the positional operator `$` to update the correct element in the array
-    db_result = current_app.db.users.update_one(
-        {'_id': user_id, 'words_mastered.word': word_to_update},
-        update_query
-    )
+    # pass: count the review and consume today's slot; fail: consume it and add tomorrow
+    changed = record_review(current_app.db, user_id, word_to_update, result, today_str, tomorrow_str)
 
-    if db_result.matched_count == 0:
+    if changed is None:
         return jsonify({'message': '在用户的掌握列表中未找到该单词'}), 404
         
-    if db_result.modified_count == 0:
+    if not changed:
         # This can happen if the date was already removed, which is not a critical error.
         return jsonify({'message': '单词状态已是最新，无需更新'}), 200
 
@@ -896,7 +820,8 @@ def update_word_review():
     try:
         beijing_tz = pytz.timezone('Asia/Shanghai')
         today_str = datetime.now(beijing_tz).strftime('%Y-%m-%d')
-        current_app.db.users.update_one({'_id': user_id}, {'$push': {'study_logs': {'date': today_str, 'word': word_to_update, 'type': 'review'}}})
+        record_study_events(current_app.db, user_id, [word_to_update], 'review', today_str,
+                            goal=load_user_fields('learning_goal').get('learning_goal', 0) or 0)
     except Exception:
         pass
 
@@ -925,6 +850,7 @@ def cleanup_student_word():
             }
         }
     )
+    remove_scheduled_words(current_app.db, [word_to_remove])
     
     return jsonify({'message': f'全局清理成功，影响了 {result.modified_count} 个用户。'}), 200
 
@@ -1260,6 +1186,7 @@ def update_student_tier(student_id):
 
     if result.matched_count == 0:
         return jsonify({'message': '未找到指定学生'}), 404
+    invalidate_user(student_object_id)
 
     return jsonify({'message': '学生层级更新成功'}), 200
 
@@ -1380,6 +1307,7 @@ def list_wordbooks_for_student():
                 deleted_to_kept[x['_id']] = keep
         if to_delete:
             current_app.db.wordbooks.delete_many({'_id': {'$in': to_delete}})
+            refresh_wordbook_tags(current_app.db, to_delete)
             # Clean up tracked_wordbooks to only existing and map to kept if necessary
             udoc = current_app.db.users.find_one({'_id': user.get('_id')}, {'tracked_wordbooks':1}) or {}
             tracked = [oid for oid in (udoc.get('tracked_wordbooks') or []) if oid]
@@ -1472,7 +1400,7 @@ def assign_from_wordbook(wordbook_id):
                 existing.add(w)
 
         # Valid words from words collection
-        valid_words = set(doc.get('word') for doc in current_app.db.words.find({}, {'word': 1}) if doc.get('word'))
+        valid_words = dictionary_words(current_app.db)
 
         entries = wb.get('entries') or []
         # Build eligible pool then randomly sample n words
@@ -1607,7 +1535,7 @@ def preview_from_wordbook(wordbook_id):
                 existing.add(w)
 
         # Valid words from words collection
-        valid_words = set(doc.get('word') for doc in current_app.db.words.find({}, {'word': 1}) if doc.get('word'))
+        valid_words = dictionary_words(current_app.db)
 
         entries = wb.get('entries') or []
         # Build eligible pool then randomly sample n words for preview
@@ -1663,8 +1591,7 @@ def build_learning_plan():
         return jsonify({'message': 'count 必须为正整数'}), 400
 
     try:
-        # Reload latest user doc to avoid stale g.current_user
-        user_doc = current_app.db.users.find_one({'_id': user.get('_id')}) or {}
+        user_doc = load_user_fields('to_be_mastered', 'vocab_mission', 'words_mastered')
 
         # 1) Build base list from to_be_mastered (teacher first)
         tbm_entries = (user_doc.get('to_be_mastered') or [])
@@ -1727,7 +1654,7 @@ def build_learning_plan():
                     exclude.add(w)
 
             # Valid words set
-            valid_words = set(doc.get('word') for doc in current_app.db.words.find({}, {'word': 1}) if doc.get('word'))
+            valid_words = dictionary_words(current_app.db)
 
             entries = wb.get('entries') or []
             # Build supplement pool and randomly pick
@@ -1794,6 +1721,7 @@ def tbm_words_from_wordbook(wordbook_id):
         if not wb:
             return jsonify({'message': '未找到指定词库'}), 404
 
+        user = load_user_fields('to_be_mastered')
         tbm = user.get('to_be_mastered', []) or []
         tbm_set = set()
         for e in tbm:
@@ -1854,6 +1782,7 @@ def wordbook_progress(wordbook_id):
         set_book = set(words_in_book)
 
         # Build user sets
+        user = load_user_fields('to_be_mastered', 'words_mastered')
         tbm_set = set()
         for e in (user.get('to_be_mastered') or []):
             if isinstance(e, dict):
@@ -1878,9 +1807,10 @@ def wordbook_progress(wordbook_id):
         learned_count = len(learned_words)
 
         # Review units: 8 per word when fully completed. Done units per mastered word = 8 - remaining scheduled dates
-        review_total_units = total_count * 8
+        review_total_units = total_count * REVIEW_STAGES
         review_done_units = 0
         mastered_count = 0
+        sched = schedule_map(current_app.db, user.get('_id'), learned_words)
         for w in set_book:
             e = mastered_map.get(w)
             if not e:
@@ -1888,12 +1818,16 @@ def wordbook_progress(wordbook_id):
             mastered_count += 1
             remaining = 0
             try:
-                remaining = len(e.get('review_date') or [])
+                if w in sched:
+                    remaining = len(sched[w].get('slots') or [])
+                else:
+                    # Entry not migrated to review_schedule yet
+                    remaining = len(e.get('review_date') or [])
             except Exception:
                 remaining = 0
-            done = max(0, 8 - remaining)
-            if done > 8:
-                done = 8
+            done = max(0, REVIEW_STAGES - remaining)
+            if done > REVIEW_STAGES:
+                done = REVIEW_STAGES
             review_done_units += done
 
         return jsonify({
@@ -1916,7 +1850,7 @@ def get_tracked_wordbooks():
     user = g.current_user
     if user.get('role') != 'user':
         return jsonify({'message': '仅学生可访问'}), 403
-    doc = current_app.db.users.find_one({'_id': user.get('_id')}, {'tracked_wordbooks': 1}) or {}
+    doc = load_user_fields('tracked_wordbooks')
     ids = []
     for _id in (doc.get('tracked_wordbooks') or []):
         try:
@@ -1988,22 +1922,11 @@ def create_private_wordbook():
     # Deduplicate and normalize
     words = sorted({w for w in words if isinstance(w, str) and w})
     # Filter existing in dictionary with case-insensitive fallback (prefer exact)
-    existing_exact = set(doc.get('word') for doc in current_app.db.words.find({'word': {'$in': words}}, {'word': 1}))
-    missing = [w for w in words if w not in existing_exact]
-    lower_candidates = sorted({w.lower() for w in missing if isinstance(w, str)})
-    existing_lower = set()
-    if lower_candidates:
-        existing_lower = set(doc.get('word') for doc in current_app.db.words.find({'word': {'$in': lower_candidates}}, {'word': 1}))
-
     valid_mapped = []
     invalid = []
     seen = set()
     for w in words:
-        if w in existing_exact:
-            key = w
-        else:
-            lw = w.lower()
-            key = lw if lw in existing_lower else None
+        key = resolve_word(current_app.db, w)
         if key:
             if key not in seen:
                 valid_mapped.append(key)
@@ -2044,6 +1967,8 @@ def create_private_wordbook():
     except Exception:
         pass
     res = current_app.db.wordbooks.insert_one(doc)
+    if entries:
+        refresh_wordbook_tags(current_app.db, res.inserted_id)
     # Auto-track newly created private wordbook for the student
     try:
         current_app.db.users.update_one({'_id': user.get('_id')}, {'$addToSet': {'tracked_wordbooks': res.inserted_id}})
@@ -2077,6 +2002,7 @@ def list_my_private_wordbooks():
                 deleted_to_kept[x['_id']] = keep
         if to_delete:
             current_app.db.wordbooks.delete_many({'_id': {'$in': to_delete}})
+            refresh_wordbook_tags(current_app.db, to_delete)
             # Cleanup tracked_wordbooks mapping
             udoc = current_app.db.users.find_one({'_id': user.get('_id')}, {'tracked_wordbooks':1}) or {}
             tracked = [oid for oid in (udoc.get('tracked_wordbooks') or []) if oid]
@@ -2122,6 +2048,7 @@ def delete_my_wordbook(wordbook_id):
     if wb.get('is_favorites') or (wb.get('title') == 'My Favorites'):
         return jsonify({'message': '"My Favorites" cannot be deleted'}), 400
     current_app.db.wordbooks.delete_one({'_id': wb_oid})
+    refresh_wordbook_tags(current_app.db, wb_oid)
     return jsonify({'message': 'Deleted'}), 200
 
 
@@ -2188,25 +2115,12 @@ def add_words_to_my_wordbook(wordbook_id):
     words = sorted(set(_normalize_words_payload(data)))
     if not words:
         return jsonify({'message': 'Missing words'}), 400
-    # Filter existing in dictionary (case sensitive first)
-    existing_exact = set(doc.get('word') for doc in current_app.db.words.find({'word': {'$in': words}}, {'word': 1}))
-    # For those not found exactly, try lowercase fallback
-    missing = [w for w in words if w not in existing_exact]
-    lower_candidates = sorted({w.lower() for w in missing if isinstance(w, str)})
-    existing_lower = set()
-    if lower_candidates:
-        existing_lower = set(doc.get('word') for doc in current_app.db.words.find({'word': {'$in': lower_candidates}}, {'word': 1}))
-
-    # Build final valid list: exact matches keep original; otherwise use lowercase match if available
+    # Build final valid list: exact dictionary matches keep original; otherwise use the case-insensitive match if available
     valid_mapped = []
     invalid = []
     seen = set()
     for w in words:
-        if w in existing_exact:
-            key = w
-        else:
-            lw = w.lower()
-            key = lw if lw in existing_lower else None
+        key = resolve_word(current_app.db, w)
         if key:
             if key not in seen:
                 valid_mapped.append(key)
@@ -2236,6 +2150,7 @@ def add_words_to_my_wordbook(wordbook_id):
             continue
     new_entries = [{'number': max_number + i + 1, 'word': w, 'tags': []} for i, w in enumerate(to_add)]
     current_app.db.wordbooks.update_one({'_id': wb_oid}, {'$push': {'entries': {'$each': new_entries}}})
+    refresh_wordbook_tags(current_app.db, wb_oid)
     return jsonify({'message': f'Added {len(new_entries)} words', 'added': len(new_entries), 'invalid_words': invalid, 'invalid_count': len(invalid)}), 200
 
 
@@ -2268,6 +2183,7 @@ def remove_words_from_my_wordbook(wordbook_id):
     for idx, e in enumerate(entries_sorted):
         e['number'] = idx + 1
     current_app.db.wordbooks.update_one({'_id': wb_oid}, {'$set': {'entries': entries_sorted}})
+    refresh_wordbook_tags(current_app.db, wb_oid)
     return jsonify({'message': 'Removed and re-numbered', 'remaining': len(entries_sorted)}), 200
 
 
@@ -1,6 +1,8 @@
 from flask import Blueprint, request, jsonify, g, current_app
 from werkzeug.security import check_password_hash, generate_password_hash
 from ..decorators import token_required
+from ..session import invalidate_user, load_user_fields
+from ..word_tags import refresh_wordbook_tags
 from bson.objectid import ObjectId
 from datetime import datetime
 
@@ -13,7 +15,7 @@ def get_user_profile():
     Fetches the profile of the currently logged-in user.
     Adds class memberships for students.
     """
-    user = g.current_user
+    user = load_user_fields('security_answer_hash')
     profile = {
         'username': user.get('username'),
         'nickname': user.get('nickname'),
@@ -55,6 +57,7 @@ def update_user_profile():
             {'_id': user_id},
             {'$set': {'nickname': new_nickname}}
         )
+        invalidate_user(user_id)
         return jsonify({'message': '昵称更新成功'}), 200
 
     # Update password
@@ -167,7 +170,7 @@ def list_saved_questions():
     Tries to enrich with quiz name from results if possible.
     """
     try:
-        user = g.current_user
+        user = load_user_fields('saved_questions')
         saved = list(user.get('saved_questions') or [])
         items = []
         # Build a cache to avoid repeated DB lookups
@@ -266,6 +269,7 @@ def save_vocab_to_private_wordbook():
             {'_id': wb['_id']},
             {'$push': {'entries': entry}}
         )
+        refresh_wordbook_tags(current_app.db, wb['_id'])
 
         # Optionally write a simple user-side log of saved vocab
         if definition:
@@ -300,6 +304,8 @@ def unsave_vocab_from_private_wordbook():
             {'_id': wb['_id']},
             {'$pull': {'entries': {'word': word}}}
         )
+        if res.modified_count:
+            refresh_wordbook_tags(current_app.db, wb['_id'])
         return jsonify({'message': 'removed', 'modified': res.modified_count}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
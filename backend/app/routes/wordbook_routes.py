@@ -1,6 +1,10 @@
 from flask import Blueprint, request, jsonify, g, current_app
 from bson.objectid import ObjectId
 from ..decorators import admin_required, superadmin_required, token_required
+from ..dictionary_index import dictionary_words
+from ..word_tags import refresh_wordbook_tags
+from ..tts_prewarm import prewarm_status, start_prewarm
+from ..word_pregeneration import source_id, wordbook_words
 
 wordbook_bp = Blueprint('wordbook_bp', __name__)
 
@@ -71,15 +75,20 @@ def get_wordbook_details(wordbook_id):
     try:
         # Before fetching, auto-clean ghost entries for this wordbook
         try:
-            existing_words = set(
-                doc.get('word') for doc in current_app.db.words.find({}, {'word': 1}) if doc.get('word')
-            )
+            existing_words = dictionary_words(current_app.db)
             if existing_words:
-                # Remove entries whose word is not in existing_words
-                current_app.db.wordbooks.update_one(
-                    {'_id': wordbook_object_id},
-                    {'$pull': {'entries': {'word': {'$nin': list(existing_words)}}}}
-                )
+                # Only issue the $pull when this wordbook actually holds a ghost entry
+                wb_words = current_app.db.wordbooks.find_one({'_id': wordbook_object_id}, {'entries.word': 1}) or {}
+                ghosts = sorted(set(
+                    e.get('word') for e in (wb_words.get('entries') or [])
+                    if isinstance(e, dict) and e.get('word') not in existing_words
+                ), key=str)
+                if ghosts:
+                    current_app.db.wordbooks.update_one(
+                        {'_id': wordbook_object_id},
+                        {'$pull': {'entries': {'word': {'$in': ghosts}}}}
+                    )
+                    refresh_wordbook_tags(current_app.db, wordbook_object_id)
         except Exception:
             # Cleanup errors should not block details view
             pass
@@ -260,6 +269,7 @@ def add_words_to_wordbook(wordbook_id):
         {'_id': wordbook_object_id},
         {'$addToSet': {'entries': {'$each': new_entries}}}
     )
+    refresh_wordbook_tags(current_app.db, wordbook_object_id)
 
     return jsonify({'message': f'Added {len(new_entries)} words to the wordbook'}), 200
 
@@ -284,5 +294,34 @@ def remove_word_from_wordbook(wordbook_id, word_identifier):
     
     if result.modified_count == 0:
         return jsonify({'message': 'The word does not exist in this wordbook'}), 404
+    refresh_wordbook_tags(current_app.db, wordbook_object_id)
 
     return jsonify({'message': 'Removed word from wordbook'}), 200
+
+
+@wordbook_bp.route('/api/wordbooks/<wordbook_id>/tts-prewarm', methods=['POST', 'GET'])
+@superadmin_required
+def prewarm_wordbook_tts(wordbook_id):
+    """
+    POST: synthesize the audio missing for the wordbook's entries in the
+    background (202). GET: progress of the last run.
+    """
+    try:
+        ObjectId(wordbook_id)
+    except Exception:
+        return jsonify({'message': 'Invalid wordbook ID'}), 400
+    source = source_id(wordbook_id=wordbook_id)
+    if request.method == 'GET':
+        status = prewarm_status(current_app.db, source)
+        if status is None:
+            return jsonify({'message': 'No pre-warm run for this wordbook'}), 404
+        return jsonify(status), 200
+    try:
+        words = wordbook_words(current_app.db, wordbook_id)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 404
+    try:
+        started = start_prewarm(current_app.db, words, source)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 503
+    return jsonify({'source': source, 'words': len(words), 'started': started}), 202
@@ -0,0 +1,172 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g, has_request_context
+
+try:
+    from bson import encode as _bson_encode
+except Exception:  # very old pymongo
+    _bson_encode = None
+
+# --- per-process session cache of slim user records ---
+# token_required used to load the full user document (study_logs, words_mastered,
+# saved_questions, ...) on every authenticated request. Only the small, stable
+# fields below are cached; anything else is loaded lazily by SessionUser.
+# Each worker process keeps its own cache, so entries are also bounded by a TTL.
+SLIM_USER_FIELDS = ('username', 'role', 'nickname', 'tier', 'approved')
+
+_SESSION_TTL_SECONDS = float(os.getenv('SESSION_CACHE_TTL', '60'))
+_SESSION_MAX_ENTRIES = int(os.getenv('SESSION_CACHE_MAX_ENTRIES', '5000'))
+
+_session_cache = OrderedDict()   # user_id(str) -> (cached_at, slim user dict)
+_session_lock = threading.Lock()
+
+# endpoint -> {'requests', 'queries', 'bytes'}; per process, reset on restart
+_user_doc_stats = {}
+_stats_lock = threading.Lock()
+
+
+def session_claims(user: dict) -> dict:
+    """Stable claims embedded in issued JWTs next to user_id/exp."""
+    return {
+        'user_id': str(user['_id']),
+        'role': user.get('role', 'user'),
+        'username': user.get('username'),
+    }
+
+
+def _doc_size(doc) -> int:
+    try:
+        if _bson_encode is not None:
+            return len(_bson_encode(doc))
+    except Exception:
+        pass
+    return len(str(doc))
+
+
+def _track_user_fetch(doc):
+    """Count one users-collection read against the current request."""
+    if not has_request_context():
+        return
+    try:
+        g._user_doc_queries = getattr(g, '_user_doc_queries', 0) + 1
+        g._user_doc_bytes = getattr(g, '_user_doc_bytes', 0) + _doc_size(doc or {})
+    except Exception:
+        pass
+
+
+class SessionUser(dict):
+    """
+    The current user as seen by handlers (g.current_user).
+    Starts with the slim session fields; any other field is fetched on first
+    access. prefetch() batches several missing fields into one projected query,
+    and everything loaded is memoized for the rest of the request.
+    """
+
+    def __init__(self, record):
+        super().__init__(record)
+        self._known = set(record.keys()) | {'_id'}
+
+    def prefetch(self, *fields):
+        missing = [f for f in fields if f not in self._known]
+        if not missing:
+            return self
+        doc = current_app.db.users.find_one({'_id': dict.get(self, '_id')}, {f: 1 for f in missing}) or {}
+        _track_user_fetch(doc)
+        for f in missing:
+            if f in doc:
+                dict.__setitem__(self, f, doc[f])
+            self._known.add(f)
+        return self
+
+    def __getitem__(self, key):
+        if key not in self._known:
+            self.prefetch(key)
+        return dict.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        if key not in self._known:
+            self.prefetch(key)
+        return dict.get(self, key, default)
+
+    def __contains__(self, key):
+        if key not in self._known:
+            self.prefetch(key)
+        return dict.__contains__(self, key)
+
+    def __setitem__(self, key, value):
+        self._known.add(key)
+        dict.__setitem__(self, key, value)
+
+
+def _cache_get(key: str):
+    with _session_lock:
+        item = _session_cache.get(key)
+        if item is None:
+            return None
+        cached_at, record = item
+        if (time.time() - cached_at) >= _SESSION_TTL_SECONDS:
+            _session_cache.pop(key, None)
+            return None
+        _session_cache.move_to_end(key)
+        return record
+
+
+def _cache_put(key: str, record: dict):
+    with _session_lock:
+        _session_cache[key] = (time.time(), record)
+        _session_cache.move_to_end(key)
+        while len(_session_cache) > _SESSION_MAX_ENTRIES:
+            _session_cache.popitem(last=False)
+
+
+def get_session_user(user_id):
+    """
+    Return a SessionUser for user_id, built from the cache when possible.
+    Returns None if the user no longer exists.
+    """
+    key = str(user_id)
+    record = _cache_get(key)
+    if record is not None:
+        return SessionUser(record)
+    from bson.objectid import ObjectId
+    projection = {f: 1 for f in SLIM_USER_FIELDS}
+    record = current_app.db.users.find_one({'_id': ObjectId(key)}, projection)
+    _track_user_fetch(record)
+    if not record:
+        return None
+    _cache_put(key, record)
+    return SessionUser(record)
+
+
+def invalidate_user(user_id):
+    """Drop a cached session record; call after changing role, approval, tier or nickname."""
+    if user_id is None:
+        return
+    with _session_lock:
+        _session_cache.pop(str(user_id), None)
+
+
+def load_user_fields(*fields):
+    """Batch-load fields outside the slim session record into g.current_user and return it."""
+    return g.current_user.prefetch(*fields)
+
+
+def record_user_doc_usage(endpoint):
+    """Fold this request's users-collection reads into the per-endpoint counters."""
+    queries = getattr(g, '_user_doc_queries', 0)
+    size = getattr(g, '_user_doc_bytes', 0)
+    with _stats_lock:
+        row = _user_doc_stats.setdefault(endpoint or 'unknown', {'requests': 0, 'queries': 0, 'bytes': 0})
+        row['requests'] += 1
+        row['queries'] += queries
+        row['bytes'] += size
+    return queries, size
+
+
+def user_doc_stats() -> dict:
+    """Snapshot of per-endpoint user-document read counters for this process."""
+    with _stats_lock:
+        return {k: dict(v) for k, v in _user_doc_stats.items()}
@@ -0,0 +1,81 @@
+"""
+Server-sent-events variants of long AI endpoints.
+
+A client opts in with ?stream=1 or 'Accept: text/event-stream'. The work then
+runs on a background thread (inside the app context) and reports sections
+through an EventSink as they complete; the response streams them as
+    event: <name>
+    data: <json>
+Comment lines keep idle proxies from closing the connection. The last event is
+the endpoint's usual JSON body: 'result' on success, 'error' otherwise.
+"""
+import json
+import queue
+import threading
+
+from flask import Response, current_app, request
+
+from .ai_gateway import AIGatewayError
+
+KEEPALIVE_SECONDS = 15
+_DONE = object()
+
+
+def wants_event_stream():
+    if (request.args.get('stream') or '').lower() in ('1', 'true', 'yes'):
+        return True
+    return 'text/event-stream' in (request.headers.get('Accept') or '')
+
+
+def format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+class EventSink:
+    """Section reporter; a no-op unless attached to a stream."""
+
+    def __init__(self, q=None):
+        self._q = q
+
+    def emit(self, event, data):
+        if self._q is not None:
+            self._q.put((event, data))
+
+
+def event_stream_response(produce):
+    """
+    Run produce(sink) -> (body, status) on a worker thread and stream its events.
+    The worker finishes even if the client goes away.
+    """
+    app = current_app._get_current_object()
+    q = queue.Queue()
+
+    def worker():
+        with app.app_context():
+            try:
+                body, status = produce(EventSink(q))
+            except AIGatewayError as e:
+                body, status = {'message': str(e), 'retry_after': e.retry_after}, e.status_code
+            except Exception as e:
+                app.logger.exception("streamed generation failed")
+                body, status = {'message': 'An unexpected error occurred.', 'error': str(e)}, 500
+        q.put((_DONE, (body, status)))
+
+    threading.Thread(target=worker, daemon=True).start()
+
+    def generate():
+        yield ': stream open\n\n'
+        while True:
+            try:
+                event, data = q.get(timeout=KEEPALIVE_SECONDS)
+            except queue.Empty:
+                yield ': keep-alive\n\n'
+                continue
+            if event is _DONE:
+                body, status = data
+                yield format_event('result' if status < 400 else 'error', body)
+                return
+            yield format_event(event, data)
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
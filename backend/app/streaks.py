@@ -0,0 +1,183 @@
+"""
+Daily-completion streaks and their distribution across users.
+
+A day counts towards a streak when it is in both complete_exercise_day and
+complete_revision_day. Each user carries its streak state on the user document:
+    current_streak:   length of the run ending at streak_last_day
+    streak_last_day:  'YYYY-MM-DD' of the last completed day
+and `streak_distribution` holds one histogram per day of everyone's streak
+ending that day:
+    { _id: 'YYYY-MM-DD', buckets: {'0': n, '1': n, ...}, total, updated_at }
+A day's histogram starts with every user in bucket 0 (plus anyone who already
+completed that day) and record_streak_completion() moves a user to their new
+bucket when they complete the day, so the percentile in /api/student/stats is a
+read of one small document shared by all workers. roll_streaks() runs nightly.
+"""
+from datetime import datetime, timedelta
+
+import pytz
+
+STREAK_DISTRIBUTION = 'streak_distribution'
+# Histograms older than this are pruned by roll_streaks()
+_KEEP_DAYS = 90
+
+
+def _to_date(s):
+    try:
+        return datetime.strptime(s, '%Y-%m-%d').date()
+    except Exception:
+        return None
+
+
+def _shift(date_str, days):
+    return (datetime.strptime(date_str, '%Y-%m-%d') + timedelta(days=days)).strftime('%Y-%m-%d')
+
+
+def ensure_streak_indexes(db):
+    try:
+        db.users.create_index([('streak_last_day', 1)])
+    except Exception:
+        pass
+
+
+def streak_ending(completed_days, end_date_str):
+    """Length of the run of consecutive completed days ending at end_date_str."""
+    days = set(d for d in (_to_date(s) for s in completed_days) if d is not None)
+    cursor = _to_date(end_date_str)
+    n = 0
+    while cursor in days:
+        n += 1
+        cursor = cursor - timedelta(days=1)
+    return n
+
+
+def _completed_days(user_doc):
+    ex = set(user_doc.get('complete_exercise_day') or [])
+    rv = set(user_doc.get('complete_revision_day') or [])
+    return ex.intersection(rv)
+
+
+def ensure_day_histogram(db, date_str):
+    """Create date_str's histogram from the users' stored streak state if it does not exist yet."""
+    coll = db[STREAK_DISTRIBUTION]
+    if coll.find_one({'_id': date_str}, {'_id': 1}):
+        return
+    pipeline = [
+        {'$group': {
+            '_id': {'$cond': [{'$eq': ['$streak_last_day', date_str]}, {'$ifNull': ['$current_streak', 0]}, 0]},
+            'count': {'$sum': 1}
+        }}
+    ]
+    buckets = {}
+    total = 0
+    for row in db.users.aggregate(pipeline):
+        key = str(int(row.get('_id') or 0))
+        buckets[key] = buckets.get(key, 0) + int(row.get('count') or 0)
+        total += int(row.get('count') or 0)
+    try:
+        coll.update_one(
+            {'_id': date_str},
+            {'$setOnInsert': {'buckets': buckets, 'total': total, 'updated_at': datetime.now(pytz.utc)}},
+            upsert=True
+        )
+    except Exception:
+        # Another worker created it concurrently
+        pass
+
+
+def record_streak_completion(db, user_id, date_str):
+    """
+    Called once a user has completed date_str (exercise + revision). Advances the
+    user's streak and moves them between buckets of that day's histogram.
+    Idempotent: a day already recorded for the user is a no-op. Returns the new streak.
+    """
+    state = db.users.find_one({'_id': user_id}, {'current_streak': 1, 'streak_last_day': 1}) or {}
+    if state.get('streak_last_day') == date_str:
+        return int(state.get('current_streak') or 0)
+    yesterday = _shift(date_str, -1)
+    if 'streak_last_day' in state:
+        prev = int(state.get('current_streak') or 0) if state.get('streak_last_day') == yesterday else 0
+    else:
+        # No stored state yet (before rebuild-streaks ran): derive it from the completion arrays
+        doc = db.users.find_one({'_id': user_id}, {'complete_exercise_day': 1, 'complete_revision_day': 1}) or {}
+        prev = streak_ending(_completed_days(doc), yesterday)
+    new_streak = prev + 1
+
+    ensure_day_histogram(db, date_str)
+    res = db.users.update_one(
+        {'_id': user_id, 'streak_last_day': {'$ne': date_str}},
+        {'$set': {'current_streak': new_streak, 'streak_last_day': date_str}}
+    )
+    if getattr(res, 'modified_count', 0):
+        db[STREAK_DISTRIBUTION].update_one(
+            {'_id': date_str},
+            {'$inc': {'buckets.0': -1, f'buckets.{new_streak}': 1}, '$set': {'updated_at': datetime.now(pytz.utc)}}
+        )
+    return new_streak
+
+
+def streak_percentile(db, date_str, current_streak):
+    """Share (0-100) of users whose streak ending date_str is below current_streak."""
+    ensure_day_histogram(db, date_str)
+    doc = db[STREAK_DISTRIBUTION].find_one({'_id': date_str}, {'buckets': 1}) or {}
+    buckets = doc.get('buckets') or {}
+    total = 0
+    below = 0
+    for k, cnt in buckets.items():
+        cnt = max(0, int(cnt or 0))
+        total += cnt
+        try:
+            if int(k) < current_streak:
+                below += cnt
+        except Exception:
+            continue
+    return int((below * 100) / total) if total > 0 else 0
+
+
+def roll_streaks(db, today_str):
+    """
+    Nightly: zero the stored streak of users who missed yesterday, open today's
+    histogram and prune old ones.
+    """
+    yesterday = _shift(today_str, -1)
+    res = db.users.update_many(
+        {'current_streak': {'$gt': 0}, 'streak_last_day': {'$lt': yesterday}},
+        {'$set': {'current_streak': 0}}
+    )
+    ensure_day_histogram(db, today_str)
+    db[STREAK_DISTRIBUTION].delete_many({'_id': {'$lt': _shift(today_str, -_KEEP_DAYS)}})
+    return getattr(res, 'modified_count', 0)
+
+
+def rebuild_streaks(db, today_str, log=None):
+    """
+    Recompute every user's streak state from the completion arrays and rebuild
+    today's histogram. Used once at deploy and to repair drift.
+    """
+    from pymongo import UpdateOne
+    yesterday = _shift(today_str, -1)
+    summary = {'users': 0, 'active_streaks': 0}
+    ops = []
+    for u in db.users.find({}, {'complete_exercise_day': 1, 'complete_revision_day': 1}):
+        done = _completed_days(u)
+        if today_str in done:
+            last_day, length = today_str, streak_ending(done, today_str)
+        elif yesterday in done:
+            last_day, length = yesterday, streak_ending(done, yesterday)
+        else:
+            last_day = max((d for d in done if _to_date(d) is not None), default=None)
+            length = 0
+        ops.append(UpdateOne({'_id': u['_id']}, {'$set': {'current_streak': length, 'streak_last_day': last_day}}))
+        summary['users'] += 1
+        if length:
+            summary['active_streaks'] += 1
+        if len(ops) >= 1000:
+            db.users.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        db.users.bulk_write(ops, ordered=False)
+    db[STREAK_DISTRIBUTION].delete_one({'_id': today_str})
+    ensure_day_histogram(db, today_str)
+    if log:
+        log(f"{summary['users']} users, {summary['active_streaks']} active streaks")
+    return summary
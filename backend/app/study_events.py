@@ -0,0 +1,282 @@
+"""
+Study event log (one document per learned / reviewed word).
+
+Replaces the unbounded users.study_logs array. Events live in the
+`study_events` collection, a MongoDB time-series collection when the server
+supports it (5.0+), otherwise a regular collection. Both shapes are:
+    { ts: datetime(UTC), meta: { user_id }, date: 'YYYY-MM-DD', word, type: 'learn'|'review' }
+Reads always go through (meta.user_id, date) so they only touch the window asked for.
+
+Per-day totals are kept in `daily_study_rollup`, one document per user per day:
+    { user_id, date, learned, reviewed, secret_learned, learned_words, reviewed_words,
+      goal, review_done, updated_at }
+maintained with $inc whenever events are recorded, so stats endpoints read a
+single date range instead of re-aggregating the event log.
+"""
+from datetime import datetime, timedelta
+
+import pytz
+
+STUDY_EVENTS = 'study_events'
+DAILY_ROLLUP = 'daily_study_rollup'
+_BEIJING_TZ = pytz.timezone('Asia/Shanghai')
+
+
+def ensure_study_events_collection(db):
+    """Create study_events (time-series if possible) and its (user, date) index."""
+    try:
+        if STUDY_EVENTS not in db.list_collection_names():
+            try:
+                db.create_collection(STUDY_EVENTS, timeseries={
+                    'timeField': 'ts',
+                    'metaField': 'meta',
+                    'granularity': 'hours'
+                })
+            except Exception:
+                # Older MongoDB without time-series support
+                db.create_collection(STUDY_EVENTS)
+    except Exception:
+        pass
+    try:
+        db[STUDY_EVENTS].create_index([('meta.user_id', 1), ('date', 1)])
+    except Exception:
+        pass
+    try:
+        db[DAILY_ROLLUP].create_index([('user_id', 1), ('date', 1)], unique=True)
+    except Exception:
+        pass
+
+
+def record_study_events(db, user_id, words, event_type, date_str=None, secret_words=None, goal=None):
+    """
+    Insert one event per word for user_id and bump that day's rollup.
+    date_str defaults to today (Asia/Shanghai); secret_words is the student's
+    secret wordbook set, used for the secret_learned counter.
+    """
+    now = datetime.now(_BEIJING_TZ)
+    date_str = date_str or now.strftime('%Y-%m-%d')
+    ts = now.astimezone(pytz.utc)
+    words = [w for w in (words or []) if isinstance(w, str) and w]
+    docs = [
+        {'ts': ts, 'meta': {'user_id': user_id}, 'date': date_str, 'word': w, 'type': event_type}
+        for w in words
+    ]
+    if docs:
+        db[STUDY_EVENTS].insert_many(docs, ordered=False)
+        try:
+            if event_type == 'learn':
+                secret = len([w for w in words if w in (secret_words or ())])
+                bump_daily_rollup(db, user_id, date_str, learned_words=words, secret_learned=secret, goal=goal)
+            else:
+                bump_daily_rollup(db, user_id, date_str, reviewed_words=words, goal=goal)
+        except Exception:
+            pass
+    return len(docs)
+
+
+def bump_daily_rollup(db, user_id, date_str, learned_words=None, reviewed_words=None, secret_learned=0, goal=None):
+    """$inc the (user_id, date_str) rollup; goal is snapshotted when the day's document is created."""
+    learned_words = list(learned_words or [])
+    reviewed_words = list(reviewed_words or [])
+    update = {
+        '$inc': {
+            'learned': len(learned_words),
+            'reviewed': len(reviewed_words),
+            'secret_learned': int(secret_learned or 0)
+        },
+        '$set': {'updated_at': datetime.now(pytz.utc)}
+    }
+    push = {}
+    if learned_words:
+        push['learned_words'] = {'$each': learned_words}
+    if reviewed_words:
+        push['reviewed_words'] = {'$each': reviewed_words}
+    if push:
+        update['$push'] = push
+    if goal is not None:
+        update['$setOnInsert'] = {'goal': int(goal or 0)}
+    db[DAILY_ROLLUP].update_one({'user_id': user_id, 'date': date_str}, update, upsert=True)
+
+
+def mark_rollup_review_done(db, user_id, date_str, goal=None):
+    """Flag the day as review-complete (and snapshot the goal when given)."""
+    fields = {'review_done': True, 'updated_at': datetime.now(pytz.utc)}
+    if goal is not None:
+        fields['goal'] = int(goal or 0)
+    db[DAILY_ROLLUP].update_one({'user_id': user_id, 'date': date_str}, {'$set': fields}, upsert=True)
+
+
+def load_daily_rollups(db, user_id, start_date=None, end_date=None, include_words=True):
+    """Return rollup documents for user_id within [start_date, end_date] (inclusive), oldest first."""
+    query = {'user_id': user_id}
+    date_range = {}
+    if start_date:
+        date_range['$gte'] = start_date
+    if end_date:
+        date_range['$lte'] = end_date
+    if date_range:
+        query['date'] = date_range
+    projection = {'_id': 0, 'user_id': 0, 'updated_at': 0}
+    if not include_words:
+        projection.update({'learned_words': 0, 'reviewed_words': 0})
+    return list(db[DAILY_ROLLUP].find(query, projection).sort('date', 1))
+
+
+def get_daily_rollup(db, user_id, date_str, include_words=False):
+    docs = load_daily_rollups(db, user_id, date_str, date_str, include_words=include_words)
+    return docs[0] if docs else {}
+
+
+def secret_word_set(db, user_id, user_doc):
+    """
+    Words of a student's secret wordbook, or None if there is none.
+    Only students linked to a teacher have one: the tracked own-private wordbook,
+    falling back to the legacy '秘制词库' title.
+    """
+    linked = user_doc.get('linked_teachers') or []
+    if not (isinstance(linked, list) and len(linked) > 0):
+        return None
+    tracked = [oid for oid in (user_doc.get('tracked_wordbooks') or []) if oid]
+    tracked_docs = list(db.wordbooks.find({'_id': {'$in': tracked}}, {'_id': 1, 'title': 1, 'creator_id': 1, 'accessibility': 1, 'entries.word': 1})) if tracked else []
+    own_priv = [w for w in tracked_docs if w.get('creator_id') == user_id and w.get('accessibility') == 'private']
+    candidate = own_priv[0] if len(own_priv) >= 1 else db.wordbooks.find_one({'creator_id': user_id, 'accessibility': 'private', 'title': '秘制词库'}, {'entries.word': 1})
+    if not candidate:
+        return None
+    return set(e.get('word') for e in (candidate.get('entries') or []) if isinstance(e, dict) and isinstance(e.get('word'), str))
+
+
+def _window_query(user_id, start_date=None, end_date=None, event_type=None):
+    query = {'meta.user_id': user_id}
+    date_range = {}
+    if start_date:
+        date_range['$gte'] = start_date
+    if end_date:
+        date_range['$lte'] = end_date
+    if date_range:
+        query['date'] = date_range
+    if event_type:
+        query['type'] = event_type
+    return query
+
+
+def load_study_events(db, user_id, start_date=None, end_date=None, event_type=None):
+    """Return [{date, word, type}] for user_id within [start_date, end_date] (inclusive), oldest first."""
+    cur = db[STUDY_EVENTS].find(
+        _window_query(user_id, start_date, end_date, event_type),
+        {'_id': 0, 'date': 1, 'word': 1, 'type': 1}
+    ).sort('ts', 1)
+    return list(cur)
+
+
+def _legacy_ts(date_str, seq):
+    """Best-effort timestamp for a legacy log entry (which only had a date); keeps original order."""
+    try:
+        day = _BEIJING_TZ.localize(datetime.strptime(date_str, '%Y-%m-%d'))
+    except Exception:
+        day = datetime.now(_BEIJING_TZ)
+    return (day + timedelta(milliseconds=seq)).astimezone(pytz.utc)
+
+
+def migrate_study_logs(db, batch_size=1000, keep_legacy=False, dry_run=False, log=None):
+    """
+    One-shot move of users.study_logs into study_events.
+    Safe to re-run: events copied from a user's legacy array are tagged meta.src='legacy'
+    and replaced on each run, and the array is unset only after its events are written.
+    """
+    ensure_study_events_collection(db)
+    summary = {'users': 0, 'events': 0, 'skipped_entries': 0, 'dry_run': bool(dry_run)}
+    coll = db[STUDY_EVENTS]
+    cur = db.users.find({'study_logs.0': {'$exists': True}}, {'study_logs': 1}, no_cursor_timeout=True)
+    try:
+        for u in cur:
+            uid = u['_id']
+            docs = []
+            for seq, lg in enumerate(u.get('study_logs') or []):
+                if not isinstance(lg, dict) or not lg.get('date') or lg.get('type') not in ('learn', 'review'):
+                    summary['skipped_entries'] += 1
+                    continue
+                docs.append({
+                    'ts': _legacy_ts(lg.get('date'), seq),
+                    'meta': {'user_id': uid, 'src': 'legacy'},
+                    'date': lg.get('date'),
+                    'word': lg.get('word'),
+                    'type': lg.get('type')
+                })
+            summary['users'] += 1
+            summary['events'] += len(docs)
+            if dry_run:
+                continue
+            coll.delete_many({'meta.user_id': uid, 'meta.src': 'legacy'})
+            for i in range(0, len(docs), batch_size):
+                coll.insert_many(docs[i:i + batch_size], ordered=False)
+            if not keep_legacy:
+                db.users.update_one({'_id': uid}, {'$unset': {'study_logs': ''}})
+            if log:
+                log(f"user {uid}: {len(docs)} events")
+    finally:
+        cur.close()
+    if not dry_run and not keep_legacy:
+        db.users.update_many({'study_logs': {'$size': 0}}, {'$unset': {'study_logs': ''}})
+    return summary
+
+
+def rebuild_daily_rollups(db, user_ids=None, log=None):
+    """
+    Recompute daily_study_rollup from study_events plus the users' completion and
+    goal records. Used after migrate_study_logs and to repair drift.
+    """
+    from pymongo import ReplaceOne
+    ensure_study_events_collection(db)
+    query = {'role': 'user'}
+    if user_ids:
+        query['_id'] = {'$in': list(user_ids)}
+    summary = {'users': 0, 'days': 0}
+    projection = {'complete_revision_day': 1, 'daily_goal_records': 1, 'learning_goal': 1,
+                  'linked_teachers': 1, 'tracked_wordbooks': 1}
+    for u in db.users.find(query, projection):
+        uid = u['_id']
+        try:
+            secret = secret_word_set(db, uid, u) or set()
+        except Exception:
+            secret = set()
+        goals = {}
+        for rec in (u.get('daily_goal_records') or []):
+            if isinstance(rec, dict) and rec.get('date'):
+                goals[rec.get('date')] = rec.get('goal')
+        days = {}
+
+        def _day(d):
+            return days.setdefault(d, {
+                'user_id': uid, 'date': d, 'learned': 0, 'reviewed': 0, 'secret_learned': 0,
+                'learned_words': [], 'reviewed_words': [], 'review_done': False
+            })
+
+        for ev in db[STUDY_EVENTS].find({'meta.user_id': uid}, {'_id': 0, 'date': 1, 'word': 1, 'type': 1}).sort('ts', 1):
+            d = _day(ev.get('date'))
+            w = ev.get('word')
+            if ev.get('type') == 'learn':
+                d['learned'] += 1
+                d['learned_words'].append(w)
+                if w in secret:
+                    d['secret_learned'] += 1
+            elif ev.get('type') == 'review':
+                d['reviewed'] += 1
+                d['reviewed_words'].append(w)
+        for ds in (u.get('complete_revision_day') or []):
+            _day(ds)['review_done'] = True
+        now = datetime.now(pytz.utc)
+        ops = []
+        for ds, doc in days.items():
+            try:
+                doc['goal'] = int(goals.get(ds, u.get('learning_goal')) or 0)
+            except Exception:
+                doc['goal'] = 0
+            doc['updated_at'] = now
+            ops.append(ReplaceOne({'user_id': uid, 'date': ds}, doc, upsert=True))
+        if ops:
+            db[DAILY_ROLLUP].bulk_write(ops, ordered=False)
+        summary['users'] += 1
+        summary['days'] += len(ops)
+        if log:
+            log(f"user {uid}: {len(ops)} days")
+    return summary
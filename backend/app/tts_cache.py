@@ -0,0 +1,350 @@
+"""
+On-disk TTS audio cache with a persistent size/LRU index.
+
+/api/tts/say used to list and stat the whole flat cache directory after every
+upstream call to total its size. Clips now live in two-level shards
+    <TTS_CACHE_DIR>/<key[:2]>/<key[2:4]>/<key>.<ext>
+and a SQLite index next to them (index.sqlite3; the cache is per host, like the
+files) records each clip's size and last access plus a running byte total.
+put() adjusts the total and, once it passes TTS_CACHE_MAX_BYTES, evicts the
+least recently used clips from the index in batches down to 90% of the budget;
+nothing walks the directory. Hits refresh last access at most once per
+TTS_CACHE_TOUCH_SECONDS. `flask --app app rebuild-tts-index` re-creates the
+index from the files (moving clips from the old flat layout into shards).
+
+fetch_through() coalesces misses: concurrent callers for one key in a process
+share a single upstream fetch, and across processes on the host the fetch runs
+under an flock on locks/<key[:3]>.lock, after which the cache is checked again,
+so a clip another worker stored meanwhile is not fetched twice.
+"""
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # no cross-process lock on Windows
+    fcntl = None
+
+DEFAULT_MAX_BYTES = 3 * 1024 * 1024 * 1024
+EVICT_BATCH = 256
+LOW_WATERMARK = 0.9
+TOUCH_SECONDS = float(os.getenv('TTS_CACHE_TOUCH_SECONDS', '300'))
+INDEX_NAME = 'index.sqlite3'
+LOCK_DIR = 'locks'
+LOCK_WAIT_SECONDS = float(os.getenv('TTS_LOCK_WAIT_SECONDS', '70'))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS clips (
+    key TEXT PRIMARY KEY,
+    ext TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS clips_last_access ON clips (last_access);
+CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+INSERT OR IGNORE INTO meta (name, value) VALUES ('total_bytes', 0);
+"""
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.path = None
+        self.data = None
+        self.error = None
+
+
+class TTSCache:
+    def __init__(self, root, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+        self._fetch_stats = {'upstream_fetches': 0, 'coalesced': 0, 'filled_meanwhile': 0,
+                             'lock_timeouts': 0}
+        self.root.mkdir(parents=True, exist_ok=True)
+        (self.root / LOCK_DIR).mkdir(exist_ok=True)
+        self._db().executescript(_SCHEMA)
+
+    def _db(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.root / INDEX_NAME), timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def path_for(self, key, ext):
+        return self.root / key[:2] / key[2:4] / f"{key}.{ext}"
+
+    def get(self, key, ext):
+        """Path of the cached clip, or None."""
+        conn = self._db()
+        row = conn.execute('SELECT size, last_access FROM clips WHERE key = ? AND ext = ?', (key, ext)).fetchone()
+        if row is None:
+            return None
+        path = self.path_for(key, ext)
+        if not path.is_file():
+            self._forget(conn, key, row[0])
+            return None
+        now = time.time()
+        if now - row[1] >= TOUCH_SECONDS:
+            conn.execute('UPDATE clips SET last_access = ? WHERE key = ?', (now, key))
+        return path
+
+    def put(self, key, ext, data):
+        """Store data for key; returns its path."""
+        path = self.path_for(key, ext)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+        except Exception:
+            try:
+                tmp.unlink(missing_ok=True)
+            except Exception:
+                pass
+            raise
+        conn = self._db()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            old = conn.execute('SELECT size, ext FROM clips WHERE key = ?', (key,)).fetchone()
+            if old is not None and old[1] != ext:
+                # Same key cached under another encoding: drop that file
+                self._unlink(self.path_for(key, old[1]))
+            conn.execute('INSERT OR REPLACE INTO clips (key, ext, size, last_access) VALUES (?, ?, ?, ?)',
+                         (key, ext, len(data), time.time()))
+            total = self._add_total(conn, len(data) - (old[0] if old else 0))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if total > self.max_bytes:
+            self.evict(int(self.max_bytes * LOW_WATERMARK))
+        return path
+
+    def fetch_through(self, key, ext, fetch):
+        """
+        (path, data) for key, calling fetch() -> bytes at most once per key at a
+        time. path is the cached clip (None if storing it failed); data is the
+        fetched bytes, or None when the clip came from the cache. fetch()'s
+        exception is raised in every caller waiting on that fetch.
+        """
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self._fetch_stats['coalesced'] += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.path, flight.data
+        try:
+            with self._host_lock(key):
+                try:
+                    path = self.get(key, ext)
+                except Exception:
+                    path = None
+                if path is not None:
+                    self._count('filled_meanwhile')
+                    flight.path = path
+                else:
+                    self._count('upstream_fetches')
+                    flight.data = fetch()
+                    try:
+                        flight.path = self.put(key, ext, flight.data)
+                    except Exception:
+                        flight.path = None
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._flights_lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+        return flight.path, flight.data
+
+    def _host_lock(self, key):
+        return _FileLock(self.root / LOCK_DIR / f"{key[:3]}.lock", LOCK_WAIT_SECONDS, self)
+
+    def _count(self, name):
+        with self._flights_lock:
+            self._fetch_stats[name] += 1
+
+    def evict(self, target_bytes):
+        """Delete least recently used clips until the total is at most target_bytes."""
+        conn = self._db()
+        removed = 0
+        while True:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                total = self._total(conn)
+                if total <= target_bytes:
+                    conn.execute('COMMIT')
+                    return removed
+                rows = conn.execute('SELECT key, ext, size FROM clips ORDER BY last_access LIMIT ?',
+                                    (EVICT_BATCH,)).fetchall()
+                if not rows:
+                    conn.execute("UPDATE meta SET value = 0 WHERE name = 'total_bytes'")
+                    conn.execute('COMMIT')
+                    return removed
+                freed = 0
+                victims = []
+                for key, ext, size in rows:
+                    victims.append((key, ext))
+                    freed += size
+                    if total - freed <= target_bytes:
+                        break
+                conn.executemany('DELETE FROM clips WHERE key = ?', [(k,) for k, _ in victims])
+                self._add_total(conn, -freed)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            for key, ext in victims:
+                self._unlink(self.path_for(key, ext))
+            removed += len(victims)
+
+    def stats(self):
+        conn = self._db()
+        count = conn.execute('SELECT COUNT(*) FROM clips').fetchone()[0]
+        with self._flights_lock:
+            fetches = dict(self._fetch_stats)
+            fetches['in_flight'] = len(self._flights)
+        fetches['saved_upstream_calls'] = fetches['coalesced'] + fetches['filled_meanwhile']
+        return {'root': str(self.root), 'entries': count, 'total_bytes': self._total(conn),
+                'max_bytes': self.max_bytes, 'fetches': fetches}
+
+    def rebuild(self, log=None):
+        """Re-create the index from the files on disk; legacy flat files are moved into shards."""
+        conn = self._db()
+        rows = []
+        moved = 0
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if Path(dirpath) == self.root and LOCK_DIR in dirnames:
+                dirnames.remove(LOCK_DIR)
+            for name in filenames:
+                if name.startswith(INDEX_NAME) or name.endswith('.tmp'):
+                    continue
+                key, dot, ext = name.partition('.')
+                if not dot or len(key) < 4:
+                    continue
+                src = Path(dirpath) / name
+                dst = self.path_for(key, ext)
+                try:
+                    if src != dst:
+                        dst.parent.mkdir(parents=True, exist_ok=True)
+                        os.replace(src, dst)
+                        moved += 1
+                    st = dst.stat()
+                except OSError:
+                    continue
+                rows.append((key, ext, st.st_size, st.st_mtime))
+                if log and len(rows) % 10000 == 0:
+                    log(f"tts index: {len(rows)} files scanned")
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM clips')
+            conn.executemany('INSERT OR REPLACE INTO clips (key, ext, size, last_access) VALUES (?, ?, ?, ?)', rows)
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM clips').fetchone()[0]
+            conn.execute("UPDATE meta SET value = ? WHERE name = 'total_bytes'", (total,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        evicted = self.evict(int(self.max_bytes * LOW_WATERMARK)) if total > self.max_bytes else 0
+        return {'entries': len(rows), 'moved_from_flat_layout': moved, 'total_bytes': total, 'evicted': evicted}
+
+    def _forget(self, conn, key, size):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if conn.execute('DELETE FROM clips WHERE key = ?', (key,)).rowcount:
+                self._add_total(conn, -size)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    @staticmethod
+    def _total(conn):
+        return conn.execute("SELECT value FROM meta WHERE name = 'total_bytes'").fetchone()[0]
+
+    def _add_total(self, conn, delta):
+        conn.execute("UPDATE meta SET value = MAX(0, value + ?) WHERE name = 'total_bytes'", (delta,))
+        return self._total(conn)
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            path.unlink(missing_ok=True)
+        except Exception:
+            pass
+
+
+class _FileLock:
+    """flock on path, given up after wait seconds (the fetch then runs unlocked)."""
+
+    def __init__(self, path, wait, cache):
+        self.path = path
+        self.wait = wait
+        self.cache = cache
+        self._fd = None
+
+    def __enter__(self):
+        if fcntl is None:
+            return self
+        try:
+            fd = os.open(str(self.path), os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError:
+            return self
+        deadline = time.monotonic() + self.wait
+        delay = 0.01
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self._fd = fd
+                return self
+            except OSError:
+                if time.monotonic() >= deadline:
+                    os.close(fd)
+                    self.cache._count('lock_timeouts')
+                    return self
+                time.sleep(delay)
+                delay = min(0.2, delay * 2)
+
+    def __exit__(self, *exc):
+        if self._fd is not None:
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            finally:
+                os.close(self._fd)
+                self._fd = None
+        return False
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_tts_cache():
+    """The cache for TTS_CACHE_DIR / TTS_CACHE_MAX_BYTES (one instance per process)."""
+    root = os.getenv('TTS_CACHE_DIR', '/tmp/piper_cache')
+    try:
+        max_bytes = int(os.getenv('TTS_CACHE_MAX_BYTES', str(DEFAULT_MAX_BYTES)))
+    except Exception:
+        max_bytes = DEFAULT_MAX_BYTES
+    with _caches_lock:
+        cache = _caches.get(root)
+        if cache is None:
+            cache = _caches[root] = TTSCache(root, max_bytes)
+        cache.max_bytes = max_bytes
+        return cache
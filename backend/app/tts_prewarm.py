@@ -0,0 +1,238 @@
+"""
+Background TTS pre-warming.
+
+Word audio used to be synthesized on the first tap, so the first student to meet
+each word waited for the upstream call. run_prewarm() synthesizes the missing
+pronunciations for a wordbook, a class's assigned words or a word list ahead of
+time, with the default voice and encoding, so each clip lands under the key
+/api/tts/say computes for { text: <word> }. Clips go through
+TTSCache.fetch_through(), so a pre-warm and a live request for the same word
+share one upstream call. Word starts are paced to per_minute across the workers;
+progress is kept in app_meta under 'tts_prewarm:<source>', and since clips
+already in the cache are skipped, an interrupted run resumes by running it
+again. add_word warms its new word on a small in-process pool
+(prewarm_word_async).
+"""
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+import pytz
+from bson.objectid import ObjectId
+
+from .dictionary_index import APP_META
+from .tts_cache import get_tts_cache
+from .tts_upstream import TTSUpstreamError, default_app_cfg, access_token, fetch_tts_audio, simple_request, tts_url
+from .word_pregeneration import Pacer
+
+logger = logging.getLogger(__name__)
+
+_FAILED_LIMIT = 200
+_SAVE_EVERY = 20
+_SPEECH_RE = re.compile(r'^([a-zA-Z\s-]+)')
+
+_async_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='tts-prewarm')
+_running = set()
+_running_lock = threading.Lock()
+
+
+def speech_text(word):
+    """What the practice page sends to /api/tts/say for word (its leading English part)."""
+    w = (word or '').strip()
+    m = _SPEECH_RE.match(w)
+    return (m.group(1) if m else w).strip()
+
+
+def class_words(db, class_id):
+    cls = db.classes.find_one({'_id': ObjectId(class_id)}, {'assignment_word_batches.words': 1})
+    if not cls:
+        raise ValueError(f'class {class_id} not found')
+    words = []
+    for b in cls.get('assignment_word_batches') or []:
+        words.extend(w for w in (b.get('words') or []) if isinstance(w, str) and w)
+    return words
+
+
+def recent_words(db, days):
+    """Dictionary words inserted in the last days (by ObjectId creation time)."""
+    since = ObjectId.from_datetime(datetime.now(pytz.utc) - timedelta(days=days))
+    return [d['word'] for d in db.words.find({'_id': {'$gte': since}}, {'word': 1}) if isinstance(d.get('word'), str)]
+
+
+def _credentials_ok():
+    app_cfg = default_app_cfg()
+    return bool(app_cfg.get('appid') and access_token(app_cfg))
+
+
+def warm_text(text, cache=None):
+    """Make sure the default-voice clip for text is cached; True if it had to be synthesized."""
+    cache = cache or get_tts_cache()
+    key, ext, payload, headers = simple_request(text)
+    if cache.get(key, ext) is not None:
+        return False
+    _, data = cache.fetch_through(key, ext, lambda: fetch_tts_audio(tts_url(), payload, headers))
+    return data is not None
+
+
+def _warm(cache, text, pacer, max_attempts):
+    """('synthesized' | 'cached', None) or (None, error message) for one text."""
+    error = None
+    for attempt in range(max_attempts):
+        pacer.wait()
+        try:
+            return ('synthesized' if warm_text(text, cache) else 'cached'), None
+        except TTSUpstreamError as e:
+            error = e.body.get('message') or e.body.get('error')
+        except Exception as e:
+            error = str(e)
+        if attempt + 1 < max_attempts:
+            time.sleep(min(30, 2 ** attempt))
+    return None, error
+
+
+def _empty_summary():
+    return {
+        'total': 0,
+        'already_cached': 0,
+        'synthesized': 0,
+        'failed': 0,
+        'failed_words': {},
+        'elapsed_seconds': 0.0
+    }
+
+
+def run_prewarm(db, words, source, workers=4, per_minute=120, max_attempts=3, restart=False, log=None):
+    """Synthesize the uncached clips for words; returns the summary (also stored in app_meta)."""
+    if not _credentials_ok():
+        raise ValueError('TTS appid / access token are not configured')
+    state_id = f'tts_prewarm:{source}'
+    state = None if restart else db[APP_META].find_one({'_id': state_id})
+    if not state or state.get('finished_at'):
+        state = {'_id': state_id, 'summary': _empty_summary(), 'started_at': datetime.now(pytz.utc)}
+    summary = state['summary']
+    # synthesized/elapsed add up across resumed runs; the rest describe this run
+    summary.update({'already_cached': 0, 'failed': 0, 'failed_words': {}})
+
+    cache = get_tts_cache()
+    todo, seen = [], set()
+    for w in words:
+        text = speech_text(w) if isinstance(w, str) else ''
+        if not text or text in seen:
+            continue
+        seen.add(text)
+        key, ext, _, _ = simple_request(text)
+        if cache.get(key, ext) is not None:
+            summary['already_cached'] += 1
+        else:
+            todo.append(text)
+    summary['total'] = len(seen)
+    summary['pending'] = len(todo)
+    if log:
+        log(f"{len(todo)} clips to synthesize, {summary['already_cached']} already cached")
+
+    def save(finished):
+        now = datetime.now(pytz.utc)
+        db[APP_META].replace_one({'_id': state_id}, {
+            **state,
+            'summary': summary,
+            'updated_at': now,
+            'finished_at': now if finished else None
+        }, upsert=True)
+
+    save(False)
+    pacer = Pacer(per_minute)
+    started = time.monotonic()
+    base_elapsed = float(summary.get('elapsed_seconds') or 0.0)
+    done_here = 0
+    finished = False
+    ex = ThreadPoolExecutor(max_workers=max(1, workers))
+    try:
+        futures = {ex.submit(_warm, cache, t, pacer, max(1, max_attempts)): t for t in todo}
+        for fut in as_completed(futures):
+            text = futures[fut]
+            status, error = fut.result()
+            done_here += 1
+            summary['pending'] = len(todo) - done_here
+            if status is None:
+                summary['failed'] += 1
+                if len(summary['failed_words']) < _FAILED_LIMIT:
+                    summary['failed_words'][text] = error
+                if log:
+                    log(f"failed: {text}: {error}")
+            elif status == 'synthesized':
+                summary['synthesized'] += 1
+            else:
+                # Warmed meanwhile by a student's request
+                summary['already_cached'] += 1
+            if done_here % _SAVE_EVERY == 0:
+                summary['elapsed_seconds'] = base_elapsed + time.monotonic() - started
+                save(False)
+                if log:
+                    rate = done_here * 60.0 / max(1e-6, time.monotonic() - started)
+                    log(f"{done_here}/{len(todo)} clips, {rate:.1f}/min, {summary['failed']} failed")
+        finished = True
+    finally:
+        ex.shutdown(wait=finished, cancel_futures=True)
+        summary['elapsed_seconds'] = base_elapsed + time.monotonic() - started
+        save(finished)
+    summary['source'] = source
+    return summary
+
+
+def prewarm_status(db, source):
+    state = db[APP_META].find_one({'_id': f'tts_prewarm:{source}'})
+    if not state:
+        return None
+    with _running_lock:
+        running = source in _running
+    return {
+        'source': source,
+        'running': running,
+        'summary': state.get('summary'),
+        'started_at': state.get('started_at'),
+        'updated_at': state.get('updated_at'),
+        'finished_at': state.get('finished_at')
+    }
+
+
+def start_prewarm(db, words, source, **kwargs):
+    """
+    Run run_prewarm on a background thread; False if this process is already
+    warming source. Raises ValueError up front when TTS credentials are missing.
+    """
+    if not _credentials_ok():
+        raise ValueError('TTS appid / access token are not configured')
+    with _running_lock:
+        if source in _running:
+            return False
+        _running.add(source)
+
+    def run():
+        try:
+            run_prewarm(db, words, source, **kwargs)
+        except Exception:
+            logger.exception('tts prewarm %s failed', source)
+        finally:
+            with _running_lock:
+                _running.discard(source)
+
+    threading.Thread(target=run, name=f'tts-prewarm-{source}', daemon=True).start()
+    return True
+
+
+def prewarm_word_async(word):
+    """Warm one word's clip in the background (best effort, for newly added words)."""
+    text = speech_text(word)
+    if not text or not _credentials_ok():
+        return
+
+    def run():
+        try:
+            warm_text(text)
+        except Exception as e:
+            logger.warning('tts prewarm of %r failed: %s', text, e)
+
+    _async_pool.submit(run)
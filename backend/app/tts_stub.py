@@ -0,0 +1,121 @@
+"""
+A local stand-in for the Volcano TTS API, and a benchmark of the TTS client.
+
+    flask --app app tts-stub-server --port 8765 --latency-ms 150
+    VOLCANO_TTS_URL=http://127.0.0.1:8765/api/v1/tts flask --app app run
+
+serves { code: 3000, data: <base64 audio> } for every POST after latency_ms
+(plus optional jitter), failing fail_rate of the calls with a 503, over HTTP/1.1
+keep-alive like the real endpoint. `flask --app app bench-tts` starts one
+in-process (or targets --url) and fires requests through fetch_tts_audio() to
+report throughput and latency; --fresh-connections builds a new client per call
+for comparison with the pooled one.
+"""
+import base64
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .tts_upstream import TTSUpstreamError, build_tts_client, fetch_tts_audio, get_tts_client, simple_request
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except Exception:
+            payload = {}
+        delay = server.latency_ms + random.uniform(0, server.jitter_ms)
+        time.sleep(delay / 1000.0)
+        with server.lock:
+            server.requests += 1
+        if server.fail_rate and random.random() < server.fail_rate:
+            self._reply(503, {'code': 5000, 'message': 'stub failure'})
+            return
+        reqid = (payload.get('request') or {}).get('reqid')
+        self._reply(200, {'reqid': reqid, 'code': 3000, 'message': 'Success', 'data': server.audio_b64})
+
+    def _reply(self, status, obj):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 turns bursts into 1 s SYN retries
+    request_queue_size = 256
+
+
+def make_stub_server(host='127.0.0.1', port=0, latency_ms=100.0, jitter_ms=0.0, fail_rate=0.0, audio_bytes=16 * 1024):
+    """A ThreadingHTTPServer answering like the Volcano TTS API (port 0 picks a free port)."""
+    server = _StubServer((host, port), _StubHandler)
+    server.latency_ms = latency_ms
+    server.jitter_ms = jitter_ms
+    server.fail_rate = fail_rate
+    server.audio_b64 = base64.b64encode(b'\xff\xfb' * (audio_bytes // 2)).decode('ascii')
+    server.requests = 0
+    server.lock = threading.Lock()
+    return server
+
+
+def stub_url(server):
+    host, port = server.server_address[:2]
+    return f'http://{host}:{port}/api/v1/tts'
+
+
+def run_benchmark(url, requests=200, concurrency=20, fresh_connections=False):
+    """Throughput and latency of requests calls to url, concurrency at a time."""
+    latencies = []
+    errors = {}
+    lock = threading.Lock()
+
+    def one(i):
+        _, _, payload, headers = simple_request(f'benchmark {i}')
+        client = build_tts_client() if fresh_connections else get_tts_client()
+        started = time.perf_counter()
+        try:
+            fetch_tts_audio(url, payload, headers, client=client)
+            with lock:
+                latencies.append((time.perf_counter() - started) * 1000.0)
+        except TTSUpstreamError as e:
+            with lock:
+                errors[e.body.get('error')] = errors.get(e.body.get('error'), 0) + 1
+        finally:
+            if fresh_connections:
+                client.close()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as ex:
+        list(ex.map(one, range(requests)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+
+    def pct(q):
+        return round(latencies[min(len(latencies) - 1, int(q * len(latencies)))], 1) if latencies else None
+
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'fresh_connections': fresh_connections,
+        'ok': len(latencies),
+        'errors': errors,
+        'elapsed_seconds': round(elapsed, 3),
+        'requests_per_second': round(requests / elapsed, 1) if elapsed > 0 else 0.0,
+        'latency_ms_p50': pct(0.5),
+        'latency_ms_p95': pct(0.95),
+        'latency_ms_max': round(latencies[-1], 1) if latencies else None
+    }
@@ -0,0 +1,180 @@
+"""
+Volcano TTS calls and the defaults behind /api/tts/say's simple schema.
+
+Shared by the route and the pre-warm job (tts_prewarm.py), so a clip synthesized
+ahead of time gets exactly the cache key a student's { text } request computes:
+sha1 of "voice|encoding|speed|text" with the env default voice and encoding and
+speed 1.0.
+
+Calls go through one pooled httpx client per process (keep-alive, at most
+TTS_MAX_CONNECTIONS, TTS_MAX_KEEPALIVE kept idle) instead of a fresh urlopen
+with a 60 s timeout per miss. Connect, read and pool-wait timeouts are separate
+(TTS_CONNECT_TIMEOUT, TTS_READ_TIMEOUT, TTS_POOL_TIMEOUT). A synthesis query has
+no side effects, so connection errors, timeouts, 429 and 5xx are retried up to
+TTS_RETRY_ATTEMPTS more times with jittered backoff and a fresh reqid.
+`flask --app app tts-stub-server` and `bench-tts` (tts_stub.py) measure it
+against a local stand-in for the vendor.
+"""
+import base64
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import uuid
+
+DEFAULT_TTS_URL = 'https://openspeech.bytedance.com/api/v1/tts'
+
+CONNECT_TIMEOUT = float(os.getenv('TTS_CONNECT_TIMEOUT', '3'))
+READ_TIMEOUT = float(os.getenv('TTS_READ_TIMEOUT', '20'))
+POOL_TIMEOUT = float(os.getenv('TTS_POOL_TIMEOUT', '5'))
+MAX_CONNECTIONS = int(os.getenv('TTS_MAX_CONNECTIONS', '20'))
+MAX_KEEPALIVE = int(os.getenv('TTS_MAX_KEEPALIVE', '10'))
+RETRY_ATTEMPTS = max(0, int(os.getenv('TTS_RETRY_ATTEMPTS', '2')))
+RETRY_BASE_DELAY = float(os.getenv('TTS_RETRY_BASE_DELAY', '0.2'))
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+class TTSUpstreamError(Exception):
+    """The TTS call failed; body is the JSON error returned to the client (502)."""
+
+    def __init__(self, body):
+        super().__init__(body.get('error'))
+        self.body = body
+
+
+def tts_cache_key(voice_type: str, encoding: str, speed_ratio: float, text: str) -> str:
+    base = f"{voice_type}|{encoding}|{speed_ratio}|{text}".encode('utf-8')
+    return hashlib.sha1(base).hexdigest()
+
+
+def clip_ext(encoding: str) -> str:
+    return 'mp3' if encoding == 'mp3' else ('wav' if encoding == 'wav' else ('ogg' if encoding in ('ogg', 'ogg_opus') else encoding))
+
+
+def tts_url() -> str:
+    return os.getenv('VOLCANO_TTS_URL') or DEFAULT_TTS_URL
+
+
+def default_app_cfg() -> dict:
+    return {
+        'appid': os.getenv('TTS_APP_ID', '') or os.getenv('VOLCANO_APP_ID', ''),
+        'token': os.getenv('TTS_ACCESS_TOKEN', '') or os.getenv('VOLCANO_TOKEN', ''),
+        'cluster': os.getenv('VOLCANO_CLUSTER', os.getenv('TTS_CLUSTER', 'volcano_tts')),
+    }
+
+
+def default_user_cfg() -> dict:
+    return {'uid': os.getenv('VOLCANO_UID', 'demo_user')}
+
+
+def default_audio_cfg() -> dict:
+    return {
+        'voice_type': os.getenv('VOLCANO_VOICE_TYPE', 'BV503_streaming') or 'BV503_streaming',
+        'encoding': os.getenv('TTS_DEFAULT_ENCODING', 'mp3'),
+        'rate': int(os.getenv('TTS_DEFAULT_RATE', '24000')),
+    }
+
+
+def access_token(app_cfg: dict) -> str:
+    return (app_cfg.get('token') or os.getenv('TTS_ACCESS_TOKEN', '') or os.getenv('VOLCANO_TOKEN', '')).strip()
+
+
+def request_headers(token: str) -> dict:
+    return {'Content-Type': 'application/json', 'Authorization': f'Bearer;{token}'}
+
+
+def simple_request(text: str):
+    """(key, ext, payload, headers) for a { text } request with the default voice and encoding."""
+    audio_cfg = default_audio_cfg()
+    encoding = audio_cfg['encoding'].lower()
+    key = tts_cache_key(audio_cfg['voice_type'].strip(), encoding, 1.0, text)
+    app_cfg = default_app_cfg()
+    payload = {
+        'app': app_cfg,
+        'user': default_user_cfg(),
+        'audio': audio_cfg,
+        'request': {'reqid': str(uuid.uuid4()), 'text': text, 'operation': 'query'},
+    }
+    return key, clip_ext(encoding), payload, request_headers(access_token(app_cfg))
+
+
+def build_tts_client(max_connections=None, max_keepalive=None):
+    import httpx
+    return httpx.Client(
+        timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT, pool=POOL_TIMEOUT),
+        limits=httpx.Limits(max_connections=max_connections or MAX_CONNECTIONS,
+                            max_keepalive_connections=max_keepalive or MAX_KEEPALIVE),
+    )
+
+
+def get_tts_client():
+    """The process's pooled client (rebuilt after a fork, so workers never share sockets)."""
+    global _client, _client_pid
+    pid = os.getpid()
+    with _client_lock:
+        if _client is None or _client_pid != pid:
+            _client = build_tts_client()
+            _client_pid = pid
+        return _client
+
+
+def _retry_delay(attempt):
+    return random.uniform(0, RETRY_BASE_DELAY * (2 ** attempt))
+
+
+def _with_new_reqid(payload):
+    req = dict(payload.get('request') or {})
+    req['reqid'] = str(uuid.uuid4())
+    return {**payload, 'request': req}
+
+
+def fetch_tts_audio(volcano_url: str, payload: dict, headers: dict, client=None) -> bytes:
+    """Audio bytes from the Volcano TTS API; raises TTSUpstreamError with the error body."""
+    import httpx
+    client = client or get_tts_client()
+    attempt = 0
+    while True:
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        error = None
+        try:
+            resp = client.post(volcano_url, content=body, headers=headers)
+        except httpx.TimeoutException as e:
+            error = {'error': f'TTS network error: timeout ({type(e).__name__})'}
+        except httpx.TransportError as e:
+            error = {'error': f'TTS network error: {e}'}
+        except Exception as e:
+            raise TTSUpstreamError({'error': f'TTS call failed: {e}'})
+        else:
+            if resp.status_code == 429 or resp.status_code >= 500:
+                error = {'error': f'TTS HTTP error: {resp.status_code}', 'detail': resp.text}
+        if error is None:
+            break
+        if attempt >= RETRY_ATTEMPTS:
+            raise TTSUpstreamError(error)
+        time.sleep(_retry_delay(attempt))
+        attempt += 1
+        payload = _with_new_reqid(payload)
+
+    if resp.status_code >= 400:
+        raise TTSUpstreamError({'error': f'TTS HTTP error: {resp.status_code}', 'detail': resp.text})
+    try:
+        parsed = resp.json()
+    except Exception:
+        raise TTSUpstreamError({'error': 'TTS returned non-JSON'})
+
+    code = parsed.get('code')
+    if code != 3000:
+        raise TTSUpstreamError({'error': 'TTS service error', 'code': code, 'message': parsed.get('message'), 'upstream': parsed})
+
+    b64 = parsed.get('data')
+    if not b64:
+        raise TTSUpstreamError({'error': 'TTS response missing audio data', 'upstream': parsed})
+    try:
+        return base64.b64decode(b64)
+    except Exception:
+        raise TTSUpstreamError({'error': 'Failed to decode audio data'})
@@ -0,0 +1,276 @@
+"""
+Inflection table for the dictionary and a local fill-in-the-blank grader.
+
+`word_forms` holds one document per dictionary word:
+    { _id: word, forms: [word, plurals, -s/-ed/-ing, comparatives, irregular forms] }
+generated offline from suffix rules plus the irregular tables below
+(`flask --app app sync-word-forms`, and nightly for words added since). Part of
+speech is unknown, so every rule is applied; over-generating only means more
+answers are treated as "a form of the target" and sent to the AI.
+
+local_fill_blank_verdict() settles the cases that need no judgement:
+    exact          the answer is the expected word                 -> correct
+    empty          nothing was typed                               -> wrong
+    other_word     a dictionary word (or one of its forms) that is
+                   not a form of the target                        -> wrong
+Anything else (another form of the target, unknown spellings, phrases) returns
+None and is graded by the AI, which checks the form against the sentence.
+Graders report the path they took as grading_path: 'local_<reason>' or 'ai'.
+"""
+import re
+import threading
+from datetime import datetime
+
+import pytz
+
+from .dictionary_index import dictionary_words, resolve_word
+
+WORD_FORMS = 'word_forms'
+
+_IRREGULAR_VERBS = """
+arise arose arisen|awake awoke awoken|be was were been am is are|bear bore born borne|beat beat beaten
+become became become|begin began begun|bend bent bent|bet bet bet|bind bound bound|bite bit bitten
+bleed bled bled|blow blew blown|break broke broken|breed bred bred|bring brought brought
+broadcast broadcast broadcast|build built built|burn burnt burned|burst burst burst|buy bought bought
+catch caught caught|choose chose chosen|cling clung clung|come came come|cost cost cost|creep crept crept
+cut cut cut|deal dealt dealt|dig dug dug|do did done does|draw drew drawn|dream dreamt dreamed
+drink drank drunk|drive drove driven|eat ate eaten|fall fell fallen|feed fed fed|feel felt felt
+fight fought fought|find found found|flee fled fled|fling flung flung|fly flew flown flies|forbid forbade forbidden
+forecast forecast forecast|forget forgot forgotten|forgive forgave forgiven|freeze froze frozen
+get got gotten|give gave given|go went gone goes|grind ground ground|grow grew grown|hang hung hanged
+have had has|hear heard heard|hide hid hidden|hit hit hit|hold held held|hurt hurt hurt|keep kept kept
+kneel knelt kneeled|know knew known|lay laid laid|lead led led|lean leant leaned|leap leapt leaped
+learn learnt learned|leave left left|lend lent lent|let let let|lie lay lain lied lying|light lit lighted
+lose lost lost|make made made|mean meant meant|meet met met|mislead misled misled|mistake mistook mistaken
+overcome overcame overcome|overtake overtook overtaken|pay paid paid|prove proved proven|put put put
+quit quit quit|read read read|rid rid rid|ride rode ridden|ring rang rung|rise rose risen|run ran run
+say said said|see saw seen|seek sought sought|sell sold sold|send sent sent|set set set|sew sewed sewn
+shake shook shaken|shed shed shed|shine shone shined|shoot shot shot|show showed shown|shrink shrank shrunk
+shut shut shut|sing sang sung|sink sank sunk|sit sat sat|sleep slept slept|slide slid slid|sling slung slung
+smell smelt smelled|sow sowed sown|speak spoke spoken|speed sped sped|spell spelt spelled|spend spent spent
+spill spilt spilled|spin spun spun|spit spat spat|split split split|spoil spoilt spoiled|spread spread spread
+spring sprang sprung|stand stood stood|steal stole stolen|stick stuck stuck|sting stung stung|stink stank stunk
+stride strode stridden|strike struck struck|string strung strung|strive strove striven|swear swore sworn
+sweep swept swept|swell swelled swollen|swim swam swum|swing swung swung|take took taken|teach taught taught
+tear tore torn|tell told told|think thought thought|throw threw thrown|thrust thrust thrust|tread trod trodden
+undergo underwent undergone|understand understood understood|undertake undertook undertaken|upset upset upset
+wake woke woken|wear wore worn|weave wove woven|weep wept wept|win won won|wind wound wound
+withdraw withdrew withdrawn|withstand withstood withstood|wring wrung wrung|write wrote written
+"""
+
+_IRREGULAR_NOUNS = """
+man men|woman women|child children|person people|foot feet|tooth teeth|goose geese|mouse mice|louse lice
+ox oxen|die dice|criterion criteria|phenomenon phenomena|analysis analyses|basis bases|crisis crises
+thesis theses|hypothesis hypotheses|diagnosis diagnoses|axis axes|medium media|datum data|bacterium bacteria
+curriculum curricula|memorandum memoranda|stimulus stimuli|nucleus nuclei|cactus cacti|fungus fungi
+radius radii|syllabus syllabi|alumnus alumni|appendix appendices|index indices|matrix matrices
+vertex vertices|formula formulae|antenna antennae|larva larvae|sheep sheep|deer deer|fish fishes
+species species|series series|aircraft aircraft|offspring offspring|potato potatoes|tomato tomatoes
+hero heroes|echo echoes|veto vetoes|torpedo torpedoes|volcano volcanoes|mosquito mosquitoes
+"""
+
+_IRREGULAR_ADJECTIVES = """
+good better best|well better best|bad worse worst|badly worse worst|ill worse worst|far farther farthest further furthest
+little less least|many more most|much more most|old older oldest elder eldest|late later latest last
+"""
+
+_VOWELS = set('aeiou')
+
+
+def _table(text):
+    out = {}
+    for entry in text.replace('\n', '|').split('|'):
+        parts = entry.split()
+        if parts:
+            out.setdefault(parts[0], set()).update(parts[1:])
+    return out
+
+
+_IRREGULAR = {}
+for _t in (_IRREGULAR_VERBS, _IRREGULAR_NOUNS, _IRREGULAR_ADJECTIVES):
+    for _base, _forms in _table(_t).items():
+        _IRREGULAR.setdefault(_base, set()).update(_forms)
+
+_WORD_RE = re.compile(r"^[a-z][a-z'\-]*$")
+
+
+def _s_form(w):
+    if w.endswith(('s', 'x', 'z', 'ch', 'sh', 'o')):
+        return [w + 'es', w + 's']
+    if w.endswith('y') and len(w) > 1 and w[-2] not in _VOWELS:
+        return [w[:-1] + 'ies']
+    out = [w + 's']
+    if w.endswith('fe'):
+        out.append(w[:-2] + 'ves')
+    elif w.endswith('f'):
+        out.append(w[:-1] + 'ves')
+    return out
+
+
+def _doubles(w):
+    """True for consonant-vowel-consonant endings that may double (stop, prefer)."""
+    return (len(w) >= 3 and w[-1] not in _VOWELS and w[-1] not in 'wxyc'
+            and w[-2] in _VOWELS and w[-3] not in _VOWELS)
+
+
+def _suffixed(w, suffix):
+    """w + a vowel-initial suffix (-ed, -ing, -er, -est), every plausible spelling."""
+    if suffix == 'ing':
+        if w.endswith('ie'):
+            return [w[:-2] + 'ying']
+        if w.endswith('e') and not w.endswith(('ee', 'ye', 'oe')):
+            return [w[:-1] + 'ing']
+        out = [w + 'ing']
+    else:
+        if w.endswith('e'):
+            return [w + suffix[1:]]
+        if w.endswith('y') and len(w) > 1 and w[-2] not in _VOWELS:
+            return [w[:-1] + 'i' + suffix]
+        out = [w + suffix]
+    if _doubles(w):
+        out.append(w + w[-1] + suffix)
+    if w.endswith('c'):
+        out.append(w + 'k' + suffix)
+    return out
+
+
+def inflect(word):
+    """Every form the rules and irregular tables give for word (including word itself)."""
+    w = (word or '').strip().lower()
+    if not w:
+        return set()
+    forms = {w}
+    if ' ' in w:
+        # Phrases: inflect the first word (give up -> gives up, gave up)
+        head, rest = w.split(' ', 1)
+        return forms | {f'{f} {rest}' for f in inflect(head)}
+    if not _WORD_RE.match(w):
+        return forms
+    forms.update(_s_form(w))
+    for suffix in ('ed', 'ing', 'er', 'est'):
+        forms.update(_suffixed(w, suffix))
+    forms.update(_IRREGULAR.get(w, ()))
+    return forms
+
+
+def ensure_word_forms_indexes(db):
+    try:
+        db[WORD_FORMS].create_index([('forms', 1)])
+    except Exception:
+        pass
+
+
+def sync_word_forms(db, rebuild=False, batch_size=1000, log=None):
+    """
+    Bring word_forms in line with the dictionary: add missing words, drop deleted
+    ones (rebuild regenerates every entry). Returns counts.
+    """
+    from pymongo import ReplaceOne
+    words = set(dictionary_words(db))
+    have = {d['_id'] for d in db[WORD_FORMS].find({}, {'_id': 1})}
+    missing = sorted(words if rebuild else words - have)
+    now = datetime.now(pytz.utc)
+    written = 0
+    for i in range(0, len(missing), batch_size):
+        chunk = missing[i:i + batch_size]
+        ops = [ReplaceOne({'_id': w}, {'forms': sorted(inflect(w)), 'updated_at': now}, upsert=True)
+               for w in chunk]
+        db[WORD_FORMS].bulk_write(ops, ordered=False)
+        written += len(chunk)
+        if log:
+            log(f"word_forms: {written}/{len(missing)} written")
+    stale = list(have - words)
+    removed = 0
+    for i in range(0, len(stale), batch_size):
+        removed += db[WORD_FORMS].delete_many({'_id': {'$in': stale[i:i + batch_size]}}).deleted_count
+    with _lock:
+        _lemma_cache.clear()
+    return {'written': written, 'removed': removed, 'dictionary_words': len(words)}
+
+
+# --- Local grading ---
+
+_stats = {}
+_lock = threading.Lock()
+_lemma_cache = {}
+_LEMMA_CACHE_MAX = 20000
+
+
+def _normalize(answer):
+    return re.sub(r'\s+', ' ', (answer or '').strip().strip('.,!?;:"').strip()).lower()
+
+
+def _lemmas_of(db, form):
+    """Dictionary words that have form among their inflections (cached per process)."""
+    with _lock:
+        if form in _lemma_cache:
+            return _lemma_cache[form]
+    try:
+        lemmas = frozenset(d['_id'] for d in db[WORD_FORMS].find({'forms': form}, {'_id': 1}).limit(20))
+    except Exception:
+        return None
+    with _lock:
+        if len(_lemma_cache) >= _LEMMA_CACHE_MAX:
+            _lemma_cache.clear()
+        _lemma_cache[form] = lemmas
+    return lemmas
+
+
+def count_grading_path(path):
+    with _lock:
+        _stats[path] = _stats.get(path, 0) + 1
+
+
+def fill_blank_grading_stats() -> dict:
+    """Answers settled per grading_path in this process, and the share graded locally."""
+    with _lock:
+        by_path = dict(_stats)
+    total = sum(by_path.values())
+    local = sum(n for path, n in by_path.items() if path.startswith('local_'))
+    return {'by_path': by_path, 'total': total,
+            'local_rate': round(local / total, 3) if total else 0.0}
+
+
+def local_fill_blank_verdict(db, answer, target):
+    """
+    (path, is_correct, detail) when the answer can be graded without the AI,
+    otherwise None. detail is the dictionary word the answer belongs to for
+    'other_word', else None.
+    """
+    a = _normalize(answer)
+    t = _normalize(target)
+    if not t:
+        return None
+    if not a:
+        return 'empty', False, None
+    if a == t:
+        return 'exact', True, None
+    try:
+        # Forms of the target, and of the lemma(s) when the target is itself inflected
+        target_forms = inflect(t)
+        for lemma in (_lemmas_of(db, t) or ()):
+            target_forms |= inflect(lemma)
+        if a in target_forms:
+            return None
+        other = resolve_word(db, a)
+        if other is None:
+            lemmas = _lemmas_of(db, a)
+            if not lemmas:
+                return None
+            other = sorted(lemmas)[0]
+    except Exception:
+        # No dictionary to check against: let the AI decide
+        return None
+    if other.lower() == t:
+        return None
+    return 'other_word', False, other
+
+
+
+def local_fill_blank_feedback(reason, answer, target, other=None):
+    if reason == 'exact':
+        return f"Excellent! '{target}' is exactly the word this sentence needs."
+    if reason == 'other_word':
+        return (f"Not quite. '{answer}' is a different word ({other}), but the blank needs a form of "
+                f"'{target}'. The correct answer is '{target}'.")
+    return f"You did not write an answer. The correct answer is '{target}'."
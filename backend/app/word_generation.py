@@ -0,0 +1,242 @@
+"""
+Section-by-section generation of a dictionary word's content.
+
+A generated word is 13 independent AI sections:
+    core                          {definition_cn, definition_en}
+    sample_sentence:<0-2>         {sentence, translation}; each sees the earlier ones
+    exercise:<kind>:<tier>        one string per exercise kind and tier (9 of them)
+run_word_generation() runs them and assembles the word document. The caller
+decides how: in the request with a thread pool (/api/words/generate-data), or one
+section at a time through a `section(name, fn)` hook that checkpoints each result
+(generation_jobs), so a restarted job skips sections it already has.
+"""
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .ai_gateway import AIGatewayError, PRIORITY_GENERATION
+from .sse import EventSink
+
+SYSTEM_PROMPT = "You are an expert English teacher creating learning materials for Chinese junior high school students. Keep language simple and precise. Always respond with a single valid JSON object."
+
+TIERS = ('tier_1', 'tier_2', 'tier_3')
+# kind -> (exercise type, field holding the per-tier values)
+EXERCISE_KINDS = {
+    'infer': ('infer_meaning', 'sentences'),
+    'scramble': ('sentence_reordering', 'sentence_answer'),
+    'synonym': ('synonym_replacement', 'sentence'),
+}
+SAMPLE_SENTENCES = 3
+
+
+def section_names():
+    names = ['core'] + [f'sample_sentence:{i}' for i in range(SAMPLE_SENTENCES)]
+    names += [f'exercise:{k}:{t}' for k in EXERCISE_KINDS for t in TIERS]
+    return names
+
+
+def _call(prompt, user_id):
+    from .ai import call_deepseek_api
+    return call_deepseek_api(user_prompt=prompt, system_prompt=SYSTEM_PROMPT, expect_json=True,
+                             model='deepseek-chat', user_id=user_id, priority=PRIORITY_GENERATION,
+                             site='word_generation')
+
+
+def generate_core(word, user_id):
+    prompt = f"""
+    请为英文单词“{word}”生成核心释义（基于该词最常见的含义），返回一个JSON：
+    {{
+      "definition_cn": "中文释义",
+      "definition_en": "A simple English definition suitable for a junior high student."
+    }}
+    """
+    return json.loads(_call(prompt, user_id))
+
+
+def _sentence_prompt(core, kind, prev):
+    if kind == 1:
+        hint = "小学水平"
+    elif kind == 2:
+        hint = "初中水平"
+    else:
+        hint = "初中水平（不同语境）"
+    prev_hint = "\n".join(f"- {p}" for p in prev) if prev else "无"
+    return (
+        f"根据该词最常见含义（中文：{core.get('definition_cn', '')}; 英文：{core.get('definition_en', '')}），生成一个{hint}的英文例句，并给出对应中文翻译。要求：\n"
+        f"1) 句子尽量短，词汇简单（CEFR A1-A2）。\n"
+        f"2) 不得与以下已生成句子重复或高度相似：\n{prev_hint}\n"
+        f"用 JSON 返回：{{\"sentence\": \"英文句子\", \"translation\": \"中文翻译\"}}"
+    )
+
+
+def generate_sample_sentence(word, core, index, prev, user_id):
+    """One sample sentence distinct from prev (up to 3 tries); blank pair if none works."""
+    def _json_pair():
+        try:
+            data = json.loads(_call(_sentence_prompt(core, index + 1, prev), user_id))
+            return {
+                'sentence': (data.get('sentence') or '').strip(),
+                'translation': (data.get('translation') or '').strip()
+            }
+        except AIGatewayError:
+            raise
+        except Exception:
+            return {'sentence': '', 'translation': ''}
+
+    seen = {p.lower() for p in prev}
+    for _ in range(3):
+        pair = _json_pair()
+        if pair['sentence'] and pair['sentence'].lower() not in seen:
+            return pair
+    return {'sentence': '', 'translation': ''}
+
+
+# Prompts for infer_meaning (per tier)
+def _infer_prompt(word, tier):
+    if tier == 'tier_1':
+        return (
+            f"请生成一个英文短段落（约30-50词，SAT 难度），包含丰富的逻辑连接词，并自然包含 [{word}]。"
+            f"不要解释或加引号；仅返回段落文本。用 JSON 返回：{{\"value\": \"...\"}}"
+        )
+    if tier == 'tier_2':
+        return (
+            f"请生成一个英文长句（15-25词，TOEFL 难度），必须恰好出现一次并且只出现一次 [{word}]（用方括号括住）。"
+            f"句子不要使用段落结构；不要包含逗号超过2个；避免使用 however/therefore 等明显段落过渡词。"
+            f"不要解释或加引号；仅返回句子文本。用 JSON 返回：{{\"value\": \"...\"}}"
+        )
+    # tier_3: Chinese sentence, only English is [word]
+    return (
+        f"请生成一个中文句子，其中唯一的英文是 [{word}]，其它全部用中文描述其语境。"
+        f"用 JSON 返回：{{\"value\": \"...\"}}"
+    )
+
+
+# Prompts for sentence_reordering (scramble) -> sentence_answer per tier
+def _scramble_prompt(word, tier):
+    if tier == 'tier_1':
+        return (
+            f"请生成一个英文短段落（约30词，SAT 难度），使用多个逻辑连接词（如 however, therefore, moreover, although 等），并包含 {word}。"
+            f"不要解释或加引号；仅返回段落文本。用 JSON 返回：{{\"value\": \"...\"}}"
+        )
+    if tier == 'tier_2':
+        return (
+            f"请生成一个英文长句（15-20词，TOEFL 难度），必须包含 {word}，且严禁使用任何方括号。"
+            f"该句应包含一个从属子句或关系从句，且至少包含一个逗号。与“infer_meaning”的句子在语气与结构上应明显不同（例如可使用被动语态或让步从句）。"
+            f"不要解释或加引号；仅返回句子文本。用 JSON 返回：{{\"value\": \"...\"}}"
+        )
+    return (
+        f"请生成一个非常简单的英文句子（5词左右，适合小学生），并包含 {word}。"
+        f"用 JSON 返回：{{\"value\": \"...\"}}"
+    )
+
+
+# Prompts for synonym_replacement -> sentence per tier
+def _synonym_prompt(word, tier):
+    if tier == 'tier_1':
+        return (
+            f"请生成一个英文短段落（约30-50词，SAT 难度），其中 {word} 被其英文同义表达替换，并用[]括住该同义表达。"
+            f"仅返回段落文本；JSON 返回：{{\"value\": \"...\"}}"
+        )
+    if tier == 'tier_2':
+        return (
+            f"请生成一个英文长句（15-25词，TOEFL 难度），其中 {word} 被其英文同义表达替换，并用[]括住该同义表达。"
+            f"仅返回句子文本；JSON 返回：{{\"value\": \"...\"}}"
+        )
+    return (
+        f"请生成一个中文句子，其中 '{word}' 被它的中文释义替换，并用[]括起来。"
+        f"仅返回句子文本；JSON 返回：{{\"value\": \"...\"}}"
+    )
+
+
+_EXERCISE_PROMPTS = {'infer': _infer_prompt, 'scramble': _scramble_prompt, 'synonym': _synonym_prompt}
+
+
+def generate_exercise_value(word, kind, tier, user_id):
+    resp = _call(_EXERCISE_PROMPTS[kind](word, tier), user_id)
+    try:
+        data = json.loads(resp)
+        return data.get('value', '').strip()
+    except Exception:
+        return ''
+
+
+def assemble_word_data(word, core, sentences, values):
+    """Word document in the generate-data output schema; values maps (kind, tier) -> str."""
+    exercises = []
+    for kind, (ex_type, field) in EXERCISE_KINDS.items():
+        ex = {'type': ex_type, field: {t: values.get((kind, t), '') for t in TIERS}}
+        if kind == 'infer':
+            ex['options_type'] = {'tier_1': 'en', 'tier_2': 'cn', 'tier_3': 'cn'}
+        exercises.append(ex)
+    return {
+        "word": word,
+        "word_root": word,
+        **core,
+        "sample_sentences": sentences,
+        "exercises": exercises
+    }
+
+
+def empty_sections(doc):
+    """Names of the sections left blank in an assembled document (failed generations)."""
+    empty = []
+    if not doc.get('definition_cn') and not doc.get('definition_en'):
+        empty.append('core')
+    for i, pair in enumerate(doc.get('sample_sentences') or []):
+        if not (pair.get('sentence') or '').strip() or not (pair.get('translation') or '').strip():
+            empty.append(f'sample_sentence:{i}')
+    fields = {ex_type: (kind, field) for kind, (ex_type, field) in EXERCISE_KINDS.items()}
+    for ex in doc.get('exercises') or []:
+        kind, field = fields.get(ex.get('type'), (ex.get('type'), None))
+        for tier in TIERS:
+            if not ((ex.get(field) or {}).get(tier) or '').strip():
+                empty.append(f'exercise:{kind}:{tier}')
+    return empty
+
+
+def run_word_generation(app, word, user_id, sink=None, section=None, workers=1):
+    """
+    Generate every section of word and return the assembled document.
+    sink receives 'core', 'sample_sentence' and 'exercise' events; section(name, fn)
+    wraps each section (default: just call fn); workers > 1 runs the sample sentences
+    and the exercises on a thread pool.
+    """
+    sink = sink or EventSink()
+    section = section or (lambda name, fn: fn())
+
+    def in_app(fn):
+        def run(*args):
+            with app.app_context():
+                return fn(*args)
+        return run
+
+    core = section('core', lambda: generate_core(word, user_id))
+    sink.emit('core', core)
+
+    def sentences():
+        out = []
+        for i in range(SAMPLE_SENTENCES):
+            prev = [r['sentence'] for r in out]
+            pair = section(f'sample_sentence:{i}', lambda i=i, prev=prev: generate_sample_sentence(word, core, i, prev, user_id))
+            out.append(pair)
+            sink.emit('sample_sentence', {'index': i, **pair})
+        return out
+
+    def exercise(kind, tier):
+        value = section(f'exercise:{kind}:{tier}', lambda: generate_exercise_value(word, kind, tier, user_id))
+        sink.emit('exercise', {'type': EXERCISE_KINDS[kind][0], 'tier': tier, 'value': value})
+        return value
+
+    keys = [(k, t) for k in EXERCISE_KINDS for t in TIERS]
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            fut_sentences = ex.submit(in_app(sentences))
+            futures = {ex.submit(in_app(exercise), k, t): (k, t) for k, t in keys}
+            values = {}
+            for fut in as_completed(futures):
+                values[futures[fut]] = fut.result()
+            sample = fut_sentences.result()
+    else:
+        sample = sentences()
+        values = {(k, t): exercise(k, t) for k, t in keys}
+
+    return assemble_word_data(word, core, sample, values)
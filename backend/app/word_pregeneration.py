@@ -0,0 +1,199 @@
+"""
+Bulk pre-generation of dictionary words (`flask --app app pregenerate-words`).
+
+Loading a new wordbook used to mean generate-data + add-word per word from the
+admin UI. This takes a word list (a file, one word per line) or a wordbook's
+entries, skips words already in the dictionary, generates the rest on a few
+threads paced to a words-per-minute budget, and upserts the documents into
+`words` with bulk_write every flush_size words. Progress (counters and failed
+words) is kept in app_meta under 'pregenerate:<source>'; the words themselves
+are the real checkpoint, so an interrupted run (or a rerun after failures) picks
+up the words that are still missing. A finished run starts a fresh summary next time.
+"""
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import pytz
+from bson.objectid import ObjectId
+
+from .ai_gateway import AIGatewayError
+from .dictionary_index import APP_META, bump_dictionary_version, resolve_word
+from .ghost_cleanup import is_invalid_word
+from .word_generation import empty_sections, run_word_generation
+
+_FAILED_LIMIT = 200
+
+
+def read_word_list(lines):
+    """Words from text lines; blank lines and '#' comments are ignored."""
+    words = []
+    for line in lines:
+        w = line.split('#', 1)[0].strip()
+        if w:
+            words.append(w)
+    return words
+
+
+def wordbook_words(db, wordbook_id):
+    wb = db.wordbooks.find_one({'_id': ObjectId(wordbook_id)}, {'entries.word': 1})
+    if not wb:
+        raise ValueError(f'wordbook {wordbook_id} not found')
+    return [e.get('word') for e in (wb.get('entries') or []) if isinstance(e.get('word'), str)]
+
+
+def source_id(words=None, wordbook_id=None):
+    if wordbook_id:
+        return f'wordbook:{wordbook_id}'
+    digest = hashlib.sha1('\n'.join(words or []).encode('utf-8')).hexdigest()[:16]
+    return f'list:{digest}'
+
+
+def _empty_summary():
+    return {
+        'total': 0,
+        'invalid': 0,
+        'skipped_existing': 0,
+        'generated': 0,
+        'inserted': 0,
+        'failed': 0,
+        'failed_words': {},
+        'elapsed_seconds': 0.0
+    }
+
+
+class Pacer:
+    """Spaces word starts evenly to stay under per_minute (<= 0 means no limit)."""
+
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute if per_minute and per_minute > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def _generate(app, word, pacer, max_attempts):
+    """(document, None) or (None, error message) for one word."""
+    error = None
+    for attempt in range(max_attempts):
+        pacer.wait()
+        try:
+            with app.app_context():
+                doc = run_word_generation(app, word, None)
+            # A blank section would be inserted for good (reruns skip existing words)
+            empty = empty_sections(doc)
+            if empty:
+                error = f"empty sections: {', '.join(empty)}"
+                continue
+            return doc, None
+        except AIGatewayError as e:
+            # Busy, not broken: wait as told and try again
+            error = str(e)
+            time.sleep(e.retry_after)
+        except Exception as e:
+            error = str(e)
+            time.sleep(min(30, 2 ** attempt))
+    return None, error
+
+
+def _flush(db, docs):
+    """Upsert generated documents; returns how many were new."""
+    from pymongo import UpdateOne
+    if not docs:
+        return 0
+    ops = [UpdateOne({'word': d['word']}, {'$setOnInsert': d}, upsert=True) for d in docs]
+    result = db.words.bulk_write(ops, ordered=False)
+    if result.upserted_count:
+        bump_dictionary_version(db)
+    return result.upserted_count
+
+
+def run_pregeneration(app, db, words, source, workers=4, words_per_minute=0, flush_size=25,
+                      max_attempts=3, restart=False, log=None):
+    """Generate and insert every word of words not yet in the dictionary. Returns the summary."""
+    state_id = f'pregenerate:{source}'
+    state = None if restart else db[APP_META].find_one({'_id': state_id})
+    if not state or state.get('finished_at'):
+        state = {'_id': state_id, 'summary': _empty_summary(), 'started_at': datetime.now(pytz.utc)}
+    summary = state['summary']
+    # generated/inserted/elapsed add up across resumed runs; the rest describe this run
+    summary.update({'invalid': 0, 'skipped_existing': 0, 'failed': 0, 'failed_words': {}})
+
+    todo, seen = [], set()
+    for w in words:
+        w = w.strip() if isinstance(w, str) else w
+        if w in seen:
+            continue
+        seen.add(w)
+        if is_invalid_word(w):
+            summary['invalid'] += 1
+        elif resolve_word(db, w) is not None:
+            summary['skipped_existing'] += 1
+        else:
+            todo.append(w)
+    summary['total'] = len(seen)
+    if log:
+        log(f"{len(todo)} to generate, {summary['skipped_existing']} already in the dictionary, "
+            f"{summary['invalid']} invalid")
+
+    def save(finished):
+        now = datetime.now(pytz.utc)
+        db[APP_META].replace_one({'_id': state_id}, {
+            **state,
+            'summary': summary,
+            'updated_at': now,
+            'finished_at': now if finished else None
+        }, upsert=True)
+
+    pacer = Pacer(words_per_minute)
+    buffer = []
+    started = time.monotonic()
+    base_elapsed = float(summary.get('elapsed_seconds') or 0.0)
+    done_here = 0
+    finished = False
+    ex = ThreadPoolExecutor(max_workers=max(1, workers))
+    try:
+        futures = {ex.submit(_generate, app, w, pacer, max(1, max_attempts)): w for w in todo}
+        for fut in as_completed(futures):
+            word = futures[fut]
+            doc, error = fut.result()
+            done_here += 1
+            if doc is None:
+                summary['failed'] += 1
+                if len(summary['failed_words']) < _FAILED_LIMIT:
+                    summary['failed_words'][word] = error
+                if log:
+                    log(f"failed: {word}: {error}")
+            else:
+                summary['generated'] += 1
+                buffer.append(doc)
+            if len(buffer) >= flush_size:
+                summary['inserted'] += _flush(db, buffer)
+                buffer = []
+                summary['elapsed_seconds'] = base_elapsed + time.monotonic() - started
+                save(False)
+                if log:
+                    rate = done_here * 60.0 / max(1e-6, time.monotonic() - started)
+                    log(f"{done_here}/{len(todo)} words, {rate:.1f}/min, "
+                        f"{summary['inserted']} inserted, {summary['failed']} failed")
+        finished = True
+    finally:
+        ex.shutdown(wait=finished, cancel_futures=True)
+        summary['inserted'] += _flush(db, buffer)
+        elapsed = time.monotonic() - started
+        summary['elapsed_seconds'] = base_elapsed + elapsed
+        save(finished)
+    summary['words_per_minute'] = round(done_here * 60.0 / elapsed, 2) if elapsed > 0 else 0.0
+    summary['source'] = source
+    return summary
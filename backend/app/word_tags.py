@@ -0,0 +1,123 @@
+"""
+word -> tags projection of wordbook entries.
+
+The word list used to $lookup every wordbook containing each listed word and
+unwind all of their entries to collect tags. `word_tags` keeps one small document
+per word instead:
+    { word, books: [wordbook_id], by_book: [{book, tags}], tags: [union of by_book.tags] }
+refresh_wordbook_tags(db, wordbook_id) re-syncs one book's contribution and is
+called after any write to a wordbook's entries (a deleted book simply contributes
+nothing). rebuild_word_tags() recomputes everything from scratch.
+"""
+from datetime import datetime
+
+import pytz
+
+WORD_TAGS = 'word_tags'
+
+_UNION_TAGS = [{'$set': {'tags': {'$reduce': {
+    'input': {'$ifNull': ['$by_book.tags', []]},
+    'initialValue': [],
+    'in': {'$setUnion': ['$$value', {'$ifNull': ['$$this', []]}]}
+}}}}]
+
+
+def ensure_word_tags_indexes(db):
+    try:
+        db[WORD_TAGS].create_index([('word', 1)], unique=True)
+        db[WORD_TAGS].create_index([('books', 1)])
+    except Exception:
+        pass
+
+
+def _entry_tags(entries):
+    """{word: sorted tag list} for one wordbook's entries."""
+    out = {}
+    for e in (entries or []):
+        if not isinstance(e, dict) or not isinstance(e.get('word'), str) or not e.get('word'):
+            continue
+        tags = out.setdefault(e['word'], set())
+        for t in (e.get('tags') or []):
+            if isinstance(t, str):
+                tags.add(t)
+    return {w: sorted(t) for w, t in out.items()}
+
+
+def refresh_wordbook_tags(db, wordbook_ids):
+    """
+    Re-sync word_tags with the current entries of one or more wordbooks.
+    Never raises: a failed sync only leaves stale tags until the next refresh
+    or rebuild-word-tags, and must not fail the wordbook write that triggered it.
+    """
+    try:
+        return _refresh(db, wordbook_ids)
+    except Exception:
+        return 0
+
+
+def _refresh(db, wordbook_ids):
+    from pymongo import UpdateOne
+    if not isinstance(wordbook_ids, (list, tuple, set)):
+        wordbook_ids = [wordbook_ids]
+    touched = set()
+    for wb_id in wordbook_ids:
+        wb = db.wordbooks.find_one({'_id': wb_id}, {'entries.word': 1, 'entries.tags': 1}) or {}
+        new = _entry_tags(wb.get('entries'))
+        old = {}
+        for d in db[WORD_TAGS].find({'books': wb_id}, {'word': 1, 'by_book': {'$elemMatch': {'book': wb_id}}}):
+            contrib = (d.get('by_book') or [{}])[0]
+            old[d.get('word')] = sorted(contrib.get('tags') or [])
+        ops = []
+        for w in old:
+            if w not in new:
+                ops.append(UpdateOne({'word': w}, {'$pull': {'by_book': {'book': wb_id}, 'books': wb_id}}))
+        for w, tags in new.items():
+            if old.get(w) == tags:
+                continue
+            if w in old:
+                ops.append(UpdateOne({'word': w}, {'$pull': {'by_book': {'book': wb_id}}}))
+            ops.append(UpdateOne(
+                {'word': w},
+                {'$push': {'by_book': {'book': wb_id, 'tags': tags}}, '$addToSet': {'books': wb_id}},
+                upsert=True
+            ))
+        if ops:
+            db[WORD_TAGS].bulk_write(ops, ordered=True)
+            touched.update(w for w in set(old) | set(new) if old.get(w) != new.get(w))
+    if touched:
+        db[WORD_TAGS].update_many({'word': {'$in': list(touched)}}, _UNION_TAGS)
+    return len(touched)
+
+
+def tags_for_words(db, words):
+    """{word: tags} for the given words; words with no wordbook entry are absent."""
+    if not words:
+        return {}
+    cur = db[WORD_TAGS].find({'word': {'$in': list(words)}}, {'_id': 0, 'word': 1, 'tags': 1})
+    return {d.get('word'): d.get('tags') or [] for d in cur}
+
+
+def rebuild_word_tags(db, batch_size=1000, log=None):
+    """Recompute word_tags from every wordbook (replaces the collection's contents)."""
+    ensure_word_tags_indexes(db)
+    by_word = {}
+    books = 0
+    for wb in db.wordbooks.find({}, {'entries.word': 1, 'entries.tags': 1}):
+        books += 1
+        for w, tags in _entry_tags(wb.get('entries')).items():
+            by_word.setdefault(w, []).append({'book': wb['_id'], 'tags': tags})
+    now = datetime.now(pytz.utc)
+    db[WORD_TAGS].delete_many({})
+    batch = []
+    for w, contribs in by_word.items():
+        union = sorted(set(t for c in contribs for t in c['tags']))
+        batch.append({'word': w, 'books': [c['book'] for c in contribs], 'by_book': contribs,
+                      'tags': union, 'updated_at': now})
+        if len(batch) >= batch_size:
+            db[WORD_TAGS].insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        db[WORD_TAGS].insert_many(batch, ordered=False)
+    if log:
+        log(f"{books} wordbooks, {len(by_word)} words")
+    return {'wordbooks': books, 'words': len(by_word)}
@@ -59,6 +59,64 @@ let __lastObjectUrl = null;
 let __ttsEpoch = 0;
 const __activeTtsControllers = new Set();
 
+// text -> cacheable GET /api/tts/audio/<key>.<ext> URL; the browser caches the audio itself
+const __ttsUrlCache = new Map();
+const TTS_URL_CACHE_MAX = 500;
+
+const postTTS = (text, extra, signal) => {
+  const token = localStorage.getItem('token');
+  return fetch(`/api/tts/say`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      ...(token ? { 'Authorization': `Bearer ${token}` } : {}),
+    },
+    body: JSON.stringify({ text, ...extra }),
+    signal,
+  });
+};
+
+// Audio source for text: the cached clip's GET URL, else an object URL of the POSTed audio
+const loadTTSSource = async (text, signal) => {
+  const known = __ttsUrlCache.get(text);
+  if (known) return known;
+  const res = await postTTS(text, { as_url: true }, signal);
+  if (res.ok) {
+    const data = await res.json().catch(() => null);
+    if (data && data.url) {
+      if (__ttsUrlCache.size >= TTS_URL_CACHE_MAX) __ttsUrlCache.clear();
+      __ttsUrlCache.set(text, data.url);
+      return data.url;
+    }
+  }
+  const fallback = await postTTS(text, {}, signal);
+  if (!fallback.ok) throw new Error('TTS request failed');
+  const blob = await fallback.blob();
+  const url = URL.createObjectURL(blob);
+  __lastObjectUrl = url;
+  return url;
+};
+
+// A remembered clip URL 404s once the server evicts the clip: forget it, ask
+// /api/tts/say again (which re-synthesizes and re-caches) and play that instead
+const retryEvictedTTS = async (audio, text, url, isCurrent, signal) => {
+  if (__ttsUrlCache.get(text) !== url) return false;
+  __ttsUrlCache.delete(text);
+  if (!isCurrent()) return false;
+  const fresh = await loadTTSSource(text, signal);
+  if (!isCurrent()) return false;
+  audio.src = fresh;
+  await audio.play();
+  return true;
+};
+
+// Detach the previous clip's handlers before clearing src (which fires 'error')
+const resetSharedAudio = (audio) => {
+  audio.onended = null; audio.onerror = null;
+  try { audio.pause(); } catch (_) {}
+  audio.src = '';
+};
+
 const ensureSharedAudio = () => {
   if (!__sharedAudio) {
     try { __sharedAudio = new Audio(); } catch (_) { __sharedAudio = null; }
@@ -88,10 +146,7 @@ export const skipAllTTS = () => {
     }
     __activeTtsControllers.clear();
     const audio = ensureSharedAudio();
-    if (audio) {
-      try { audio.pause(); } catch (_) {}
-      audio.src = '';
-    }
+    if (audio) resetSharedAudio(audio);
     if (__lastObjectUrl) {
       try { URL.revokeObjectURL(__lastObjectUrl); } catch (_) {}
       __lastObjectUrl = null;
@@ -104,34 +159,18 @@ export const cancelAllTTS = skipAllTTS;
 export const playTTS = async (text) => {
   if (!text) return;
   const epoch = __ttsEpoch;
-  const token = localStorage.getItem('token');
   const controller = new AbortController();
   __activeTtsControllers.add(controller);
   try {
     // Stop any current playback
     const audio = ensureSharedAudio();
-    if (audio) {
-      try { audio.pause(); } catch (_) {}
-      audio.src = '';
-    }
+    if (audio) resetSharedAudio(audio);
     if (__lastObjectUrl) {
       try { URL.revokeObjectURL(__lastObjectUrl); } catch (_) {}
       __lastObjectUrl = null;
     }
-    const res = await fetch(`/api/tts/say`, {
-      method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-        ...(token ? { 'Authorization': `Bearer ${token}` } : {}),
-      },
-      body: JSON.stringify({ text }),
-      signal: controller.signal,
-    });
-    if (!res.ok) throw new Error('TTS request failed');
-    const blob = await res.blob();
+    const url = await loadTTSSource(text, controller.signal);
     if (epoch !== __ttsEpoch) return; // stale
-    const url = URL.createObjectURL(blob);
-    __lastObjectUrl = url;
     if (!audio) return;
     audio.src = url;
     audio.onended = () => {
@@ -140,6 +179,7 @@ export const playTTS = async (text) => {
     };
     audio.onerror = () => {
       audio.onended = null; audio.onerror = null;
+      retryEvictedTTS(audio, text, url, () => epoch === __ttsEpoch).catch(() => {});
     };
     await audio.play().catch(() => {});
   } catch (_) {
@@ -152,36 +192,31 @@ export const playTTS = async (text) => {
 export const playTTSOnceWait = async (text, maxWaitMs = 2200) => {
   if (!text) return;
   const startEpoch = __ttsEpoch;
-  const token = localStorage.getItem('token');
   const controller = new AbortController();
   __activeTtsControllers.add(controller);
   try {
     const audio = ensureSharedAudio();
-    if (audio) { try { audio.pause(); } catch (_) {} audio.src = ''; }
+    if (audio) resetSharedAudio(audio);
     if (__lastObjectUrl) { try { URL.revokeObjectURL(__lastObjectUrl); } catch (_) {} __lastObjectUrl = null; }
-    const res = await fetch(`/api/tts/say`, {
-      method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-        ...(token ? { 'Authorization': `Bearer ${token}` } : {}),
-      },
-      body: JSON.stringify({ text }),
-      signal: controller.signal,
-    });
-    if (!res.ok) throw new Error('TTS request failed');
-    const blob = await res.blob();
+    const url = await loadTTSSource(text, controller.signal);
     if (startEpoch !== __ttsEpoch) return; // cancelled
-    const url = URL.createObjectURL(blob);
-    __lastObjectUrl = url;
     if (!audio) return;
     audio.src = url;
     await new Promise((resolve) => {
       let done = false;
       const finish = () => { if (done) return; done = true; resolve(); };
       const to = setTimeout(finish, Math.max(1500, Math.min(20000, maxWaitMs)));
+      const fail = () => { clearTimeout(to); finish(); };
+      let retrying = false;
       audio.onended = () => { clearTimeout(to); finish(); };
-      audio.onerror = () => { clearTimeout(to); finish(); };
-      audio.play().catch(() => { clearTimeout(to); finish(); });
+      audio.onerror = () => {
+        retrying = true;
+        audio.onerror = fail;
+        retryEvictedTTS(audio, text, url, () => startEpoch === __ttsEpoch, controller.signal)
+          .then((retried) => { if (!retried) fail(); })
+          .catch(fail);
+      };
+      audio.play().catch(() => { if (!retrying) fail(); });
     });
   } catch (_) {
     // ignore
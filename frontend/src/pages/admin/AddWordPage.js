@@ -17,9 +17,37 @@ const api = {
         throw new Error(errorData.message || 'Request failed');
     }
     return response.json();
+  },
+  get: async (endpoint) => {
+    const token = localStorage.getItem('token');
+    const response = await fetch(endpoint, {
+      headers: { 'Authorization': `Bearer ${token}` }
+    });
+    if (!response.ok) {
+        const errorData = await response.json();
+        throw new Error(errorData.message || 'Request failed');
+    }
+    return response.json();
   }
 };
 
+const JOB_POLL_MS = 2000;
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+// Generation runs in the generation worker: queue a job and poll it until it finishes
+const generateWordData = async (word, onProgress) => {
+    let job = await api.post('/api/words/generate-data/jobs', { word });
+    while (job.status === 'queued' || job.status === 'running') {
+        if (onProgress) onProgress(job);
+        await sleep(JOB_POLL_MS);
+        job = await api.get(`/api/words/generate-data/jobs/${job.job_id}`);
+    }
+    if (job.status !== 'done') {
+        throw new Error(job.error || 'Generation failed');
+    }
+    return job.result;
+};
+
 // SpecifyMeaningModal removed in simplified flow
 
 
@@ -89,6 +117,7 @@ const AddWordPage = () => {
     const [isSaving, setIsSaving] = useState(false);
     const [generatedData, setGeneratedData] = useState(null);
     const [successMessage, setSuccessMessage] = useState('');
+    const [progress, setProgress] = useState(null);
     // simplified flow; no specify-meaning modal
 
     const handleInitialSubmit = (e) => {
@@ -101,14 +130,15 @@ const AddWordPage = () => {
 
     const handleStartGeneration = async () => {
         setIsGenerating(true);
+        setProgress(null);
         try {
-            const payload = { word };
-            const data = await api.post('/api/words/generate-data', payload);
+            const data = await generateWordData(word, setProgress);
             setGeneratedData(data);
         } catch (err) {
             setError(err.message);
         } finally {
             setIsGenerating(false);
+            setProgress(null);
         }
     };
 
@@ -155,6 +185,11 @@ const AddWordPage = () => {
                         {isGenerating ? 'Generating...' : 'Next'}
                     </button>
                 </div>
+                {isGenerating && progress && (
+                    <p className="mt-3 text-gray-600 text-center">
+                        {progress.status === 'queued' ? 'Queued...' : `Generated ${progress.sections_done}/${progress.sections_total} sections...`}
+                    </p>
+                )}
                 {error && <p className="mt-3 text-red-600 text-center">{error}</p>}
                 {successMessage && <p className="mt-3 text-green-600 text-center">{successMessage}</p>}
             </form>
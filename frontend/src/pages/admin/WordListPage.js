@@ -92,21 +92,13 @@ const WordListPage = () => {
 
     const [ready, setReady] = useState(false);
 
-    // Call ghost-cleanup endpoint once on mount, then enable fetching
+    // Nudge the incremental ghost-cleanup job once on mount; the list does not wait for it
     useEffect(() => {
-        let cancelled = false;
-        const init = async () => {
-            try {
-                await api.post('/api/admin/cleanup-ghosts', {});
-            } catch (e) {
-                // Swallow errors; do not block page
-                console.warn('Cleanup ghosts failed:', e?.message || e);
-            } finally {
-                if (!cancelled) setReady(true);
-            }
-        };
-        init();
-        return () => { cancelled = true; };
+        api.post('/api/admin/cleanup-ghosts', {}).catch((e) => {
+            // Swallow errors; do not block page
+            console.warn('Cleanup ghosts failed:', e?.message || e);
+        });
+        setReady(true);
     }, []);
 
     useEffect(() => {